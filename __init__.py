@@ -1,5 +1,4 @@
-from commonapi_tools import fidl_parser
-from commonapi_tools import commonapi_types
+import importlib
 
 __all__ = [ 'fidl_parser', 'commonapi_types' ]
 
@@ -11,3 +10,13 @@ __maintainer__ = "Denis Kotov"
 __email__ = "redradist@gmail.com"
 __status__ = "Production"
 
+
+def __getattr__(name):
+    """
+    Submodules are imported on the first access (PEP 562), so importing of package costs nothing
+    :param name: Name of submodule
+    :return: Submodule
+    """
+    if name in __all__:
+        return importlib.import_module("." + name, __name__)
+    raise AttributeError("module " + repr(__name__) + " has no attribute " + repr(name))
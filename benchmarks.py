@@ -0,0 +1,421 @@
+import argparse
+import gc
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from commonapi_types import Interface, Method, Parameter, Broadcast, Attribute, TypeCollection
+from fidl_parser import REGEX_ENGINE, ENGINES
+from output_writer import write_output
+from workspace import Workspace
+from wrapper_generator import get_template, render_commonapi_wrappers
+
+PHASES = ["parse", "resolve", "render", "write"]
+DEFAULT_TEMPLATES = ["CommonAPIClientDefault.hpp.jinja2", "CommonAPIServiceDefault.hpp.jinja2"]
+
+
+def build_model(num_interfaces, num_methods=20, num_parameters=3, num_broadcasts=5, num_attributes=5):
+    """
+    Build synthetic model of interfaces with the same shape as parser produces
+    :param num_interfaces: Number of interfaces
+    :param num_methods: Number of methods per interface
+    :param num_parameters: Number of in/out parameters per method and broadcast
+    :param num_broadcasts: Number of broadcasts per interface
+    :param num_attributes: Number of attributes per interface
+    :return: List of Interface
+    """
+    types = ["Int32", "UInt8", "String", "Boolean", "tStatus", "Double []"]
+    type_collection = TypeCollection("CommonTypes", None)
+    type_collection.set_package_name("org.example.common")
+    type_collection.set_major("1")
+    type_collection.set_minor("0")
+    interfaces = []
+    for i in range(num_interfaces):
+        # Names are built dynamically, like strings sliced from parsed text
+        interface_name = "Interface" + str(i)
+        interface = Interface(interface_name, None)
+        interface.set_package_name("org.example.generated")
+        interface.set_major("1")
+        interface.set_minor("0")
+        interface.type_collections = [type_collection]
+        for m in range(num_methods):
+            method = Method("method" + str(m), None)
+            method.outputs = []
+            for p in range(num_parameters):
+                method.inputs.append(Parameter(interface_name, types[p % len(types)], "in" + str(p), None))
+                method.outputs.append(Parameter(interface_name, types[(p + 1) % len(types)], "out" + str(p), None))
+            interface.methods.append(method)
+        for b in range(num_broadcasts):
+            broadcast = Broadcast("broadcast" + str(b), None)
+            broadcast.set_is_selective(b % 2 == 0)
+            for p in range(num_parameters):
+                broadcast.parameters.append(Parameter(interface_name, types[p % len(types)], "value" + str(p), None))
+            interface.broadcasts.append(broadcast)
+        for a in range(num_attributes):
+            attribute = Attribute(interface_name, types[a % len(types)], "attribute" + str(a), None)
+            attribute.set_is_readonly(a % 2 == 0)
+            interface.attributes.append(attribute)
+        interface.is_settable_attribute = any(not attribute.is_read_only for attribute in interface.attributes)
+        interfaces.append(interface)
+    return interfaces
+
+
+_dict_classes = {}
+
+
+def _dict_class_of(cls):
+    """
+    Plain class with attributes in __dict__ with the same name as model class,
+    like model classes were before they got __slots__
+    """
+    dict_class = _dict_classes.get(cls)
+    if dict_class is None:
+        dict_class = _dict_classes[cls] = type(cls.__name__, (), {})
+    return dict_class
+
+
+def _slots_of(value):
+    """
+    Names of all slots of slotted object
+    """
+    return [name for cls in type(value).__mro__ for name in getattr(cls, "__slots__", ())]
+
+
+def to_dict_model(value, copy_strings=False, copies=None):
+    """
+    Copy model into dict-backed objects, like model classes were before they got __slots__.
+    Objects shared in model, for example TypeCollection, stay shared
+    :param value: Model object, list of them or attribute value
+    :param copy_strings: If True, every occurrence of string gets its own copy, like strings sliced
+                         from parsed text before they were interned, otherwise strings are shared with model
+    :param copies: Dictionary id of model object -> its copy, it is used internally
+    :return: Copy of value
+    """
+    if copies is None:
+        copies = {}
+    if isinstance(value, str):
+        # Concatenation gives new object, so equal strings are not shared
+        return (value + ".")[:-1] if copy_strings else value
+    if isinstance(value, list):
+        return [to_dict_model(item, copy_strings, copies) for item in value]
+    if isinstance(value, tuple):
+        return tuple(to_dict_model(item, copy_strings, copies) for item in value)
+    if isinstance(value, dict):
+        return {to_dict_model(key, copy_strings, copies): to_dict_model(item, copy_strings, copies)
+                for key, item in value.items()}
+    if not _slots_of(value):
+        return value
+    copy = copies.get(id(value))
+    if copy is None:
+        copy = copies[id(value)] = _dict_class_of(type(value))()
+        for name in _slots_of(value):
+            if hasattr(value, name):
+                setattr(copy, name, to_dict_model(getattr(value, name), copy_strings, copies))
+    return copy
+
+
+def _measure_memory(build):
+    """
+    Measure memory held by object built by function build
+    :return: Tuple (current, peak) memory in bytes
+    """
+    gc.collect()
+    tracemalloc.start()
+    built = build()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del built
+    return current, peak
+
+
+def benchmark_model_memory(num_interfaces):
+    """
+    Measure memory held by model of num_interfaces interfaces and, as baselines, by the same model
+    with dict-backed objects: with strings shared with model and with own copy of every string
+    :param num_interfaces: Number of interfaces
+    :return: Dictionary with current and peak memory in bytes of model ('current', 'peak'),
+             of dict-backed model ('dict_current', 'dict_peak') and of dict-backed model
+             with not interned strings ('uninterned_current', 'uninterned_peak')
+    """
+    result = {"interfaces": num_interfaces}
+    result["current"], result["peak"] = _measure_memory(lambda: build_model(num_interfaces))
+    # Slotted model is released after copying, only strings shared with it stay in memory
+    result["dict_current"], result["dict_peak"] = \
+        _measure_memory(lambda: to_dict_model(build_model(num_interfaces)))
+    result["uninterned_current"], result["uninterned_peak"] = \
+        _measure_memory(lambda: to_dict_model(build_model(num_interfaces), copy_strings=True))
+    return result
+
+
+def _comment(prefix, comment_size, indent):
+    """
+    Build '<** **>' comment of about comment_size characters
+    :param prefix: First words of comment
+    :param comment_size: Size of comment, 0 means no comment
+    :param indent: Indentation of comment
+    :return: Comment text with trailing new line
+    """
+    if comment_size <= 0:
+        return ""
+    words = (prefix + " lorem ipsum dolor sit amet").split()
+    text = ""
+    i = 0
+    while len(text) < comment_size:
+        text += words[i % len(words)] + (" " if (i + 1) % 10 else "\n" + indent + "  ")
+        i += 1
+    return indent + "<** " + text.rstrip() + " **>\n"
+
+
+def _nested_block(nesting_depth, indent):
+    """
+    Build brace-nested contract block, parsers have to skip it
+    :param nesting_depth: Depth of nesting, 0 means no block
+    :param indent: Indentation of block
+    :return: Block text
+    """
+    if nesting_depth <= 0:
+        return ""
+    result = indent + "contract {\n"
+    for depth in range(nesting_depth):
+        result += indent + "  " * (depth + 1) + "state s" + str(depth) + " {\n"
+    for depth in reversed(range(nesting_depth)):
+        result += indent + "  " * (depth + 1) + "}\n"
+    return result + indent + "}\n"
+
+
+def generate_corpus(directory, num_files=10, num_interfaces=5, num_methods=20, num_parameters=3,
+                    import_depth=2, comment_size=80, nesting_depth=0):
+    """
+    Write deterministic synthetic corpus of fidl-files. Same arguments always give the same files
+    :param directory: Directory for fidl-files, it is created if it does not exist
+    :param num_files: Number of fidl-files with interfaces
+    :param num_interfaces: Number of interfaces per fidl-file
+    :param num_methods: Number of methods per interface
+    :param num_parameters: Number of in/out parameters per method
+    :param import_depth: Length of chain of imported fidl-files with typeCollections
+    :param comment_size: Size of '<** **>' comment of every interface, method and parameter
+    :param nesting_depth: Depth of brace-nested block in every interface
+    :return: List of fidl-files with interfaces
+    """
+    os.makedirs(directory, exist_ok=True)
+    for depth in range(import_depth):
+        name = "CommonTypes" + str(depth)
+        text = "package org.example.common\n\n"
+        if depth + 1 < import_depth:
+            text += 'import org.example.common.* from "CommonTypes' + str(depth + 1) + '.fidl"\n\n'
+        text += _comment(name, comment_size, "")
+        text += "typeCollection " + name + " {\n"
+        text += "  version { major 1 minor " + str(depth) + " }\n"
+        text += "  struct tStatus" + str(depth) + " {\n    Int32 code\n    String message\n  }\n"
+        text += "  enumeration eState" + str(depth) + " {\n    IDLE\n    BUSY = 2\n  }\n"
+        text += "  array tStatuses" + str(depth) + " of tStatus" + str(depth) + "\n"
+        text += "}\n"
+        with open(os.path.join(directory, name + ".fidl"), "w") as file:
+            file.write(text)
+    types = ["Int32", "UInt8", "String", "Boolean", "Double []", "tLocal"]
+    if import_depth:
+        types.append("tStatus0")
+        types.append("CommonTypes" + str(import_depth - 1) + ".eState" + str(import_depth - 1))
+    fidl_files = []
+    for f in range(num_files):
+        text = "package org.example.generated" + str(f) + "\n\n"
+        if import_depth:
+            text += 'import org.example.common.* from "CommonTypes0.fidl"\n\n'
+        for i in range(num_interfaces):
+            interface_name = "Service" + str(f) + "x" + str(i)
+            text += _comment(interface_name, comment_size, "")
+            text += "interface " + interface_name + " {\n"
+            text += "  version { major 1 minor " + str(i) + " }\n"
+            text += "  struct tLocal {\n    UInt32 id\n  }\n"
+            for m in range(num_methods):
+                text += _comment("method" + str(m), comment_size, "  ")
+                text += "  method method" + str(m) + (" fireAndForget" if m % 7 == 6 else "") + " {\n"
+                for direction in (["in"] if m % 7 == 6 else ["in", "out"]):
+                    text += "    " + direction + " {\n"
+                    for p in range(num_parameters):
+                        text += _comment(direction + str(p), comment_size // 4, "      ")
+                        text += "      " + types[(m + p) % len(types)] + " " + direction + str(p) + "\n"
+                    text += "    }\n"
+                text += "  }\n"
+            text += "  broadcast changed" + (" selective" if i % 2 else "") + " {\n"
+            text += "    out {\n      " + types[i % len(types)] + " value\n    }\n  }\n"
+            text += "  attribute " + types[i % len(types)] + " state readonly\n"
+            text += "  attribute UInt32 counter\n"
+            text += _nested_block(nesting_depth, "  ")
+            text += "}\n\n"
+        fidl_file = os.path.join(directory, "Services" + str(f) + ".fidl")
+        with open(fidl_file, "w") as file:
+            file.write(text)
+        fidl_files.append(fidl_file)
+    return fidl_files
+
+
+def _run_phases(fidl_files, templates, dir_to_save, engine, timings=None):
+    """
+    Parse, resolve, render and write fidl-files once
+    :param fidl_files: List of fidl-files
+    :param templates: Templates of CommonAPI Client and CommonAPI Service
+    :param dir_to_save: Directory for generated files, it should end with '/'
+    :param engine: Parser engine
+    :param timings: Optional dictionary to which time of every phase is written
+    :return: Tuple (number of interfaces, number of generated files)
+    """
+    if timings is None:
+        timings = {}
+    start = time.perf_counter()
+    workspace = Workspace(engine=engine)
+    for fidl_file in fidl_files:
+        workspace.load(fidl_file)
+    timings["parse"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    interfaces = [workspace.interfaces(fidl_file) for fidl_file in fidl_files]
+    timings["resolve"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    outputs = []
+    for file_interfaces in interfaces:
+        outputs.extend(render_commonapi_wrappers(templates, file_interfaces, dir_to_save))
+    timings["render"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for output, content in outputs:
+        write_output(output, content)
+    timings["write"] = time.perf_counter() - start
+    return sum(len(file_interfaces) for file_interfaces in interfaces), len(outputs)
+
+
+def benchmark_corpus(fidl_files, templates=None, dir_to_save=None, engine=REGEX_ENGINE, repeat=3):
+    """
+    Measure time of parse, type resolution, render and write phases and peak memory.
+    Every phase reports the best time of repeat runs, peak memory is measured in separate run,
+    so tracing does not slow down timed runs
+    :param fidl_files: List of fidl-files
+    :param templates: Templates of CommonAPI Client and CommonAPI Service, default ones if None
+    :param dir_to_save: Directory for generated files, temporary directory if None
+    :param engine: Parser engine
+    :param repeat: Number of timed runs
+    :return: Dictionary with seconds of every phase, 'total' and 'peak_memory' in bytes
+    """
+    if templates is None:
+        script_dir = os.path.dirname(os.path.abspath(__file__))
+        templates = [os.path.join(script_dir, template) for template in DEFAULT_TEMPLATES]
+    for template in templates:
+        # Templates are compiled once per process, it should not be measured as render
+        get_template(template)
+    with tempfile.TemporaryDirectory() as temp_dir:
+        dir_to_save = os.path.join(dir_to_save or temp_dir, "")
+        result = {phase: None for phase in PHASES}
+        for _ in range(repeat):
+            timings = {}
+            gc.collect()
+            num_interfaces, num_outputs = _run_phases(fidl_files, templates, dir_to_save, engine, timings)
+            for phase in PHASES:
+                if result[phase] is None or timings[phase] < result[phase]:
+                    result[phase] = timings[phase]
+        gc.collect()
+        tracemalloc.start()
+        _run_phases(fidl_files, templates, dir_to_save, engine)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    result["total"] = sum(result[phase] for phase in PHASES)
+    result["peak_memory"] = peak
+    result["engine"] = engine
+    result["files"] = len(fidl_files)
+    result["interfaces"] = num_interfaces
+    result["outputs"] = num_outputs
+    return result
+
+
+def compare_with_baseline(result, baseline, tolerance=0.25):
+    """
+    Find measurements that became worse than baseline by more than tolerance
+    :param result: Result of benchmark_corpus
+    :param baseline: Stored result of benchmark_corpus
+    :param tolerance: Allowed relative growth, 0.25 means 25%
+    :return: List of regression descriptions, empty if there are no regressions
+    """
+    regressions = []
+    for key in PHASES + ["total", "peak_memory"]:
+        if not baseline.get(key) or result.get(key) is None:
+            continue
+        ratio = result[key] / baseline[key]
+        if ratio > 1 + tolerance:
+            regressions.append(key + ": " + "{:.3g}".format(result[key]) + " vs baseline " +
+                               "{:.3g}".format(baseline[key]) + " (+" + "{:.0%}".format(ratio - 1) + ")")
+    return regressions
+
+
+def _add_corpus_arguments(parser):
+    parser.add_argument("--files", type=int, default=10, help="Number of fidl-files with interfaces")
+    parser.add_argument("--interfaces", type=int, default=5, help="Number of interfaces per fidl-file")
+    parser.add_argument("--methods", type=int, default=20, help="Number of methods per interface")
+    parser.add_argument("--parameters", type=int, default=3, help="Number of in/out parameters per method")
+    parser.add_argument("--import-depth", type=int, default=2, help="Length of chain of imported fidl-files")
+    parser.add_argument("--comment-size", type=int, default=80, help="Size of every '<** **>' comment")
+    parser.add_argument("--nesting", type=int, default=0, help="Depth of brace-nested block in every interface")
+
+
+def _generate_corpus_from(args, directory):
+    return generate_corpus(directory, args.files, args.interfaces, args.methods, args.parameters,
+                           args.import_depth, args.comment_size, args.nesting)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+    memory_parser = subparsers.add_parser("memory", help="Memory held by parsed model")
+    memory_parser.add_argument("--interfaces",
+                               type=int,
+                               default=2000,
+                               help="Number of interfaces in model")
+    corpus_parser = subparsers.add_parser("corpus", help="Write synthetic corpus of fidl-files")
+    corpus_parser.add_argument("directory", help="Directory for fidl-files")
+    _add_corpus_arguments(corpus_parser)
+    run_parser = subparsers.add_parser("run", help="Time parse, resolve, render and write of synthetic corpus")
+    _add_corpus_arguments(run_parser)
+    run_parser.add_argument("--engine", choices=ENGINES, default=REGEX_ENGINE, help="Parser engine")
+    run_parser.add_argument("--repeat", type=int, default=3, help="Number of timed runs, the best one is reported")
+    run_parser.add_argument("--save-baseline", metavar="FILE", help="Store result as baseline")
+    run_parser.add_argument("--baseline", metavar="FILE", help="Compare result with stored baseline")
+    run_parser.add_argument("--tolerance", type=float, default=0.25,
+                            help="Allowed relative growth before result is reported as regression")
+    args = parser.parse_args(argv)
+    if args.benchmark == "memory":
+        result = benchmark_model_memory(args.interfaces)
+        print("interfaces: " + str(result["interfaces"]))
+        print("current: " + str(result["current"] // 1024) + " KiB")
+        print("peak: " + str(result["peak"] // 1024) + " KiB")
+        for baseline in ["dict", "uninterned"]:
+            print(baseline + " baseline current: " + str(result[baseline + "_current"] // 1024) + " KiB")
+    elif args.benchmark == "corpus":
+        fidl_files = _generate_corpus_from(args, args.directory)
+        print("Generated " + str(len(fidl_files)) + " fidl-files in " + args.directory)
+    else:
+        with tempfile.TemporaryDirectory() as corpus_dir:
+            fidl_files = _generate_corpus_from(args, corpus_dir)
+            result = benchmark_corpus(fidl_files, engine=args.engine, repeat=args.repeat)
+        print("engine: " + result["engine"])
+        print("files: " + str(result["files"]) + ", interfaces: " + str(result["interfaces"]) +
+              ", outputs: " + str(result["outputs"]))
+        for phase in PHASES + ["total"]:
+            print(phase + ": " + "{:.3f}".format(result[phase] * 1000) + " ms")
+        print("peak: " + str(result["peak_memory"] // 1024) + " KiB")
+        if args.save_baseline:
+            with open(args.save_baseline, "w") as file:
+                json.dump(result, file, indent=2, sort_keys=True)
+        if args.baseline:
+            with open(args.baseline) as file:
+                regressions = compare_with_baseline(result, json.load(file), args.tolerance)
+            for regression in regressions:
+                print("regression: " + regression)
+            if regressions:
+                return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,6 +1,19 @@
-import re
+import hashlib
+import sys
 
-_type_regex = re.compile(r"([\.\w]+)\s*(\[\])?")
+
+_builtin_types = {
+    "Int8": "int8_t",
+    "UInt8": "uint8_t",
+    "Int16": "int16_t",
+    "UInt16": "uint16_t",
+    "Int32": "int32_t",
+    "UInt32": "uint32_t",
+    "Boolean": "bool",
+    "Double": "double",
+    "String": "std::string",
+    "ByteBuffer": "CommonAPI::ByteBuffer",
+}
 
 
 def _upper_case_first_letter(name):
@@ -9,49 +22,70 @@ def _upper_case_first_letter(name):
     :param name: String which first character will be converted to UPPER case
     :return: String with first character in UPPER case
     """
-    indices = set([0])
-    return "".join(c.upper() if i in indices else c for i, c in enumerate(name))
+    return name[:1].upper() + name[1:]
+
+
+def _intern(value):
+    """
+    Function that interns string, so equal names and types share one object
+    :param value: String or None
+    :return: Interned string or None
+    """
+    if value is None:
+        return None
+    return sys.intern(value)
+
+
+def _fingerprint_of(*parts):
+    """
+    Function that hashes fields of model node together with fingerprints of its children (Merkle-style),
+    so fingerprint of node changes if and only if something inside of it was changed
+    :param parts: Strings, numbers, None, booleans or lists of them
+    :return: Hex digest
+    """
+    return hashlib.blake2b(repr(parts).encode("utf-8"), digest_size=16).hexdigest()
+
+
+def _fingerprints_of(nodes):
+    return [node.fingerprint for node in nodes]
+
+
+def split_type(type):
+    """
+    Function that splits commonapi type to base type and array flag
+    :param type: commonapi type, for example 'Int32 []'
+    :return: Tuple (base type, is_array)
+    """
+    type = type.strip()
+    if type.endswith("[]"):
+        return type[:-2].rstrip(), True
+    return type, False
+
+
+def is_builtin_type(type):
+    """
+    Function that checks whether commonapi type is predefined (Int32, String, ...)
+    :param type: Base commonapi type
+    :return: True if type is predefined, False - otherwise
+    """
+    return type in _builtin_types
 
 
 def _cpp_type_from(type_namespace, type):
     """
-    Function that convert cpp type to commonapi type
-    :param type_namespace: Namespace of type
-    :param type: cpp type
-    :return: commonapi type
+    Function that convert commonapi type to cpp type
+    :param type_namespace: Namespace in which user type is declared (interface or typeCollection name),
+                           None for predefined, qualified or unknown types
+    :param type: commonapi type
+    :return: cpp type
     """
-    is_array = False
-    real_type = None
-    matchs = _type_regex.findall(type)
-    if matchs:
-        if matchs[0]:
-            if matchs[0][0]:
-                real_type = matchs[0][0]
-            if matchs[0][1]:
-                is_array = True
-    real_type = real_type.replace(".", "::")
-    if real_type == "Int8":
-        real_type = "int8_t"
-    elif real_type == "UInt8":
-        real_type = "uint8_t"
-    elif real_type == "Int16":
-        real_type = "int16_t"
-    elif real_type == "UInt16":
-        real_type = "uint16_t"
-    elif real_type == "Int32":
-        real_type = "int32_t"
-    elif real_type == "UInt32":
-        real_type = "uint32_t"
-    elif real_type == "Boolean":
-        real_type = "bool"
-    elif real_type == "Double":
-        real_type = "double"
-    elif real_type == "String":
-        real_type = "std::string"
-    elif real_type == "ByteBuffer":
-        real_type = "CommonAPI::ByteBuffer"
-    elif type_namespace and len(real_type) > 0 and real_type[0] == 't':
-        real_type = type_namespace + "::" + real_type
+    real_type, is_array = split_type(type)
+    if real_type in _builtin_types:
+        real_type = _builtin_types[real_type]
+    else:
+        real_type = real_type.replace(".", "::")
+        if type_namespace:
+            real_type = type_namespace + "::" + real_type
     if is_array:
         return 'std::vector<' + real_type + '>'
     else:
@@ -62,12 +96,26 @@ class Parameter:
     """
     Class for collecting information regarding the parameter meta-information
     """
+    __slots__ = ("type_namespace", "fidl_type", "type", "name", "description")
+
     def __init__(self, type_namespace, type, name, description):
-        self.type_namespace = type_namespace
-        self.type = _cpp_type_from(self.type_namespace, type)
-        self.name = name
+        self.type_namespace = _intern(type_namespace)
+        self.fidl_type = _intern(type)
+        # User types get their namespace when SymbolTable resolves them
+        self.type = _intern(_cpp_type_from(None, type))
+        self.name = _intern(name)
         self.description = description
 
+    @property
+    def fingerprint(self):
+        """
+        Stable fingerprint of content of parameter, resolved cpp type is included,
+        commonapi type is normalized, so 'Int32 []' and 'Int32[]' have the same fingerprint
+        :return: Hex digest
+        """
+        return _fingerprint_of("Parameter", self.type_namespace, split_type(self.fidl_type), self.type, self.name,
+                               self.description)
+
     def __repr__(self):
         """
         Detail string representation of Parameter class
@@ -90,17 +138,21 @@ class Attribute(Parameter):
     """
     Class for collecting information regarding the attribute meta-information
     """
+    __slots__ = ("is_read_only", "upper_name", "lower_name")
+
     def __init__(self, type_namespace,  type, name, description):
         Parameter.__init__(self, type_namespace, type, name, description)
-        self.name = _upper_case_first_letter(self.name)
+        self.name = _intern(_upper_case_first_letter(self.name))
+        self.upper_name = _intern(self.name.upper())
+        self.lower_name = _intern(self.name.lower())
         self.is_read_only = False
         self.description = description
 
     def upper(self):
-        return str(self).upper()
+        return self.upper_name
 
     def lower(self):
-        return str(self).lower()
+        return self.lower_name
 
     def set_is_readonly(self, is_read_only):
         """
@@ -110,6 +162,15 @@ class Attribute(Parameter):
         """
         self.is_read_only = is_read_only
 
+    @property
+    def fingerprint(self):
+        """
+        Stable fingerprint of content of attribute
+        :return: Hex digest
+        """
+        return _fingerprint_of("Attribute", self.type_namespace, split_type(self.fidl_type), self.type, self.name,
+                               self.description, self.is_read_only)
+
     def __repr__(self):
         """
         Detail string representation of Attribute class
@@ -132,17 +193,21 @@ class Broadcast:
     """
     Class for collecting information regarding the broadcast meta-information
     """
+    __slots__ = ("name", "upper_name", "lower_name", "parameters", "description", "is_selective")
+
     def __init__(self, name, description):
-        self.name = _upper_case_first_letter(name)
+        self.name = _intern(_upper_case_first_letter(name))
+        self.upper_name = _intern(self.name.upper())
+        self.lower_name = _intern(self.name.lower())
         self.parameters = []
         self.description = description
         self.is_selective = None
 
     def upper(self):
-        return str(self).upper()
+        return self.upper_name
 
     def lower(self):
-        return str(self).lower()
+        return self.lower_name
 
     def set_is_selective(self, is_selective):
         """
@@ -152,6 +217,15 @@ class Broadcast:
         """
         self.is_selective = is_selective
 
+    @property
+    def fingerprint(self):
+        """
+        Stable fingerprint of content of broadcast over fingerprints of its parameters
+        :return: Hex digest
+        """
+        return _fingerprint_of("Broadcast", self.name, self.description, self.is_selective,
+                               _fingerprints_of(self.parameters))
+
     def __repr__(self):
         """
         Detail string representation of Broadcast class
@@ -176,12 +250,24 @@ class Method:
     """
     Class for collecting information regarding the method meta-information
     """
+    __slots__ = ("name", "capitalized_name", "inputs", "outputs", "description")
+
     def __init__(self, name, description):
-        self.name = name
+        self.name = _intern(name)
+        self.capitalized_name = _intern(_upper_case_first_letter(name))
         self.inputs = []
         self.outputs = None
         self.description = description
 
+    @property
+    def fingerprint(self):
+        """
+        Stable fingerprint of content of method over fingerprints of its in/out arguments
+        :return: Hex digest
+        """
+        return _fingerprint_of("Method", self.name, self.description, _fingerprints_of(self.inputs),
+                               None if self.outputs is None else _fingerprints_of(self.outputs))
+
     def __repr__(self):
         """
         Detail string representation of Method class
@@ -202,24 +288,84 @@ class Method:
         String representation of Method class
         :return: Method name
         """
-        return _upper_case_first_letter(self.name)
+        return self.capitalized_name
+
+
+class TypeDeclaration:
+    """
+    Class for collecting information regarding the user type meta-information:
+    struct, union, enumeration, map, array or typedef
+    """
+    __slots__ = ("kind", "name", "description", "extends", "fields", "enumerators")
+
+    def __init__(self, kind, name, description):
+        self.kind = _intern(kind)
+        self.name = _intern(name)
+        self.description = description
+        self.extends = None
+        # struct/union: fields, array: 'element', typedef: 'type', map: 'key' and 'value'
+        self.fields = []
+        self.enumerators = []
+
+    def set_extends(self, extends):
+        """
+        Set base type of struct or enumeration
+        :param extends: Base type
+        :return: None
+        """
+        self.extends = _intern(extends)
+
+    @property
+    def fingerprint(self):
+        """
+        Stable fingerprint of content of user type over fingerprints of its fields
+        :return: Hex digest
+        """
+        return _fingerprint_of("TypeDeclaration", self.kind, self.name, self.description, self.extends,
+                               _fingerprints_of(self.fields), self.enumerators)
+
+    def __repr__(self):
+        """
+        Detail string representation of TypeDeclaration class
+        :return: Detail string representation
+        """
+        result = ""
+        result += "TypeDeclaration kind: " + str(self.kind) + "\n"
+        result += "TypeDeclaration name: " + str(self.name) + "\n"
+        for field in self.fields:
+            result += str(field) + "\n"
+        for enumerator in self.enumerators:
+            result += str(enumerator) + "\n"
+        return result
+
+    def __str__(self):
+        """
+        String representation of TypeDeclaration class
+        :return: TypeDeclaration name
+        """
+        return self.name
 
 
 class Interface:
     """
     Class for collecting information regarding the interface meta-information
     """
+    __slots__ = ("package_name", "major", "minor", "description", "name", "type_collections",
+                 "methods", "broadcasts", "is_settable_attribute", "attributes", "types", "_fingerprint")
+
     def __init__(self, name, description):
         self.package_name = None
         self.major = None
         self.minor = None
         self.description = description
-        self.name = name
+        self.name = _intern(name)
         self.type_collections = []
         self.methods = []
         self.broadcasts = []
         self.is_settable_attribute = False
         self.attributes = []
+        self.types = []
+        self._fingerprint = None
 
     def set_package_name(self, package_name):
         """
@@ -227,7 +373,8 @@ class Interface:
         :param package_name: Package name
         :return: None
         """
-        self.package_name = package_name
+        self.package_name = _intern(package_name)
+        self._fingerprint = None
 
     def set_major(self, major):
         """
@@ -235,7 +382,7 @@ class Interface:
         :param major: Major version
         :return: None
         """
-        self.major = major
+        self.major = _intern(major)
 
     def set_minor(self, minor):
         """
@@ -243,7 +390,33 @@ class Interface:
         :param minor: Minor version
         :return: None
         """
-        self.minor = minor
+        self.minor = _intern(minor)
+
+    @property
+    def fingerprint(self):
+        """
+        Stable fingerprint of content of interface over fingerprints of its members
+        and of typeCollections visible from it, it is equal for equal interfaces parsed by any engine.
+        It is computed on the first access and kept until interface is resolved again, see forget_fingerprint
+        :return: Hex digest
+        """
+        if self._fingerprint is None:
+            fingerprint = _fingerprint_of("Interface", self.package_name, self.name, self.major, self.minor,
+                                          self.description, self.is_settable_attribute,
+                                          _fingerprints_of(self.methods),
+                                          _fingerprints_of(self.broadcasts),
+                                          _fingerprints_of(self.attributes),
+                                          _fingerprints_of(self.types),
+                                          _fingerprints_of(self.type_collections))
+            self._fingerprint = fingerprint
+        return self._fingerprint
+
+    def forget_fingerprint(self):
+        """
+        Compute fingerprint again on the next access, it is needed when members or their types were changed
+        :return: None
+        """
+        self._fingerprint = None
 
     def __repr__(self):
         """
@@ -269,17 +442,111 @@ class Interface:
         return self.name
 
 
+def _lazy_member(name):
+    """
+    Property that loads LazyInterface before the first read of member stored in slot of Interface
+    :param name: Name of slot of Interface
+    :return: property
+    """
+    slot = Interface.__dict__[name]
+
+    def get(self):
+        if self._loader is not None:
+            self.load()
+        return slot.__get__(self, Interface)
+
+    def set(self, value):
+        slot.__set__(self, value)
+    return property(get, set)
+
+
+class LazyInterface(Interface):
+    """
+    Interface which methods, broadcasts, attributes and types are parsed on the first access
+    from retained span of interface body. Name, package and version are available without parsing
+    """
+    __slots__ = ("_loader", "_hooks")
+
+    methods = _lazy_member("methods")
+    broadcasts = _lazy_member("broadcasts")
+    attributes = _lazy_member("attributes")
+    types = _lazy_member("types")
+    is_settable_attribute = _lazy_member("is_settable_attribute")
+
+    def __init__(self, name, description, loader):
+        self._loader = None
+        self._hooks = []
+        Interface.__init__(self, name, description)
+        self._loader = loader
+
+    @property
+    def is_loaded(self):
+        return self._loader is None
+
+    def load(self):
+        """
+        Parse members of interface, it is done only once
+        :return: None
+        """
+        loader = self._loader
+        if loader is None:
+            return
+        self._loader = None
+        loader(self)
+        hooks = self._hooks
+        self._hooks = []
+        for hook in hooks:
+            hook(self)
+
+    def after_load(self, hook):
+        """
+        Call hook when members are parsed, immediately if they are already parsed
+        :param hook: Callable (interface) -> None
+        :return: None
+        """
+        if self._loader is None:
+            hook(self)
+        else:
+            self._hooks.append(hook)
+
+    def load_from(self, interface):
+        """
+        Take members of eagerly parsed interface
+        :param interface: Interface parsed from the same span
+        :return: None
+        """
+        self.methods = interface.methods
+        self.broadcasts = interface.broadcasts
+        self.attributes = interface.attributes
+        self.types = interface.types
+        self.is_settable_attribute = interface.is_settable_attribute
+
+    def __getstate__(self):
+        """
+        Lazy interface is pickled with parsed members, loader is not pickled
+        :return: State of slots
+        """
+        self.load()
+        state = {name: getattr(self, name) for name in Interface.__slots__}
+        state["_loader"] = None
+        state["_hooks"] = []
+        return None, state
+
+
 class TypeCollection:
     """
     Class for collecting information regarding the typeCollection meta-information
     """
+    __slots__ = ("package_name", "major", "minor", "description", "name", "types", "type", "path", "_fingerprint")
+
     def __init__(self, name, description):
         self.package_name = None
         self.major = None
         self.minor = None
         self.description = description
-        self.name = name
+        self.name = _intern(name)
         self.types = []
+        self._fingerprint = None
 
     def set_package_name(self, package_name):
         """
@@ -287,7 +554,8 @@ class TypeCollection:
         :param package_name: Package name
         :return: None
         """
-        self.package_name = package_name
+        self.package_name = _intern(package_name)
+        self._fingerprint = None
         if self.package_name:
             self.type = self.package_name.replace(".", "::") + "::" + self.name
             self.path = self.package_name.replace(".", "/") + "/" + self.name
@@ -298,7 +566,7 @@ class TypeCollection:
         :param major: Major version
         :return: None
         """
-        self.major = major
+        self.major = _intern(major)
 
     def set_minor(self, minor):
         """
@@ -306,7 +574,26 @@ class TypeCollection:
         :param minor: Minor version
         :return: None
         """
-        self.minor = minor
+        self.minor = _intern(minor)
+
+    @property
+    def fingerprint(self):
+        """
+        Stable fingerprint of content of typeCollection over fingerprints of its types,
+        it is computed once for all interfaces which see typeCollection, see Interface.fingerprint
+        :return: Hex digest
+        """
+        if self._fingerprint is None:
+            self._fingerprint = _fingerprint_of("TypeCollection", self.package_name, self.name, self.major,
+                                                self.minor, self.description, _fingerprints_of(self.types))
+        return self._fingerprint
+
+    def forget_fingerprint(self):
+        """
+        Compute fingerprint again on the next access, it is needed when types were changed
+        :return: None
+        """
+        self._fingerprint = None
 
     def __repr__(self):
         """
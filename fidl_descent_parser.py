@@ -0,0 +1,463 @@
+import hashlib
+
+from commonapi_types import Interface, LazyInterface, Method, Parameter, Broadcast, Attribute, TypeCollection, \
+    TypeDeclaration
+from fidl_tokenizer import tokenize, parse_budget, check_deadline, FidlParseError, NAME, STRING, DOC, PUNCT
+import run_stats
+
+_attribute_flags = frozenset(["readonly", "noSubscriptions", "noRead"])
+_type_kinds = frozenset(["struct", "union", "enumeration", "map", "array", "typedef"])
+# Time budget is checked once per this number of tokens
+_steps_per_deadline_check = 1024
+
+
+class FidlDocument:
+    """
+    Class for collecting everything that was found in one fidl-file
+    """
+    def __init__(self, fidl_file):
+        self.fidl_file = fidl_file
+        self.package_name = None
+        self.imports_from = []
+        self.imports_model = []
+        self.interfaces = []
+        self.type_collections = []
+        # Hash of text of every interface and typeCollection -> parsed node, see span_hash
+        self.span_hashes = {}
+
+    @property
+    def imports(self):
+        """
+        Imported fidl-files in the same order as regex parser handles them
+        :return: List of imported fidl-files
+        """
+        return self.imports_from + self.imports_model
+
+    def __repr__(self):
+        """
+        Detail string representation of FidlDocument class
+        :return: Detail string representation
+        """
+        result = ""
+        result += "FidlDocument file: " + str(self.fidl_file) + "\n"
+        result += "FidlDocument package: " + str(self.package_name) + "\n"
+        for interface in self.interfaces:
+            result += str(interface) + "\n"
+        for type_collection in self.type_collections:
+            result += str(type_collection) + "\n"
+        return result
+
+
+def span_hash(text, start, end, description):
+    """
+    Hash of declaration text together with its '<** **>' comment,
+    declarations with equal hash are parsed to equal nodes
+    :param text: Text of fidl-file
+    :param start: Start offset of declaration
+    :param end: End offset of declaration
+    :param description: Comment attached to declaration
+    :return: Hex digest
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update((description or "").encode("utf-8"))
+    digest.update(b"\0")
+    digest.update(text[start:end].encode("utf-8"))
+    return digest.hexdigest()
+
+
+class FidlDescentParser:
+    """
+    Recursive-descent parser of fidl-file.
+    It works on top of single-pass tokenizer and does not backtrack,
+    so parsing time is linear in the size of the input
+    """
+    def __init__(self, text, fidl_file=None, pos=0, endpos=None, lazy=False, reuse=None):
+        self.text = text
+        self.fidl_file = fidl_file
+        self.lazy = lazy
+        # Span hash -> node of previous version of document, see span_hash
+        self.reuse = reuse or {}
+        self._end = pos
+        self._tokens = tokenize(text, pos, endpos, fidl_file=fidl_file)
+        self._current = None
+        self._doc = None
+        self._steps = 0
+        self._advance()
+
+    def _advance(self):
+        """
+        Move to the next token, remembering '<** **>' comment that precedes it
+        :return: None
+        """
+        self._steps += 1
+        if self._steps % _steps_per_deadline_check == 0 and self._current is not None:
+            check_deadline(self.text, self._current.start, self.fidl_file)
+        doc = None
+        for token in self._tokens:
+            if token.kind == DOC:
+                doc = token.value
+                continue
+            self._current = token
+            self._doc = doc
+            return
+        self._current = None
+        self._doc = doc
+
+    def _error(self, message):
+        """
+        Create error pointing to the current token
+        :param message: Description of error
+        :return: FidlParseError
+        """
+        offset = self._current.start if self._current is not None else len(self.text)
+        return FidlParseError.at(message, self.text, offset, self.fidl_file)
+
+    def _next(self):
+        """
+        Consume the current token
+        :return: Consumed token
+        """
+        token = self._current
+        if token is None:
+            raise self._error("Unexpected end of file")
+        self._end = token.end
+        self._advance()
+        return token
+
+    def _is(self, kind, value=None):
+        token = self._current
+        return token is not None and token.kind == kind and (value is None or token.value == value)
+
+    def _accept(self, kind, value=None):
+        if self._is(kind, value):
+            return self._next()
+        return None
+
+    def _expect(self, kind, value=None):
+        if not self._is(kind, value):
+            expected = "'" + value + "'" if value else kind
+            found = "'" + self._current.value + "'" if self._current is not None else "end of file"
+            raise self._error("Expected " + expected + ", but found " + found)
+        return self._next()
+
+    def _skip_until_body(self):
+        """
+        Skip tokens until '{' that opens body of declaration
+        :return: Names of skipped tokens
+        """
+        skipped = []
+        while not self._is(PUNCT, "{"):
+            skipped.append(self._next().value)
+        self._next()
+        return skipped
+
+    def _skip_block(self):
+        """
+        Skip brace-balanced block
+        :return: None
+        """
+        self._expect(PUNCT, "{")
+        depth = 1
+        while depth:
+            token = self._next()
+            if token.kind == PUNCT:
+                if token.value == "{":
+                    depth += 1
+                elif token.value == "}":
+                    depth -= 1
+
+    def parse(self):
+        """
+        This following function is parsing whole fidl-file
+        :return: FidlDocument
+        """
+        document = FidlDocument(self.fidl_file)
+        while self._current is not None:
+            if self._is(NAME, "package"):
+                self._next()
+                document.package_name = self._expect(NAME).value
+            elif self._is(NAME, "import"):
+                self._parse_import(document)
+            elif self._is(NAME, "interface"):
+                description = self._doc
+                start = self._current.start
+                if self.lazy or self.reuse:
+                    # Body is only skipped, so unchanged interface is not parsed at all
+                    interface = self._parse_lazy_interface()
+                else:
+                    interface = self._parse_interface()
+                key = span_hash(self.text, start, self._end, description)
+                if key in self.reuse:
+                    interface = self.reuse[key]
+                elif not self.lazy and isinstance(interface, LazyInterface):
+                    interface.load()
+                document.span_hashes[key] = interface
+                document.interfaces.append(interface)
+            elif self._is(NAME, "typeCollection"):
+                description = self._doc
+                start = self._current.start
+                type_collection = self._parse_type_collection()
+                if type_collection:
+                    key = span_hash(self.text, start, self._end, description)
+                    type_collection = self.reuse.get(key, type_collection)
+                    document.span_hashes[key] = type_collection
+                    document.type_collections.append(type_collection)
+            elif self._is(PUNCT, "{"):
+                self._skip_block()
+            elif self._is(PUNCT, "}"):
+                raise self._error("Unexpected '}'")
+            else:
+                self._next()
+        for interface in document.interfaces:
+            interface.set_package_name(document.package_name)
+        for type_collection in document.type_collections:
+            type_collection.set_package_name(document.package_name)
+        return document
+
+    def _parse_import(self, document):
+        self._next()
+        if self._accept(NAME, "model"):
+            document.imports_model.append(self._expect(STRING).value)
+        else:
+            while not self._accept(NAME, "from"):
+                self._next()
+            document.imports_from.append(self._expect(STRING).value)
+
+    def _parse_version(self):
+        """
+        This following function is parsing 'version { major N minor M }'
+        :return: Tuple (major, minor)
+        """
+        self._next()
+        self._expect(PUNCT, "{")
+        major = None
+        minor = None
+        while not self._accept(PUNCT, "}"):
+            if self._accept(NAME, "major"):
+                major = self._expect(NAME).value
+            elif self._accept(NAME, "minor"):
+                minor = self._expect(NAME).value
+            else:
+                self._next()
+        return major, minor
+
+    def _parse_type_collection(self):
+        description = self._doc
+        self._next()
+        name = self._accept(NAME)
+        self._skip_until_body()
+        type_collection = TypeCollection(name.value, description) if name else None
+        while not self._accept(PUNCT, "}"):
+            if self._is(NAME, "version"):
+                major, minor = self._parse_version()
+                if type_collection and type_collection.major is None:
+                    type_collection.set_major(major)
+                    type_collection.set_minor(minor)
+            elif self._is(NAME) and self._current.value in _type_kinds:
+                declaration = self._parse_type_declaration(name.value if name else None)
+                if type_collection:
+                    type_collection.types.append(declaration)
+            elif self._is(PUNCT, "{"):
+                self._skip_block()
+            else:
+                self._next()
+        return type_collection
+
+    def _parse_interface(self):
+        description = self._doc
+        self._next()
+        name = self._expect(NAME).value
+        interface = Interface(name, description)
+        self._skip_until_body()
+        while not self._accept(PUNCT, "}"):
+            if self._is(NAME, "version"):
+                major, minor = self._parse_version()
+                if interface.major is None:
+                    interface.set_major(major)
+                    interface.set_minor(minor)
+            elif self._is(NAME, "method"):
+                interface.methods.append(self._parse_method(name))
+            elif self._is(NAME, "broadcast"):
+                interface.broadcasts.append(self._parse_broadcast(name))
+            elif self._is(NAME, "attribute"):
+                interface.attributes.append(self._parse_attribute(name))
+            elif self._is(NAME) and self._current.value in _type_kinds:
+                interface.types.append(self._parse_type_declaration(name))
+            elif self._is(PUNCT, "{"):
+                self._skip_block()
+            else:
+                self._next()
+        interface.is_settable_attribute = \
+            any(not attribute.is_read_only for attribute in interface.attributes)
+        return interface
+
+    def _parse_lazy_interface(self):
+        """
+        This following function is parsing only name and version of interface,
+        the rest of body is skipped and parsed on the first access to members
+        :return: LazyInterface
+        """
+        description = self._doc
+        start = self._next().start
+        name = self._expect(NAME).value
+        major = None
+        minor = None
+        self._skip_until_body()
+        while True:
+            closing = self._accept(PUNCT, "}")
+            if closing:
+                break
+            if self._is(NAME, "version"):
+                version = self._parse_version()
+                if major is None:
+                    major, minor = version
+            elif self._is(PUNCT, "{"):
+                self._skip_block()
+            else:
+                self._next()
+        interface = LazyInterface(name, description, _interface_loader(self.text, self.fidl_file, start, closing.end))
+        interface.set_major(major)
+        interface.set_minor(minor)
+        return interface
+
+    def _parse_parameters(self, type_namespace):
+        """
+        This following function is parsing '{ Type name ... }' of in/out arguments
+        :param type_namespace: Namespace of user types
+        :return: List of Parameter
+        """
+        self._expect(PUNCT, "{")
+        parameters = []
+        while not self._accept(PUNCT, "}"):
+            description = self._doc
+            parameter_type = self._parse_type()
+            parameter_name = self._expect(NAME).value
+            parameters.append(Parameter(type_namespace, parameter_type, parameter_name, description))
+        return parameters
+
+    def _parse_type(self):
+        parameter_type = self._expect(NAME).value
+        if self._accept(PUNCT, "["):
+            self._expect(PUNCT, "]")
+            parameter_type += "[]"
+        return parameter_type
+
+    def _parse_type_declaration(self, type_namespace):
+        """
+        This following function is parsing struct, union, enumeration, map, array or typedef
+        :param type_namespace: Name of interface or typeCollection in which type is declared
+        :return: TypeDeclaration
+        """
+        description = self._doc
+        kind = self._next().value
+        declaration = TypeDeclaration(kind, self._expect(NAME).value, description)
+        if kind == "array":
+            self._expect(NAME, "of")
+            declaration.fields.append(Parameter(type_namespace, self._parse_type(), "element", None))
+            return declaration
+        if kind == "typedef":
+            self._expect(NAME, "is")
+            declaration.fields.append(Parameter(type_namespace, self._parse_type(), "type", None))
+            return declaration
+        header = self._skip_until_body()
+        if "extends" in header[:-1]:
+            declaration.set_extends(header[header.index("extends") + 1])
+        if kind == "map":
+            declaration.fields.append(Parameter(type_namespace, self._parse_type(), "key", None))
+            self._expect(NAME, "to")
+            declaration.fields.append(Parameter(type_namespace, self._parse_type(), "value", None))
+            self._expect(PUNCT, "}")
+        elif kind == "enumeration":
+            while not self._accept(PUNCT, "}"):
+                if self._is(NAME):
+                    declaration.enumerators.append(self._next().value)
+                    if self._accept(PUNCT, "="):
+                        self._accept(PUNCT, "-")
+                        self._next()
+                else:
+                    self._next()
+        else:
+            while not self._accept(PUNCT, "}"):
+                description = self._doc
+                field_type = self._parse_type()
+                field_name = self._expect(NAME).value
+                declaration.fields.append(Parameter(type_namespace, field_type, field_name, description))
+        return declaration
+
+    def _parse_method(self, interface_name):
+        description = self._doc
+        self._next()
+        method = Method(self._expect(NAME).value, description)
+        if "fireAndForget" not in self._skip_until_body():
+            method.outputs = []
+        while not self._accept(PUNCT, "}"):
+            if self._is(NAME, "in"):
+                self._next()
+                method.inputs.extend(self._parse_parameters(interface_name))
+            elif self._is(NAME, "out"):
+                self._next()
+                parameters = self._parse_parameters(interface_name)
+                if method.outputs is not None:
+                    method.outputs.extend(parameters)
+            elif self._is(PUNCT, "{"):
+                self._skip_block()
+            else:
+                self._next()
+        return method
+
+    def _parse_broadcast(self, interface_name):
+        description = self._doc
+        self._next()
+        broadcast = Broadcast(self._expect(NAME).value, description)
+        broadcast.set_is_selective("selective" in self._skip_until_body())
+        while not self._accept(PUNCT, "}"):
+            if self._is(NAME, "out"):
+                self._next()
+                broadcast.parameters.extend(self._parse_parameters(interface_name))
+            elif self._is(PUNCT, "{"):
+                self._skip_block()
+            else:
+                self._next()
+        return broadcast
+
+    def _parse_attribute(self, interface_name):
+        description = self._doc
+        self._next()
+        attribute_type = self._parse_type()
+        attribute = Attribute(interface_name, attribute_type, self._expect(NAME).value, description)
+        is_read_only = False
+        while self._current is not None and self._current.kind == NAME \
+                and self._current.value in _attribute_flags:
+            if self._next().value == "readonly":
+                is_read_only = True
+        attribute.set_is_readonly(is_read_only)
+        return attribute
+
+
+def _interface_loader(text, fidl_file, start, end):
+    """
+    Create loader of LazyInterface which parses text[start:end] on the first access to members
+    :param text: Text of fidl-file
+    :param fidl_file: Name of fidl-file used in error messages
+    :param start: Offset of 'interface' keyword
+    :param end: Offset after closing '}' of interface
+    :return: Callable (interface) -> None
+    """
+    def load(interface):
+        with run_stats.phase("load_interface"), parse_budget():
+            interface.load_from(FidlDescentParser(text, fidl_file, start, end)._parse_interface())
+    return load
+
+
+def parse_fidl_text(text, fidl_file=None, lazy=False, reuse=None):
+    """
+    This following function is parsing text of fidl-file with recursive-descent parser
+    :param text: Text of fidl-file
+    :param fidl_file: Name of fidl-file used in error messages
+    :param lazy: If True, members of interfaces are parsed on the first access
+    :param reuse: Optional span_hashes of previous version of document, its unchanged
+                  interfaces and typeCollections are taken instead of being parsed
+    :return: FidlDocument
+    """
+    with parse_budget():
+        return FidlDescentParser(text, fidl_file, lazy=lazy, reuse=reuse).parse()
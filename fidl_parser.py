@@ -1,56 +1,130 @@
 import argparse
-import datetime
-import regex as re
-import itertools
+import os
+from bisect import bisect_right
+from collections import namedtuple
+from contextlib import contextmanager
+from functools import partial
+
+from commonapi_types import Interface, LazyInterface, Method, Parameter, Broadcast, Attribute, TypeCollection, TypeDeclaration
+from fidl_descent_parser import parse_fidl_text, span_hash, FidlDocument
+from fidl_tokenizer import tokenize, parse_budget, remaining_time, check_deadline, timeout_error, \
+    FidlParseError, FidlParseTimeout, NAME, STRING, DOC, PUNCT
+from fidl_source import read_fidl_file, read_fidl_source, source_name, STDIN
+from symbol_table import SymbolTable
+from model_ir import dump_ir, IR_FORMATS
+import run_stats
+
+REGEX_ENGINE = "regex"
+DESCENT_ENGINE = "descent"
+ENGINES = (REGEX_ENGINE, DESCENT_ENGINE)
+
+
+class _LazyPattern:
+    """
+    Regular expression that is compiled on the first use, so neither regex module is imported
+    nor patterns are compiled when fidl_parser is imported, for example for listing of outputs.
+    Matching is bounded by time budget of parsed fidl-file, see fidl_tokenizer.parse_budget
+    """
+    def __init__(self, pattern):
+        self.pattern = pattern
+
+    def __getattr__(self, name):
+        import regex
+        compiled = self.compiled = regex.compile(self.pattern)
+        return compiled if name == "compiled" else getattr(compiled, name)
+
+    def match(self, string, pos=0, endpos=None):
+        timeout = remaining_time()
+        if timeout is None:
+            return self.compiled.match(string, pos, endpos)
+        try:
+            return self.compiled.match(string, pos, endpos, timeout=max(timeout, 0))
+        except TimeoutError:
+            raise timeout_error(string, pos)
+
+    def search(self, string, pos=0, endpos=None):
+        timeout = remaining_time()
+        if timeout is None:
+            return self.compiled.search(string, pos, endpos)
+        try:
+            return self.compiled.search(string, pos, endpos, timeout=max(timeout, 0))
+        except TimeoutError:
+            raise timeout_error(string, pos)
+
+    def finditer(self, string, pos=0, endpos=None):
+        timeout = remaining_time()
+        if timeout is None:
+            return self.compiled.finditer(string, pos, endpos)
+        return self._finditer_in_budget(string, pos, endpos, timeout)
+
+    def _finditer_in_budget(self, string, pos, endpos, timeout):
+        # Timeout of regex bounds every match, so budget is also checked between matches
+        try:
+            for number, meta in enumerate(self.compiled.finditer(string, pos, endpos, timeout=max(timeout, 0)), 1):
+                yield meta
+                pos = meta.end()
+                if number % 64 == 0:
+                    check_deadline(string, pos)
+        except TimeoutError:
+            raise timeout_error(string, pos)
+
+
+@contextmanager
+def _parse_budget_of(fidl_file):
+    """
+    Time budget of parsing of fidl-file, error about exceeded budget gets name of fidl_file
+    :param fidl_file: Name of fidl-file
+    :return: None
+    """
+    with parse_budget():
+        try:
+            yield
+        except FidlParseTimeout as ex:
+            if ex.fidl_file is None:
+                ex.fidl_file = fidl_file
+            raise
 
-from jinja2 import Template
-from commonapi_types import Interface, Method, Parameter, Broadcast, Attribute, TypeCollection
 
 __comment_regex = r"(\<\*\*(?P<comment>(\<\*\*(*PRUNE)(*FAIL)|.|\n)*?)\*\*\>)?"
-__comment = re.compile(__comment_regex)
+__comment = _LazyPattern(__comment_regex)
 __type_regex = r"(?P<type>([\.\w]+)\s*(\[\])?)"
 __parameter_regex = __comment_regex + \
                     r"\s*((" + __type_regex + r")\s+(?P<name>\w+)\s*)\s*"
-__parameter = re.compile(__parameter_regex)
+__parameter = _LazyPattern(__parameter_regex)
+# Body without nested blocks, braces inside of comments are allowed
+__flat_body_regex = r"(?P<body>\{((?:[^{}/]++|//[^\n]*+|/\*(?:.|\n)*?\*/|/)*+)\})"
 __in_parameter_regex = r"in\s*" + \
-                       r"\s*(?P<body>\{((?:[^{}])*)\})"
-__in_parameter = re.compile(__in_parameter_regex)
+                       r"\s*" + __flat_body_regex
+__in_parameter = _LazyPattern(__in_parameter_regex)
 __out_parameter_regex = r"out\s*" + \
-                        r"\s*(?P<body>\{((?:[^{}])*)\})"
-__out_parameter = re.compile(__out_parameter_regex)
+                        r"\s*" + __flat_body_regex
+__out_parameter = _LazyPattern(__out_parameter_regex)
 __error_parameter_regex = r"\s*error\s*[\{]?\s*(?P<error_type>[\w.]+)\s*[\}]?\s*"
-__error_parameter = re.compile(__error_parameter_regex)
-__method_regex = __comment_regex + \
-                 r"\s*method\s+(?P<name>\w+)\s*(?P<is_reply>fireAndForget)?" + \
-                 r"\s*(?P<body>\{((?:[^\{\}]|(?&body))*)\})"
-__method = re.compile(__method_regex)
-__broadcast_regex = __comment_regex + \
-                    r"\s*broadcast\s+(?P<name>\w+)\s*(?P<is_selective>selective)?" + \
-                    r"\s*(?P<body>\{((?:[^\{\}]|(?&body))*)\})"
-__broadcast = re.compile(__broadcast_regex)
-__attribute_regex = __comment_regex + \
-                    r"\s*attribute\s+(" + __type_regex + r")\s+(?P<name>\w+)\s*(?P<is_readonly>readonly)?\s*\n"
-__attribute = re.compile(__attribute_regex)
-__array_regex = __comment_regex + \
-                r"\s*array\s+(?P<array_type>\w+)\s+of\s+" + __type_regex + r"\s*\n"
-__array = re.compile(__array_regex)
+__error_parameter = _LazyPattern(__error_parameter_regex)
+__method_regex = r"method\s+(?P<name>\w+)\s*(?P<is_reply>fireAndForget)?\s*"
+__method = _LazyPattern(__method_regex)
+__broadcast_regex = r"broadcast\s+(?P<name>\w+)\s*(?P<is_selective>selective)?\s*"
+__broadcast = _LazyPattern(__broadcast_regex)
+__attribute_regex = r"attribute\s+(" + __type_regex + r")\s+(?P<name>\w+)\s*(?P<is_readonly>readonly)?\s*(\n|$)"
+__attribute = _LazyPattern(__attribute_regex)
+__array_regex = r"array\s+(?P<name>\w+)\s+of\s+" + __type_regex
+__array = _LazyPattern(__array_regex)
+__typedef_regex = r"typedef\s+(?P<name>\w+)\s+is\s+" + __type_regex
+__typedef = _LazyPattern(__typedef_regex)
+__struct_regex = r"(?P<kind>struct|union|enumeration)\s+(?P<name>\w+)(\s+extends\s+(?P<extends>[\.\w]+))?"
+__struct = _LazyPattern(__struct_regex)
+__enumerator_regex = __comment_regex + \
+                     r"\s*(?P<name>\w+)(\s*=\s*[-+]?\w+)?\s*,?\s*"
+__enumerator = _LazyPattern(__enumerator_regex)
+__map_regex = r"map\s+(?P<name>\w+)\s*\{\s*(?P<key>[\.\w]+\s*(\[\])?)\s+to\s+(?P<value>[\.\w]+\s*(\[\])?)\s*\}"
+__map = _LazyPattern(__map_regex)
 __version_regex = r"version\s*" + \
                   r"{\s*major\s+(?P<major_ver>\d+)\s+minor\s+(?P<minor_ver>\d+)\s*\}\s*"
-__version = re.compile(__version_regex)
-__interface_regex = __comment_regex + \
-                    r"\s*interface\s+(?P<name>\w+)" + \
-                    r"\s*(?P<body>\{((?:[^\{\}]|(?&body))*)\})"
-__interface = re.compile(__interface_regex)
-__type_collection_regex = __comment_regex + \
-                          r"\s*typeCollection\s+(?P<name>\w+)" + \
-                          r"\s*(?P<body>\{((?:[^\{\}]|(?&body))*)\})"
-__type_collection = re.compile(__type_collection_regex)
-__import_from_regex = r"import\s+(?P<type>([\*\.\w]+))\s+from\s+\"(?P<fidl_file>([\.\w]+))\""
-__import_from = re.compile(__import_from_regex)
-__import_regex = r"import\s+model\s+\"(?P<fidl_file>([\.\w]+))\""
-__import = re.compile(__import_regex)
-__package_regex = r"package\s+(?P<name>[\.\w]+)"
-__package = re.compile(__package_regex)
+__version = _LazyPattern(__version_regex)
+__interface_regex = r"interface\s+(?P<name>\w+)"
+__interface = _LazyPattern(__interface_regex)
+__type_collection_regex = r"typeCollection\s+(?P<name>\w+)"
+__type_collection = _LazyPattern(__type_collection_regex)
 
 __test_fidl = """
 package commonapi
@@ -166,199 +240,736 @@ typeCollection MyTypes
 """
 
 
-def parse_type_collections(fidl_file, handled_files=None):
+BlockSpan = namedtuple("BlockSpan", ["kind", "start", "end", "body_start", "body_end",
+                                     "comment_start", "comment_end"])
+
+_type_kinds = frozenset(["struct", "union", "enumeration", "map", "array", "typedef"])
+_bodyless_kinds = frozenset(["attribute", "array", "typedef"])
+_block_kinds = frozenset(["method", "broadcast", "attribute", "version"]) | _type_kinds
+
+
+class InterfaceBlockIndex:
     """
-    This following function is parsing fidl-file
-    :param fidl_file: File to parse
-    :param handled_files: Number of handled files with types
-    :return: Raw type_collections
+    Class for collecting spans of top-level blocks of interface or typeCollection body
     """
-    import os
-    if handled_files is None:
-        handled_files = set()
-    head, tail = os.path.split(fidl_file)
-    if tail in handled_files:
-        return
-    handled_files.add(tail)
-
-    with open(fidl_file, 'r') as file:
-        dir_path = os.path.dirname(fidl_file)
-        file_lines = file.readlines()
-        file_lines = "".join(file_lines)
-        file_lines = re.sub(r'\/\/.*\n', '', file_lines)
-        packages_name_meta = __package.finditer(file_lines)
-        for package_name_meta in packages_name_meta:
-            package_name = package_name_meta.group("name")
-        type_collections = []
-        type_collections_meta = __type_collection.finditer(file_lines)
-        if type_collections_meta:
-            for type_collection_meta in type_collections_meta:
-                type_collection_description = type_collection_meta.group("comment")
-                type_collection_name = type_collection_meta.group("name")
-                type_collection_body = type_collection_meta.group("body")
-                type_collection = TypeCollection(type_collection_name, type_collection_description)
+    def __init__(self):
+        self.methods = []
+        self.broadcasts = []
+        self.attributes = []
+        self.versions = []
+        self.types = []
+        # Spans of '//' and '/* */' comments, text is matched only outside of them
+        self.comments = []
+
+    def add(self, span):
+        """
+        Add span of block to the corresponding list
+        :param span: BlockSpan
+        :return: None
+        """
+        if span.kind == "method":
+            self.methods.append(span)
+        elif span.kind == "broadcast":
+            self.broadcasts.append(span)
+        elif span.kind == "attribute":
+            self.attributes.append(span)
+        elif span.kind in _type_kinds:
+            self.types.append(span)
+        else:
+            self.versions.append(span)
+
+    @staticmethod
+    def description(text, span):
+        """
+        Get '<** **>' comment attached to block
+        :param text: Text in which span was indexed
+        :param span: BlockSpan
+        :return: Comment or None if block does not have comment
+        """
+        if span.comment_start is None:
+            return None
+        return text[span.comment_start:span.comment_end]
+
+
+def index_interface_body(text, pos=0, endpos=None):
+    """
+    This following function builds in one pass index of top-level
+    method/broadcast/attribute/version and type declaration blocks of interface body
+    :param text: Text that contains interface body
+    :param pos: Start offset of interface body (usually it is '{' of interface)
+    :param endpos: End offset of interface body
+    :return: InterfaceBlockIndex
+    """
+    if endpos is None:
+        endpos = len(text)
+    index = InterfaceBlockIndex()
+    top_depth = None
+    depth = 0
+    doc = None
+    pending = None
+    for token in tokenize(text, pos, endpos, index.comments):
+        is_open = token.kind == PUNCT and token.value == "{"
+        is_close = token.kind == PUNCT and token.value == "}"
+        is_block = token.kind == NAME and token.value in _block_kinds
+        if pending is not None and pending[0] in _bodyless_kinds and \
+                (token.kind == DOC or is_open or is_close or is_block):
+            # Attribute, array and typedef do not have body, they last up to the next block
+            index.add(_block_span(pending, token.start, None, None))
+            pending = None
+        if token.kind == DOC:
+            doc = token
+            continue
+        if top_depth is None:
+            top_depth = 1 if is_open else 0
+        if is_open:
+            depth += 1
+            if pending is not None and pending[3] is None and depth == top_depth + 1:
+                pending[3] = token.start
+        elif is_close:
+            if pending is not None and pending[3] is not None and depth == top_depth + 1:
+                index.add(_block_span(pending, token.end, pending[3], token.end))
+                pending = None
+            depth -= 1
+        elif is_block and depth == top_depth and pending is None:
+            pending = [token.value, token.start, doc, None]
+        doc = None
+    if pending is not None and pending[0] in _bodyless_kinds:
+        index.add(_block_span(pending, endpos, None, None))
+    return index
+
+
+def _block_span(pending, end, body_start, body_end):
+    kind, start, comment, _ = pending
+    return BlockSpan(kind, start, end, body_start, body_end,
+                     comment.start + 3 if comment else None,
+                     comment.end - 3 if comment else None)
+
+
+def _segments(pos, endpos, comments):
+    """
+    Split text[pos:endpos] to parts which are not covered by comments
+    :param pos: Start offset
+    :param endpos: End offset
+    :param comments: Sorted spans of comments
+    :return: Generator of (start, end)
+    """
+    i = bisect_right(comments, (pos, pos))
+    if i and comments[i - 1][1] > pos:
+        i -= 1
+    while pos < endpos:
+        if i < len(comments) and comments[i][0] < endpos:
+            start, end = comments[i]
+            if start > pos:
+                yield pos, start
+            pos = max(pos, end)
+            i += 1
+        else:
+            yield pos, endpos
+            return
+
+
+def _in_comment(offset, comments):
+    """
+    Check whether offset is located inside of comment
+    :param offset: Offset in text
+    :param comments: Sorted spans of comments
+    :return: True if offset is inside of comment, False - otherwise
+    """
+    i = bisect_right(comments, (offset, float("inf")))
+    return i > 0 and offset < comments[i - 1][1]
+
+
+class DocumentIndex:
+    """
+    Class for collecting package, imports and spans of interfaces and typeCollections of fidl-file
+    """
+    def __init__(self):
+        self.package_name = None
+        self.imports_from = []
+        self.imports_model = []
+        self.interfaces = []
+        self.type_collections = []
+        self.comments = []
+
+    def add(self, span):
+        """
+        Add span of block to the corresponding list
+        :param span: BlockSpan
+        :return: None
+        """
+        if span.kind == "interface":
+            self.interfaces.append(span)
+        else:
+            self.type_collections.append(span)
+
+
+def index_document(text, fidl_file=None):
+    """
+    This following function builds in one pass index of fidl-file.
+    Comments are not removed from text, their spans are recorded instead
+    :param text: Text of fidl-file
+    :param fidl_file: Name of fidl-file used in error messages
+    :return: DocumentIndex
+    :raise FidlParseError: If braces are not balanced
+    """
+    index = DocumentIndex()
+    depth = 0
+    doc = None
+    pending = None
+    statement = None
+    for token in tokenize(text, comments=index.comments, fidl_file=fidl_file):
+        if token.kind == DOC:
+            doc = token
+            continue
+        if token.kind == PUNCT and token.value == "{":
+            depth += 1
+            if pending is not None and pending[3] is None and depth == 1:
+                pending[3] = token.start
+            statement = None
+        elif token.kind == PUNCT and token.value == "}":
+            depth -= 1
+            if depth < 0:
+                raise FidlParseError.at("Unexpected '}'", text, token.start, fidl_file)
+            if pending is not None and pending[3] is not None and depth == 0:
+                index.add(_block_span(pending, token.end, pending[3], token.end))
+                pending = None
+        elif depth == 0 and pending is None:
+            if statement == "package" and token.kind == NAME:
+                index.package_name = token.value
+                statement = None
+            elif statement == "import" and token.kind == NAME and token.value in ("model", "from"):
+                statement = token.value
+            elif statement in ("model", "from") and token.kind == STRING:
+                (index.imports_model if statement == "model" else index.imports_from).append(token.value)
+                statement = None
+            elif token.kind == NAME and token.value in ("package", "import"):
+                statement = token.value
+            elif token.kind == NAME and token.value in ("interface", "typeCollection"):
+                pending = [token.value, token.start, doc, None]
+                statement = None
+        doc = None
+    if pending is not None:
+        raise FidlParseError.at("Unterminated " + pending[0] + ", expected '}'", text, pending[1], fidl_file)
+    if depth != 0:
+        raise FidlParseError.at("Unexpected end of file, expected '}'", text, len(text), fidl_file)
+    return index
+
+
+def _parse_interface_members(interface, file_lines, block_index):
+    """
+    This following function is parsing methods, broadcasts, attributes and types of interface
+    :param interface: Interface which members are parsed
+    :param file_lines: Text in which block_index was built
+    :param block_index: InterfaceBlockIndex of interface body
+    :return: None
+    """
+    with run_stats.phase("parse_methods") as measured:
+        interface.methods = parse_methods(file_lines, interface.name, block_index)
+        measured.count(len(interface.methods))
+    with run_stats.phase("parse_broadcasts") as measured:
+        interface.broadcasts = parse_broadcasts(file_lines, interface.name, block_index)
+        measured.count(len(interface.broadcasts))
+    with run_stats.phase("parse_attributes") as measured:
+        attributes = parse_attributes(file_lines, interface.name, block_index)
+        measured.count(len(attributes))
+    interface.attributes = attributes
+    interface.types = parse_type_declarations(file_lines, interface.name, block_index)
+    interface.is_settable_attribute = \
+        any(not attribute.is_read_only for attribute in attributes)
+
+
+def _interface_loader(file_lines, fidl_file, body_start, body_end):
+    """
+    Create loader of LazyInterface which parses file_lines[body_start:body_end] on the first access to members
+    :param file_lines: Text of fidl-file without comments
+    :param fidl_file: Name of fidl-file used in error messages
+    :param body_start: Start offset of interface body
+    :param body_end: End offset of interface body
+    :return: Callable (interface) -> None
+    """
+    def load(interface):
+        with run_stats.phase("load_interface"), _parse_budget_of(fidl_file):
+            block_index = index_interface_body(file_lines, body_start, body_end)
+            _parse_interface_members(interface, file_lines, block_index)
+    return load
+
+
+def _parse_document_regex(file_lines, fidl_file, lazy=False, reuse=None):
+    """
+    This following function is parsing text of fidl-file with regex engine.
+    Text is not copied: regexes are matched inside of indexed blocks and outside of comments
+    :param file_lines: Text of fidl-file
+    :param fidl_file: Name of fidl-file
+    :param lazy: If True, members of interfaces are parsed on the first access
+    :param reuse: Optional span_hashes of previous version of document, its unchanged
+                  interfaces and typeCollections are taken instead of being parsed
+    :return: FidlDocument, interfaces do not have type_collections yet
+    """
+    with _parse_budget_of(fidl_file):
+        return _parse_document_regex_in_budget(file_lines, fidl_file, lazy, reuse or {})
+
+
+def _parse_document_regex_in_budget(file_lines, fidl_file, lazy, reuse):
+    document = FidlDocument(fidl_file)
+    with run_stats.phase("index_document"):
+        document_index = index_document(file_lines, fidl_file)
+    package_name = document_index.package_name
+    document.package_name = package_name
+    document.imports_from = document_index.imports_from
+    document.imports_model = document_index.imports_model
+    with run_stats.phase("parse_type_collections") as measured:
+        for type_collection_span in document_index.type_collections:
+            type_collection_meta = __type_collection.match(file_lines, type_collection_span.start,
+                                                           type_collection_span.body_start)
+            if not type_collection_meta:
+                continue
+            type_collection_description = InterfaceBlockIndex.description(file_lines, type_collection_span)
+            key = span_hash(file_lines, type_collection_span.start, type_collection_span.end,
+                            type_collection_description)
+            if key in reuse:
+                type_collection = reuse[key]
                 type_collection.set_package_name(package_name)
-                for version_meta in __version.finditer(type_collection_body):
+                document.span_hashes[key] = type_collection
+                document.type_collections.append(type_collection)
+                continue
+            type_collection_name = type_collection_meta.group("name")
+            type_collection = TypeCollection(type_collection_name, type_collection_description)
+            type_collection.set_package_name(package_name)
+            block_index = index_interface_body(file_lines, type_collection_span.body_start,
+                                               type_collection_span.body_end)
+            for version_span in block_index.versions:
+                version_meta = __version.match(file_lines, version_span.start, version_span.end)
+                if version_meta:
                     type_collection.set_major(version_meta.group("major_ver"))
                     type_collection.set_minor(version_meta.group("minor_ver"))
                     break
-                type_collections.append(type_collection)
-        else:
-            print("No type_collections !!")
+            type_collection.types = parse_type_declarations(file_lines, type_collection_name, block_index)
+            document.span_hashes[key] = type_collection
+            document.type_collections.append(type_collection)
+        measured.count(len(document.type_collections))
 
-        imports_from_meta = __import_from.finditer(file_lines)
-        for imp in imports_from_meta:
-            head, tail = os.path.split(imp.group("fidl_file"))
-            if tail in handled_files:
-                continue
-            collection_file = dir_path + "/" + imp.group("fidl_file")
-            new_type_collections = parse_type_collections(collection_file, handled_files)
-            if new_type_collections:
-                type_collections.extend(new_type_collections)
-        imports_meta = __import.finditer(file_lines)
-        for imp in imports_meta:
-            head, tail = os.path.split(imp.group("fidl_file"))
-            if tail in handled_files:
+    with run_stats.phase("parse_interfaces") as measured:
+        for interface_span in document_index.interfaces:
+            interface_meta = __interface.match(file_lines, interface_span.start, interface_span.body_start)
+            if not interface_meta:
                 continue
-            collection_file = dir_path + "/" + imp.group("fidl_file")
-            new_type_collections = parse_type_collections(collection_file, handled_files)
-            if new_type_collections:
-                type_collections.extend(new_type_collections)
+            interface_description = InterfaceBlockIndex.description(file_lines, interface_span)
+            interface_name = interface_meta.group("name")
+            body_start, body_end = interface_span.body_start, interface_span.body_end
+            key = span_hash(file_lines, interface_span.start, interface_span.end, interface_description)
+            if key in reuse:
+                interface = reuse[key]
+            elif lazy:
+                interface = LazyInterface(interface_name, interface_description,
+                                          _interface_loader(file_lines, fidl_file, body_start, body_end))
+                for version_start, version_end in _segments(body_start, body_end, document_index.comments):
+                    version_meta = __version.search(file_lines, version_start, version_end)
+                    if version_meta:
+                        interface.set_major(version_meta.group("major_ver"))
+                        interface.set_minor(version_meta.group("minor_ver"))
+                        break
+            else:
+                interface = Interface(interface_name, interface_description)
+                block_index = index_interface_body(file_lines, body_start, body_end)
+                for version_span in block_index.versions:
+                    version_meta = __version.match(file_lines, version_span.start, version_span.end)
+                    if version_meta:
+                        interface.set_major(version_meta.group("major_ver"))
+                        interface.set_minor(version_meta.group("minor_ver"))
+                        break
+                _parse_interface_members(interface, file_lines, block_index)
+            interface.set_package_name(package_name)
+            document.span_hashes[key] = interface
+            document.interfaces.append(interface)
+        measured.count(len(document.interfaces))
+    return document
+
+
+def parse_fidl_file(fidl_file, engine=REGEX_ENGINE, cache=None, lazy=False, previous=None):
+    """
+    This following function reads fidl-file once and parses everything declared in it,
+    imported files are not parsed
+    :param fidl_file: File to parse, '-' means stdin. File is memory-mapped, not read by lines
+    :param engine: Parser engine: REGEX_ENGINE or DESCENT_ENGINE
+    :param cache: Optional ParseCache, it is not used for lazy parsing and re-parsing
+    :param lazy: If True, interfaces are LazyInterface and their members are parsed on the first access
+    :param previous: Optional FidlDocument of previous version of fidl-file, see reparse_fidl_file
+    :return: FidlDocument
+    """
+    if engine not in ENGINES:
+        raise ValueError("Unknown parser engine: " + str(engine))
+    if cache is not None and not lazy and previous is None and _is_path(fidl_file):
+        key = cache.key(fidl_file, "document", engine, with_imports=False)
+        document = cache.get(key)
+        if document is None:
+            document = parse_fidl_file(fidl_file, engine)
+            cache.put(key, document)
+        return document
+    with run_stats.phase("read", fidl_file) as measured:
+        file_lines = read_fidl_file(fidl_file)
+        measured.count(len(file_lines))
+    return parse_fidl_source(file_lines, engine, fidl_file if fidl_file != STDIN else source_name(fidl_file), lazy,
+                             previous)
+
+
+def parse_fidl_source(source, engine=REGEX_ENGINE, fidl_file=None, lazy=False, previous=None):
+    """
+    This following function parses fidl-file taken from any source, imported files are not parsed
+    :param source: Text, bytes-like object (bytes, mmap, ...) or file-like object (for example sys.stdin)
+    :param engine: Parser engine: REGEX_ENGINE or DESCENT_ENGINE
+    :param fidl_file: Name of fidl-file used in error messages, imports are resolved relative to it
+    :param lazy: If True, interfaces are LazyInterface and their members are parsed on the first access
+    :param previous: Optional FidlDocument of previous version of fidl-file, see reparse_fidl_file
+    :return: FidlDocument
+    """
+    if engine not in ENGINES:
+        raise ValueError("Unknown parser engine: " + str(engine))
+    if fidl_file is None:
+        fidl_file = source_name(source)
+    file_lines = read_fidl_source(source)
+    reuse = previous.span_hashes if previous is not None else None
+    with run_stats.phase("parse", fidl_file):
+        if engine == DESCENT_ENGINE:
+            document = parse_fidl_text(file_lines, fidl_file, lazy, reuse)
+        else:
+            document = _parse_document_regex(file_lines, fidl_file, lazy, reuse)
+    if reuse:
+        run_stats.count("reused_nodes", sum(1 for key in document.span_hashes if key in reuse))
+    return document
+
+
+def reparse_fidl_file(previous, fidl_file=None, engine=REGEX_ENGINE, lazy=False, source=None):
+    """
+    This following function parses new version of already parsed fidl-file.
+    Text of every interface and typeCollection is hashed together with its '<** **>' comment,
+    nodes which hash is found in previous document are taken from it as they are instead of being parsed,
+    so editing of one method re-parses only interface which contains it.
+    Reused nodes are shared with previous document, their types are resolved again on resolving of new one
+    :param previous: FidlDocument of previous version
+    :param fidl_file: Path to fidl-file, by default fidl-file of previous document
+    :param engine: Parser engine: REGEX_ENGINE or DESCENT_ENGINE
+    :param lazy: If True, changed interfaces are LazyInterface and their members are parsed on the first access
+    :param source: Already read text, bytes-like or file-like object of new version, by default fidl_file is read
+    :return: FidlDocument
+    """
+    if fidl_file is None:
+        fidl_file = previous.fidl_file
+    if source is not None:
+        return parse_fidl_source(source, engine, fidl_file, lazy, previous)
+    return parse_fidl_file(fidl_file, engine, lazy=lazy, previous=previous)
+
+
+def _is_path(fidl_file):
+    return isinstance(fidl_file, (str, os.PathLike)) and fidl_file != STDIN
+
+
+def resolve_fidl_file(fidl_file, dir_path=None):
+    """
+    Resolve fidl-file to normalized absolute path
+    :param fidl_file: Path of fidl-file, relative paths are resolved against dir_path
+    :param dir_path: Directory of importing fidl-file
+    :return: Normalized absolute path
+    """
+    if dir_path:
+        fidl_file = os.path.join(dir_path, fidl_file)
+    return os.path.normpath(os.path.abspath(fidl_file))
+
+
+def _collect_type_collections(document, handled_files, engine, load_document):
+    """
+    This following function collects type_collections of document and of its transitive imports
+    :param document: FidlDocument
+    :param handled_files: Set of resolved paths of already handled files
+    :param engine: Parser engine
+    :param load_document: Callable (fidl_file, engine) -> FidlDocument
+    :return: Raw type_collections
+    """
+    type_collections = list(document.type_collections)
+    dir_path = os.path.dirname(resolve_fidl_file(document.fidl_file))
+    for imported_file in document.imports:
+        collection_file = resolve_fidl_file(imported_file, dir_path)
+        if collection_file in handled_files:
+            continue
+        handled_files.add(collection_file)
+        imported_document = load_document(collection_file, engine)
+        type_collections.extend(_collect_type_collections(imported_document, handled_files,
+                                                          engine, load_document))
+    return type_collections
+
+
+def parse_type_collections(fidl_file, handled_files=None, engine=REGEX_ENGINE, cache=None):
+    """
+    This following function is parsing fidl-file
+    :param fidl_file: File to parse
+    :param handled_files: Set of resolved paths of handled files with types
+    :param engine: Parser engine: REGEX_ENGINE or DESCENT_ENGINE
+    :param cache: Optional ParseCache, it is used only for top-level call
+    :return: Raw type_collections
+    """
+    if cache is not None and handled_files is None:
+        key = cache.key(fidl_file, "type_collections", engine)
+        type_collections = cache.get(key)
+        if type_collections is None:
+            type_collections = parse_type_collections(fidl_file, engine=engine)
+            cache.put(key, type_collections)
         return type_collections
+    if handled_files is None:
+        handled_files = set()
+    fidl_file = resolve_fidl_file(fidl_file)
+    if fidl_file in handled_files:
+        return
+    handled_files.add(fidl_file)
+    document = parse_fidl_file(fidl_file, engine)
+    return _collect_type_collections(document, handled_files, engine, parse_fidl_file)
 
 
-def parse_interfaces(fidl_file):
+def parse_interfaces(fidl_file, engine=REGEX_ENGINE, cache=None, lazy=False, source=None):
     """
     This following function is parsing fidl-file
-    :param fidl_file:
+    :param fidl_file: Path to fidl-file, '-' for stdin, bytes-like or file-like object,
+                      imports of the last three are resolved relative to current directory
+    :param engine: Parser engine: REGEX_ENGINE (default) or DESCENT_ENGINE,
+                   the last one is linear-time tokenizer with recursive-descent parser
+    :param cache: Optional ParseCache, parsed interfaces are taken from it
+                  if neither fidl_file nor its imports were changed, it is not used for lazy parsing
+    :param lazy: If True, members of interfaces are parsed on the first access
+    :param source: Already read text, bytes-like or file-like object of fidl_file,
+                   then fidl_file is not read and is used only for resolving imports
     :return: Raw interfaces
     """
-    with open(fidl_file, 'r') as file:
-        file_lines = file.readlines()
-        file_lines = "".join(file_lines)
-        file_lines = re.sub(r'\/\/.*\n', '', file_lines)
-        file_lines = re.sub(r'\/\*\*(.|\n)*?\*\/', '', file_lines)
-        packages_name_meta = __package.finditer(file_lines)
-        for package_name_meta in packages_name_meta:
-            package_name = package_name_meta.group("name")
-        print("package_name is " + str(package_name))
-        type_collections = parse_type_collections(fidl_file)
-        interfaces = []
-        interfaces_meta = __interface.finditer(file_lines)
-        if interfaces_meta:
-            for interface_meta in interfaces_meta:
-                interface_description = interface_meta.group("comment")
-                interface_name = interface_meta.group("name")
-                interface_body = interface_meta.group("body")
-                interface = Interface(interface_name, interface_description)
-                for version_meta in __version.finditer(interface_body):
-                    interface.set_major(version_meta.group("major_ver"))
-                    interface.set_minor(version_meta.group("minor_ver"))
-                    break
-                methods = parse_methods(interface_body, interface_name)
-                interface.methods = methods
-                broadcasts = parse_broadcasts(interface_body, interface_name)
-                interface.broadcasts = broadcasts
-                attributes = parse_attributes(interface_body, interface_name)
-                interface.attributes = attributes
-                interface.is_settable_attribute = \
-                    any(not attribute.is_read_only for attribute in attributes)
-                interface.type_collections = type_collections
-                interface.set_package_name(package_name)
-                interfaces.append(interface)
+    if engine not in ENGINES:
+        raise ValueError("Unknown parser engine: " + str(engine))
+    if cache is not None and not lazy and source is None and _is_path(fidl_file):
+        key = cache.key(fidl_file, "interfaces", engine)
+        interfaces = cache.get(key)
+        if interfaces is None:
+            interfaces = parse_interfaces(fidl_file, engine)
+            cache.put(key, interfaces)
         return interfaces
+    if source is not None:
+        document = parse_fidl_source(source, engine, fidl_file, lazy)
+    elif _is_path(fidl_file):
+        document = parse_fidl_file(fidl_file, engine, lazy=lazy)
+    else:
+        document = parse_fidl_source(fidl_file, engine, lazy=lazy)
+        fidl_file = document.fidl_file
+    print("package_name is " + str(document.package_name))
+    with run_stats.phase("imports", fidl_file) as measured:
+        load_document = partial(parse_fidl_file, lazy=True) if lazy else parse_fidl_file
+        type_collections = _collect_type_collections(document, {resolve_fidl_file(fidl_file)},
+                                                     engine, load_document)
+        measured.count(len(type_collections))
+    with run_stats.phase("resolve", fidl_file) as measured:
+        symbol_table = SymbolTable()
+        for type_collection in type_collections:
+            symbol_table.add(type_collection)
+        for interface in document.interfaces:
+            symbol_table.add(interface)
+        for type_collection in type_collections:
+            symbol_table.resolve(type_collection, type_collections)
+        for interface in document.interfaces:
+            interface.type_collections = type_collections
+            symbol_table.resolve(interface, type_collections)
+        measured.count(len(symbol_table))
+    return document.interfaces
 
 
-def parse_methods(interface_body, interface_name):
+def _parse_parameters(text, pos, endpos, type_namespace, comments=()):
+    """
+    This following function is parsing in/out arguments located in text[pos:endpos]
+    :param text: Text that contains arguments
+    :param pos: Start offset of arguments
+    :param endpos: End offset of arguments
+    :param type_namespace: Namespace of user types
+    :param comments: Sorted spans of comments which are skipped
+    :return: List of Parameter
+    """
+    parameters = []
+    for start, end in _segments(pos, endpos, comments):
+        for parameter in __parameter.finditer(text, start, end):
+            parameter_description = parameter.group("comment")
+            parameter_type = parameter.group("type")
+            parameter_name = parameter.group("name")
+            parameters.append(Parameter(type_namespace, parameter_type, parameter_name, parameter_description))
+    return parameters
+
+
+def parse_methods(interface_body, interface_name, block_index=None):
     """
     This following function is parsing fidl-file
     :param interface_body:
+    :param interface_name:
+    :param block_index: InterfaceBlockIndex of interface_body, if it is passed
+                        interface_body could be the whole text in which index was built
     :return: Raw methods
     """
+    if block_index is None:
+        block_index = index_interface_body(interface_body)
+    comments = block_index.comments
     methods = []
-    methods_meta = __method.finditer(interface_body)
-    if methods_meta:
-        for method_meta in methods_meta:
-            method_description = method_meta.group("comment")
-            method_name = method_meta.group("name")
-            method_without_reply = method_meta.group("is_reply")
-            method_body = method_meta.group("body")
-            method = Method(method_name, method_description)
-            in_parameters = __in_parameter.finditer(method_body)
-            for in_parameter in in_parameters:
-                if in_parameter.group("body"):
-                    parameters = __parameter.finditer(in_parameter.group("body"))
-                    for parameter in parameters:
-                        parameter_description = parameter.group("comment")
-                        parameter_type = parameter.group("type")
-                        parameter_name = parameter.group("name")
-                        param = Parameter(interface_name, parameter_type, parameter_name, parameter_description)
-                        method.inputs.append(param)
-            if method_without_reply != "fireAndForget":
-                method.outputs = []
-                out_parameters = __out_parameter.finditer(method_body)
-                for out_parameter in out_parameters:
-                    if out_parameter.group("body"):
-                        parameters = __parameter.finditer(out_parameter.group("body"))
-                        for parameter in parameters:
-                            parameter_description = parameter.group("comment")
-                            parameter_type = parameter.group("type")
-                            parameter_name = parameter.group("name")
-                            method.outputs.append(Parameter(interface_name, parameter_type, parameter_name, parameter_description))
-            methods.append(method)
-    else:
-        print("No methods !!")
+    for method_span in block_index.methods:
+        method_meta = __method.match(interface_body, method_span.start, method_span.body_start)
+        if not method_meta:
+            continue
+        method_description = block_index.description(interface_body, method_span)
+        method_name = method_meta.group("name")
+        method_without_reply = method_meta.group("is_reply")
+        method = Method(method_name, method_description)
+        in_parameters = __in_parameter.finditer(interface_body, method_span.body_start, method_span.body_end)
+        for in_parameter in in_parameters:
+            if _in_comment(in_parameter.start(), comments):
+                continue
+            method.inputs.extend(_parse_parameters(interface_body, in_parameter.start("body"),
+                                                   in_parameter.end("body"), interface_name, comments))
+        if method_without_reply != "fireAndForget":
+            method.outputs = []
+            out_parameters = __out_parameter.finditer(interface_body, method_span.body_start, method_span.body_end)
+            for out_parameter in out_parameters:
+                if _in_comment(out_parameter.start(), comments):
+                    continue
+                method.outputs.extend(_parse_parameters(interface_body, out_parameter.start("body"),
+                                                        out_parameter.end("body"), interface_name, comments))
+        methods.append(method)
     return methods
 
 
-def parse_broadcasts(interface_body, interface_name):
+def parse_broadcasts(interface_body, interface_name, block_index=None):
     """
 
     :param interface_body:
+    :param interface_name:
+    :param block_index: InterfaceBlockIndex of interface_body, if it is passed
+                        interface_body could be the whole text in which index was built
     :return:
     """
+    if block_index is None:
+        block_index = index_interface_body(interface_body)
+    comments = block_index.comments
     broadcasts = []
-    broadcasts_meta = __broadcast.finditer(interface_body)
-    if broadcasts_meta:
-        for broadcast_meta in broadcasts_meta:
-            broadcast_description = broadcast_meta.group("comment")
-            broadcast_name = broadcast_meta.group("name")
-            broadcast_body = broadcast_meta.group("body")
-            broadcast_is_selective = broadcast_meta.group("is_selective")
-            broadcast = Broadcast(broadcast_name, broadcast_description)
-            broadcast.set_is_selective(broadcast_is_selective == "selective")
-            out_parameters = __out_parameter.finditer(broadcast_body)
-            for out_parameter in out_parameters:
-                if out_parameter.group("body"):
-                    parameters = __parameter.finditer(out_parameter.group("body"))
-                    for parameter in parameters:
-                        parameter_description = parameter.group("comment")
-                        parameter_type = parameter.group("type")
-                        parameter_name = parameter.group("name")
-                        broadcast.parameters.append(Parameter(interface_name, parameter_type, parameter_name, parameter_description))
-            broadcasts.append(broadcast)
-    else:
-        print("No broadcasts !!")
+    for broadcast_span in block_index.broadcasts:
+        broadcast_meta = __broadcast.match(interface_body, broadcast_span.start, broadcast_span.body_start)
+        if not broadcast_meta:
+            continue
+        broadcast_description = block_index.description(interface_body, broadcast_span)
+        broadcast_name = broadcast_meta.group("name")
+        broadcast_is_selective = broadcast_meta.group("is_selective")
+        broadcast = Broadcast(broadcast_name, broadcast_description)
+        broadcast.set_is_selective(broadcast_is_selective == "selective")
+        out_parameters = __out_parameter.finditer(interface_body, broadcast_span.body_start, broadcast_span.body_end)
+        for out_parameter in out_parameters:
+            if _in_comment(out_parameter.start(), comments):
+                continue
+            broadcast.parameters.extend(_parse_parameters(interface_body, out_parameter.start("body"),
+                                                          out_parameter.end("body"), interface_name, comments))
+        broadcasts.append(broadcast)
     return broadcasts
 
 
-def parse_attributes(interface_body, interface_name):
+def parse_attributes(interface_body, interface_name, block_index=None):
     """
     This following function is parsing fidl-file
     :param interface_body:
+    :param interface_name:
+    :param block_index: InterfaceBlockIndex of interface_body, if it is passed
+                        interface_body could be the whole text in which index was built
     :return: Raw methods
     """
+    if block_index is None:
+        block_index = index_interface_body(interface_body)
     attributes = []
-    attributes_meta = __attribute.finditer(interface_body)
-    if attributes_meta:
-        for attribute_meta in attributes_meta:
-            attribute_description = attribute_meta.group("comment")
-            attribute_type = attribute_meta.group("type")
-            attribute_name = attribute_meta.group("name")
-            attribute_is_readonly = attribute_meta.group("is_readonly")
-            attribute = Attribute(interface_name, attribute_type, attribute_name, attribute_description)
-            attribute.set_is_readonly(attribute_is_readonly == "readonly")
-            attributes.append(attribute)
-    else:
-        print("No attributes !!")
+    for attribute_span in block_index.attributes:
+        # Attribute lasts up to the next block or up to comment that follows it
+        _, attribute_end = next(_segments(attribute_span.start, attribute_span.end, block_index.comments))
+        attribute_meta = __attribute.match(interface_body, attribute_span.start, attribute_end)
+        if not attribute_meta:
+            continue
+        attribute_description = block_index.description(interface_body, attribute_span)
+        attribute_type = attribute_meta.group("type")
+        attribute_name = attribute_meta.group("name")
+        attribute_is_readonly = attribute_meta.group("is_readonly")
+        attribute = Attribute(interface_name, attribute_type, attribute_name, attribute_description)
+        attribute.set_is_readonly(attribute_is_readonly == "readonly")
+        attributes.append(attribute)
     return attributes
+
+
+def parse_type_declarations(text, type_namespace, block_index):
+    """
+    This following function is parsing struct, union, enumeration, map, array and typedef
+    :param text: Text in which block_index was built
+    :param type_namespace: Name of interface or typeCollection in which types are declared
+    :param block_index: InterfaceBlockIndex of interface or typeCollection body
+    :return: Raw type declarations
+    """
+    declarations = []
+    for type_span in block_index.types:
+        description = block_index.description(text, type_span)
+        if type_span.kind == "array" or type_span.kind == "typedef":
+            _, type_end = next(_segments(type_span.start, type_span.end, block_index.comments))
+            type_meta = (__array if type_span.kind == "array" else __typedef).match(text, type_span.start, type_end)
+            if not type_meta:
+                continue
+            declaration = TypeDeclaration(type_span.kind, type_meta.group("name"), description)
+            field_name = "element" if type_span.kind == "array" else "type"
+            declaration.fields.append(Parameter(type_namespace, type_meta.group("type").rstrip(), field_name, None))
+        elif type_span.kind == "map":
+            type_meta = __map.match(text, type_span.start, type_span.end)
+            if not type_meta:
+                continue
+            declaration = TypeDeclaration("map", type_meta.group("name"), description)
+            declaration.fields.append(Parameter(type_namespace, type_meta.group("key"), "key", None))
+            declaration.fields.append(Parameter(type_namespace, type_meta.group("value"), "value", None))
+        else:
+            type_meta = __struct.match(text, type_span.start, type_span.body_start)
+            if not type_meta:
+                continue
+            declaration = TypeDeclaration(type_meta.group("kind"), type_meta.group("name"), description)
+            if type_meta.group("extends"):
+                declaration.set_extends(type_meta.group("extends"))
+            if declaration.kind == "enumeration":
+                for start, end in _segments(type_span.body_start + 1, type_span.body_end - 1, block_index.comments):
+                    for enumerator in __enumerator.finditer(text, start, end):
+                        declaration.enumerators.append(enumerator.group("name"))
+            else:
+                declaration.fields = _parse_parameters(text, type_span.body_start + 1, type_span.body_end - 1,
+                                                       type_namespace, block_index.comments)
+        declarations.append(declaration)
+    return declarations
+
+
+def emit_ir(fidl_files, ir_file, engine=REGEX_ENGINE, cache=None, ir_format=None):
+    """
+    This following function is parsing fidl-files and writes resolved model to IR file,
+    so other tools could take model from it without parsing
+    :param fidl_files: List of fidl-files
+    :param ir_file: Path to IR file
+    :param engine: Parser engine
+    :param cache: Optional ParseCache
+    :param ir_format: JSON_FORMAT or BINARY_FORMAT, by default it is chosen by extension of ir_file
+    :return: Number of interfaces written to IR
+    """
+    files = [(fidl_file, parse_interfaces(fidl_file, engine, cache)) for fidl_file in fidl_files]
+    dump_ir(files, ir_file, ir_format)
+    return sum(len(interfaces) for _, interfaces in files)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Parse *.fidl files and write resolved model to IR file")
+    parser.add_argument("capi_interface",
+                        nargs='+',
+                        help="CommonAPI interface /<path>/<name>.fidl")
+    parser.add_argument("--ir",
+                        required=True,
+                        metavar="FILE",
+                        help="IR file to write, '*.json' is readable JSON, other names are fast binary format")
+    parser.add_argument("--ir-format",
+                        choices=IR_FORMATS,
+                        help="Format of IR file, by default it is chosen by extension")
+    parser.add_argument("--engine",
+                        choices=ENGINES,
+                        default=REGEX_ENGINE,
+                        help="Parser engine that is used for parsing *.fidl")
+    args = parser.parse_args()
+    num_interfaces = emit_ir(args.capi_interface, args.ir, args.engine, ir_format=args.ir_format)
+    print("Written " + str(num_interfaces) + " interfaces of " + str(len(args.capi_interface)) +
+          " fidl-files to " + args.ir)
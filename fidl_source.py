@@ -0,0 +1,87 @@
+import io
+import locale
+import mmap
+import os
+import sys
+from contextlib import contextmanager
+
+STDIN = "-"
+
+
+def _encoding():
+    """
+    Encoding of fidl-files, it is the same as encoding of file opened with open(path, 'r')
+    :return: Name of encoding
+    """
+    return locale.getpreferredencoding(False)
+
+
+@contextmanager
+def mapped(path):
+    """
+    Memory-map file for reading, pages are shared with OS file cache and are not copied
+    :param path: Path to file
+    :return: mmap object or empty bytes for empty file
+    """
+    with open(path, 'rb') as file:
+        if os.fstat(file.fileno()).st_size == 0:
+            # Empty file could not be mapped
+            yield b""
+            return
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            yield data
+
+
+def _decode(data):
+    """
+    Decode content of fidl-file and translate '\\r\\n' and '\\r' to '\\n' as universal newlines mode of open does
+    :param data: Bytes-like object or text
+    :return: Text of fidl-file
+    """
+    text = data if isinstance(data, str) else str(data, _encoding())
+    if "\r" in text:
+        text = text.replace("\r\n", "\n").replace("\r", "\n")
+    return text
+
+
+def read_fidl_file(path):
+    """
+    Read fidl-file: file is memory-mapped and decoded straight to text,
+    so text is the only copy of file content kept in process memory
+    :param path: Path to fidl-file, '-' means stdin
+    :return: Text of fidl-file
+    """
+    if path == STDIN:
+        return read_fidl_source(sys.stdin)
+    with mapped(path) as data:
+        return _decode(data)
+
+
+def read_fidl_source(source):
+    """
+    Get text of fidl-file from any source without intermediate copies, newlines are translated to '\\n'
+    :param source: Text, bytes-like object (bytes, bytearray, memoryview, mmap) or file-like object
+    :return: Text of fidl-file
+    """
+    if isinstance(source, (str, bytes, bytearray, memoryview, mmap.mmap)):
+        return _decode(source)
+    if isinstance(source, io.TextIOWrapper) and source.buffer is not None:
+        # Binary buffer of text stream is decoded at once instead of line by line
+        source = source.buffer
+    return _decode(source.read())
+
+
+def source_name(source):
+    """
+    Name of fidl source used in error messages
+    :param source: Path, '-', text, bytes-like or file-like object
+    :return: Name of source
+    """
+    if source == STDIN or source is sys.stdin:
+        return "<stdin>"
+    if isinstance(source, os.PathLike):
+        return os.fspath(source)
+    name = getattr(source, "name", None)
+    if isinstance(name, str):
+        return name
+    return "<" + type(source).__name__ + ">"
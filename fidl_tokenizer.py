@@ -0,0 +1,250 @@
+import re
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+NAME = "name"
+STRING = "string"
+DOC = "doc"
+PUNCT = "punct"
+
+Token = namedtuple("Token", ["kind", "value", "start", "end"])
+
+_name_regex = re.compile(r"[\w.]+")
+_space_regex = re.compile(r"\s+")
+
+
+def location_of(text, offset):
+    """
+    Function that convert offset in text to line and column
+    :param text: Text in which offset is located
+    :param offset: Offset of character in text
+    :return: Tuple (line, column), both are counted from 1
+    """
+    line = text.count("\n", 0, offset) + 1
+    column = offset - text.rfind("\n", 0, offset)
+    return line, column
+
+
+class FidlParseError(ValueError):
+    """
+    Class for reporting error found during parsing of fidl-file
+    """
+    def __init__(self, message, fidl_file=None, line=None, column=None):
+        self.message = message
+        self.fidl_file = fidl_file
+        self.line = line
+        self.column = column
+        ValueError.__init__(self, str(self))
+
+    @classmethod
+    def at(cls, message, text, offset, fidl_file=None):
+        """
+        Create error pointing to offset in text
+        :param message: Description of error
+        :param text: Text of fidl-file
+        :param offset: Offset of error in text
+        :param fidl_file: Name of fidl-file
+        :return: FidlParseError
+        """
+        line, column = location_of(text, offset)
+        return cls(message, fidl_file, line, column)
+
+    def __str__(self):
+        """
+        String representation of FidlParseError class
+        :return: <file>:<line>:<column>: <message>
+        """
+        location = ""
+        if self.fidl_file:
+            location += str(self.fidl_file) + ":"
+        if self.line is not None:
+            location += str(self.line) + ":" + str(self.column) + ":"
+        if location:
+            return location + " " + self.message
+        return self.message
+
+
+class FidlParseTimeout(FidlParseError):
+    """
+    Class for reporting that parsing of fidl-file exceeded its time budget
+    """
+
+
+# Budget and deadline belong to context of caller, so threads and asyncio tasks parsing
+# in parallel do not share them
+_parse_timeout = ContextVar("parse_timeout", default=None)
+_deadline = ContextVar("parse_deadline", default=None)
+
+
+def set_parse_timeout(seconds):
+    """
+    Set time budget of parsing of one fidl-file in current context
+    :param seconds: Budget in seconds, None means unlimited
+    :return: None
+    """
+    _parse_timeout.set(seconds)
+
+
+@contextmanager
+def parse_time_limit(seconds):
+    """
+    Set time budget of parsing of one fidl-file inside of block, previous budget is restored after it
+    :param seconds: Budget in seconds, None means unlimited
+    :return: None
+    """
+    token = _parse_timeout.set(seconds)
+    try:
+        yield
+    finally:
+        _parse_timeout.reset(token)
+
+
+def remaining_time():
+    """
+    :return: Seconds left from budget of fidl-file that is being parsed, None if time is unlimited
+    """
+    deadline = _deadline.get()
+    if deadline is None:
+        return None
+    return deadline - time.perf_counter()
+
+
+@contextmanager
+def parse_budget():
+    """
+    Start budget of parsing of one fidl-file, nested budget does not extend outer one
+    :return: None
+    """
+    parse_timeout = _parse_timeout.get()
+    if parse_timeout is None or _deadline.get() is not None:
+        yield
+        return
+    token = _deadline.set(time.perf_counter() + parse_timeout)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def timeout_error(text, offset, fidl_file=None):
+    """
+    Create error about exceeded time budget
+    :param text: Text of fidl-file
+    :param offset: Offset at which parsing was stopped
+    :param fidl_file: Name of fidl-file
+    :return: FidlParseTimeout
+    """
+    return FidlParseTimeout.at("Parsing exceeded time budget of " + str(_parse_timeout.get()) + " s",
+                               text, offset, fidl_file)
+
+
+def check_deadline(text, offset, fidl_file=None):
+    """
+    Abort parsing if budget of fidl-file is exceeded
+    :param text: Text of fidl-file
+    :param offset: Current offset of parser
+    :param fidl_file: Name of fidl-file
+    :raise FidlParseTimeout: If budget is exceeded
+    """
+    deadline = _deadline.get()
+    if deadline is not None and time.perf_counter() > deadline:
+        raise timeout_error(text, offset, fidl_file)
+
+
+def tokenize(text, pos=0, endpos=None, comments=None, fidl_file=None):
+    """
+    Single-pass tokenizer of fidl text. Every character is visited once,
+    so the run time is linear in the size of the text.
+    Comments '//' and '/* */' are skipped, comments '<** **>' are DOC tokens
+    :param text: Text to tokenize
+    :param pos: Offset from which tokenizing is started
+    :param endpos: Offset at which tokenizing is stopped
+    :param comments: Optional list to which spans of skipped comments are appended
+    :param fidl_file: Name of fidl-file used in error messages
+    :return: Generator of Token
+    """
+    if endpos is None:
+        endpos = len(text)
+    while pos < endpos:
+        char = text[pos]
+        if char.isspace():
+            pos = _space_regex.match(text, pos, endpos).end()
+        elif text.startswith("//", pos, endpos):
+            end = text.find("\n", pos, endpos)
+            if end < 0:
+                end = endpos
+            if comments is not None:
+                comments.append((pos, end))
+            pos = end
+        elif text.startswith("/*", pos, endpos):
+            end = text.find("*/", pos + 2, endpos)
+            if end < 0:
+                raise FidlParseError.at("Unterminated comment '/*'", text, pos, fidl_file)
+            if comments is not None:
+                comments.append((pos, end + 2))
+            pos = end + 2
+        elif text.startswith("<**", pos, endpos):
+            end = text.find("**>", pos + 3, endpos)
+            if end < 0:
+                raise FidlParseError.at("Unterminated comment '<**'", text, pos, fidl_file)
+            yield Token(DOC, text[pos + 3:end], pos, end + 3)
+            pos = end + 3
+        elif char == '"':
+            end = text.find('"', pos + 1, endpos)
+            if end < 0:
+                raise FidlParseError.at("Unterminated string", text, pos, fidl_file)
+            yield Token(STRING, text[pos + 1:end], pos, end + 1)
+            pos = end + 1
+        else:
+            name_meta = _name_regex.match(text, pos, endpos)
+            if name_meta:
+                yield Token(NAME, name_meta.group(), pos, name_meta.end())
+                pos = name_meta.end()
+            else:
+                yield Token(PUNCT, char, pos, pos + 1)
+                pos += 1
+
+
+def scan_interface_names(text, fidl_file=None):
+    """
+    Fast scan of package and interface headers, bodies are skipped without parsing
+    :param text: Text of fidl-file
+    :param fidl_file: Name of fidl-file used in error messages
+    :return: Tuple (package name, list of interface names)
+    """
+    package_name, interfaces = scan_interfaces(text, fidl_file)
+    return package_name, [name for name, _ in interfaces]
+
+
+def scan_interfaces(text, fidl_file=None):
+    """
+    Fast scan of package and interface headers, bodies are skipped without parsing
+    :param text: Text of fidl-file
+    :param fidl_file: Name of fidl-file used in error messages
+    :return: Tuple (package name, list of (interface name, size of interface in characters))
+    """
+    package_name = None
+    interfaces = []
+    depth = 0
+    expected = None
+    interface_start = None
+    for token in tokenize(text, fidl_file=fidl_file):
+        if token.kind == PUNCT:
+            if token.value == "{":
+                depth += 1
+            elif token.value == "}":
+                depth -= 1
+                if depth == 0 and interface_start is not None:
+                    interfaces[-1] = (interfaces[-1][0], token.end - interface_start)
+                    interface_start = None
+            expected = None
+        elif depth == 0 and token.kind == NAME:
+            if expected == "package":
+                package_name = token.value
+            elif expected == "interface":
+                interfaces.append((token.value, 0))
+                interface_start = token.start
+            expected = token.value if token.value in ("package", "interface") else None
+    return package_name, interfaces
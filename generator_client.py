@@ -0,0 +1,69 @@
+import json
+import os
+import socket
+import sys
+
+SOCKET_ENV = "COMMONAPI_TOOLS_SOCKET"
+
+
+def default_socket_path():
+    """
+    Path of Unix socket of generator_server if it was not set explicitly
+    :return: $COMMONAPI_TOOLS_SOCKET, otherwise socket in private directory of current user
+             in $XDG_RUNTIME_DIR or in temporary directory
+    """
+    socket_path = os.environ.get(SOCKET_ENV)
+    if socket_path:
+        return socket_path
+    runtime_dir = os.environ.get("XDG_RUNTIME_DIR") or os.environ.get("TMPDIR") or "/tmp"
+    return os.path.join(runtime_dir, "commonapi_tools-" + str(os.getuid()), "server.sock")
+
+
+def call(socket_path, method, params=None, request_id=1):
+    """
+    Send one JSON-RPC request to generator_server and wait for response
+    :param socket_path: Path of Unix socket
+    :param method: Name of method: 'generate', 'ping' or 'shutdown'
+    :param params: Parameters of method
+    :param request_id: Id of request
+    :return: Result of method
+    :raise OSError: If server is not running
+    :raise RuntimeError: If server returned error
+    """
+    request = {"jsonrpc": "2.0", "id": request_id, "method": method, "params": params or {}}
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+        connection.connect(socket_path)
+        with connection.makefile('rwb') as stream:
+            stream.write(json.dumps(request).encode("utf-8") + b"\n")
+            stream.flush()
+            line = stream.readline()
+    if not line:
+        raise RuntimeError("generator_server closed connection without response")
+    response = json.loads(line)
+    if "error" in response:
+        raise RuntimeError(response["error"]["message"])
+    return response["result"]
+
+
+def main(argv=None):
+    """
+    Thin client for build systems: it takes arguments of wrapper_generator.py and runs them
+    in generator_server, so neither python modules nor fidl-files are loaded again.
+    If server is not running, wrapper_generator is run in this process
+    :param argv: Arguments of wrapper_generator.py
+    :return: Exit code
+    """
+    if argv is None:
+        argv = sys.argv[1:]
+    try:
+        result = call(default_socket_path(), "generate", {"argv": argv})
+    except OSError:
+        import wrapper_generator
+        return wrapper_generator.main(argv)
+    sys.stdout.write(result["stdout"])
+    sys.stderr.write(result["stderr"])
+    return result["exit_code"]
+
+
+if __name__ == '__main__':
+    sys.exit(main())
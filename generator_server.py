@@ -0,0 +1,234 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import socket
+import socketserver
+import struct
+import sys
+
+import wrapper_generator
+from generator_client import default_socket_path, SOCKET_ENV
+
+PARSE_ERROR = -32700
+INVALID_REQUEST = -32600
+METHOD_NOT_FOUND = -32601
+INVALID_PARAMS = -32602
+
+
+class GeneratorServer:
+    """
+    Class for running wrapper_generator in long-living process: python modules, compiled regular expressions,
+    compiled templates and parsed fidl-files are kept between requests.
+    Before every request fidl-files changed on disk (by mtime, then by hash) are re-parsed
+    and files importing them are resolved again, templates are checked for changes by jinja2.
+    Requests are JSON-RPC 2.0 objects, one per line, they are handled one by one
+    """
+    def __init__(self):
+        self.workspaces = {}
+        self.requests = 0
+        self.stopped = False
+        wrapper_generator.set_template_auto_reload(True)
+
+    def generate(self, argv):
+        """
+        Run wrapper_generator with arguments of its command line
+        :param argv: List of arguments
+        :return: Dictionary with exit_code, stdout and stderr of run
+                 and fidl-files affected by changes since the previous request
+        """
+        if not isinstance(argv, list) or not all(isinstance(arg, str) for arg in argv):
+            raise TypeError("argv should be list of strings")
+        affected = []
+        for workspace in self.workspaces.values():
+            affected.extend(workspace.refresh())
+        stdout = io.StringIO()
+        stderr = io.StringIO()
+        cwd = os.getcwd()
+        with contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(stderr):
+            try:
+                exit_code = wrapper_generator.main(argv, self.workspaces)
+            except SystemExit as ex:
+                # argparse exits on wrong arguments or --help
+                exit_code = ex.code if isinstance(ex.code, int) else (0 if ex.code is None else 1)
+            except Exception as ex:
+                print("error: " + (str(ex) or type(ex).__name__), file=sys.stderr)
+                exit_code = 1
+            finally:
+                os.chdir(cwd)
+        return {"exit_code": exit_code,
+                "stdout": stdout.getvalue(),
+                "stderr": stderr.getvalue(),
+                "affected": sorted(set(affected))}
+
+    def ping(self):
+        """
+        :return: State of server
+        """
+        return {"pid": os.getpid(),
+                "requests": self.requests,
+                "fidl_files": sum(len(workspace.documents) for workspace in self.workspaces.values())}
+
+    def shutdown(self):
+        """
+        Stop server after response is sent
+        :return: None
+        """
+        self.stopped = True
+
+    def handle(self, line):
+        """
+        Handle one JSON-RPC request
+        :param line: Text of request
+        :return: Response dictionary or None for notification
+        """
+        self.requests += 1
+        try:
+            request = json.loads(line)
+        except ValueError as ex:
+            return _error(None, PARSE_ERROR, "Parse error: " + str(ex))
+        if not isinstance(request, dict) or not isinstance(request.get("method"), str):
+            return _error(None, INVALID_REQUEST, "Invalid request")
+        request_id = request.get("id")
+        method = {"generate": self.generate, "ping": self.ping, "shutdown": self.shutdown}.get(request["method"])
+        if method is None:
+            return _error(request_id, METHOD_NOT_FOUND, "Method not found: " + request["method"])
+        params = request.get("params") or {}
+        if not isinstance(params, dict):
+            return _error(request_id, INVALID_PARAMS, "params should be object")
+        try:
+            result = method(**params)
+        except TypeError as ex:
+            return _error(request_id, INVALID_PARAMS, str(ex))
+        if "id" not in request:
+            return None
+        return {"jsonrpc": "2.0", "id": request_id, "result": result}
+
+    def serve_stream(self, input_stream, output_stream):
+        """
+        Handle requests read line by line from binary input_stream until end of stream or shutdown
+        :param input_stream: Binary stream of requests
+        :param output_stream: Binary stream of responses
+        :return: None
+        """
+        for line in input_stream:
+            if not line.strip():
+                continue
+            response = self.handle(line)
+            if response is not None:
+                output_stream.write(json.dumps(response).encode("utf-8") + b"\n")
+                output_stream.flush()
+            if self.stopped:
+                break
+
+    def serve_socket(self, socket_path):
+        """
+        Listen on Unix socket, connections are handled one by one
+        :param socket_path: Path of Unix socket
+        :return: None
+        """
+        server = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                server.serve_stream(self.rfile, self.wfile)
+
+        _remove_stale_socket(socket_path)
+        with _PrivateUnixStreamServer(socket_path, Handler, bind_and_activate=False) as unix_server:
+            unix_server.server_bind()
+            try:
+                # Nobody could connect before listen, so other users never see socket with wider mode
+                os.chmod(socket_path, 0o600)
+                unix_server.server_activate()
+                while not self.stopped:
+                    unix_server.handle_request()
+            finally:
+                os.unlink(socket_path)
+
+
+class _PrivateUnixStreamServer(socketserver.UnixStreamServer):
+    """
+    Unix socket server which accepts connections only from processes of the same user
+    """
+    def verify_request(self, request, client_address):
+        peer_uid = _peer_uid(request)
+        if peer_uid is not None and peer_uid != os.getuid():
+            print("warning: connection from uid " + str(peer_uid) + " is rejected", file=sys.stderr)
+            return False
+        return True
+
+
+def _peer_uid(connection):
+    """
+    User of process connected to Unix socket
+    :param connection: Connected Unix socket
+    :return: uid or None if SO_PEERCRED is not supported, then access is limited only by mode of socket
+    """
+    if not hasattr(socket, "SO_PEERCRED"):
+        return None
+    credentials = connection.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize("3i"))
+    _, uid, _ = struct.unpack("3i", credentials)
+    return uid
+
+
+def make_socket_dir(socket_path):
+    """
+    Create directory of socket, only its owner could access it
+    :param socket_path: Path of Unix socket
+    :raise RuntimeError: If existing directory is owned by other user or is accessible by others
+    """
+    dir_path = os.path.dirname(os.path.abspath(socket_path))
+    os.makedirs(dir_path, mode=0o700, exist_ok=True)
+    stat = os.stat(dir_path)
+    if stat.st_uid != os.getuid() or stat.st_mode & 0o077:
+        raise RuntimeError(dir_path + " should be owned by current user and accessible only by owner")
+
+
+def _error(request_id, code, message):
+    return {"jsonrpc": "2.0", "id": request_id, "error": {"code": code, "message": message}}
+
+
+def _remove_stale_socket(socket_path):
+    """
+    Remove socket left by server that was killed
+    :param socket_path: Path of Unix socket
+    :raise RuntimeError: If other server is listening on socket_path
+    """
+    if not os.path.exists(socket_path):
+        return
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+        try:
+            connection.connect(socket_path)
+        except OSError:
+            os.unlink(socket_path)
+            return
+    raise RuntimeError("generator_server is already listening on " + socket_path)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Keep wrapper_generator warm between runs of build system, "
+                                                 "run generator_client.py with arguments of wrapper_generator.py")
+    parser.add_argument("--socket",
+                        help="Unix socket to listen on, by default $" + SOCKET_ENV + " or socket in private "
+                             "directory of current user, it is created with mode 0700. "
+                             "Only processes of current user are served")
+    parser.add_argument("--stdio",
+                        action='store_true',
+                        help="Read JSON-RPC requests from stdin and write responses to stdout instead of socket")
+    args = parser.parse_args(argv)
+    server = GeneratorServer()
+    if args.stdio:
+        server.serve_stream(sys.stdin.buffer, sys.stdout.buffer)
+    else:
+        socket_path = args.socket
+        if socket_path is None:
+            socket_path = default_socket_path()
+            if not os.environ.get(SOCKET_ENV):
+                make_socket_dir(socket_path)
+        server.serve_socket(socket_path)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,253 @@
+import json
+import marshal
+import os
+
+from commonapi_types import Parameter, Attribute, Broadcast, Method, TypeDeclaration, Interface, TypeCollection
+
+IR_FORMAT = "commonapi-ir"
+IR_VERSION = 1
+JSON_FORMAT = "json"
+BINARY_FORMAT = "binary"
+IR_FORMATS = [JSON_FORMAT, BINARY_FORMAT]
+
+# Binary IR is marshal dump of the same dictionary as JSON IR behind this header
+_BINARY_MAGIC = b"CAPIIR\0"
+
+
+class IRFormatError(ValueError):
+    """
+    Exception raised when file is not IR or it was written by incompatible version
+    """
+
+
+def _parameter_to_ir(parameter):
+    return {"type_namespace": parameter.type_namespace,
+            "fidl_type": parameter.fidl_type,
+            "type": parameter.type,
+            "name": parameter.name,
+            "description": parameter.description}
+
+
+def _parameter_from_ir(data, cls=Parameter):
+    parameter = cls(data["type_namespace"], data["fidl_type"], data["name"], data["description"])
+    # Type is stored resolved, so SymbolTable is not needed
+    parameter.type = data["type"]
+    return parameter
+
+
+def _attribute_to_ir(attribute):
+    data = _parameter_to_ir(attribute)
+    data["is_read_only"] = attribute.is_read_only
+    return data
+
+
+def _attribute_from_ir(data):
+    attribute = _parameter_from_ir(data, Attribute)
+    attribute.set_is_readonly(data["is_read_only"])
+    return attribute
+
+
+def _method_to_ir(method):
+    return {"name": method.name,
+            "description": method.description,
+            "inputs": [_parameter_to_ir(parameter) for parameter in method.inputs],
+            "outputs": None if method.outputs is None else [_parameter_to_ir(parameter)
+                                                            for parameter in method.outputs]}
+
+
+def _method_from_ir(data):
+    method = Method(data["name"], data["description"])
+    method.inputs = [_parameter_from_ir(parameter) for parameter in data["inputs"]]
+    if data["outputs"] is not None:
+        method.outputs = [_parameter_from_ir(parameter) for parameter in data["outputs"]]
+    return method
+
+
+def _broadcast_to_ir(broadcast):
+    return {"name": broadcast.name,
+            "description": broadcast.description,
+            "is_selective": broadcast.is_selective,
+            "parameters": [_parameter_to_ir(parameter) for parameter in broadcast.parameters]}
+
+
+def _broadcast_from_ir(data):
+    broadcast = Broadcast(data["name"], data["description"])
+    broadcast.set_is_selective(data["is_selective"])
+    broadcast.parameters = [_parameter_from_ir(parameter) for parameter in data["parameters"]]
+    return broadcast
+
+
+def _type_declaration_to_ir(declaration):
+    return {"kind": declaration.kind,
+            "name": declaration.name,
+            "description": declaration.description,
+            "extends": declaration.extends,
+            "fields": [_parameter_to_ir(field) for field in declaration.fields],
+            "enumerators": list(declaration.enumerators)}
+
+
+def _type_declaration_from_ir(data):
+    declaration = TypeDeclaration(data["kind"], data["name"], data["description"])
+    declaration.set_extends(data["extends"])
+    declaration.fields = [_parameter_from_ir(field) for field in data["fields"]]
+    declaration.enumerators = list(data["enumerators"])
+    return declaration
+
+
+def _type_collection_to_ir(type_collection):
+    return {"package_name": type_collection.package_name,
+            "name": type_collection.name,
+            "major": type_collection.major,
+            "minor": type_collection.minor,
+            "description": type_collection.description,
+            "types": [_type_declaration_to_ir(declaration) for declaration in type_collection.types]}
+
+
+def _type_collection_from_ir(data):
+    type_collection = TypeCollection(data["name"], data["description"])
+    type_collection.set_package_name(data["package_name"])
+    type_collection.set_major(data["major"])
+    type_collection.set_minor(data["minor"])
+    type_collection.types = [_type_declaration_from_ir(declaration) for declaration in data["types"]]
+    return type_collection
+
+
+def _interface_to_ir(interface, type_collection_index):
+    return {"package_name": interface.package_name,
+            "name": interface.name,
+            "major": interface.major,
+            "minor": interface.minor,
+            "description": interface.description,
+            "type_collections": [type_collection_index[_type_collection_key(type_collection)]
+                                 for type_collection in interface.type_collections],
+            "is_settable_attribute": interface.is_settable_attribute,
+            "methods": [_method_to_ir(method) for method in interface.methods],
+            "broadcasts": [_broadcast_to_ir(broadcast) for broadcast in interface.broadcasts],
+            "attributes": [_attribute_to_ir(attribute) for attribute in interface.attributes],
+            "types": [_type_declaration_to_ir(declaration) for declaration in interface.types]}
+
+
+def _interface_from_ir(data, type_collections):
+    interface = Interface(data["name"], data["description"])
+    interface.set_package_name(data["package_name"])
+    interface.set_major(data["major"])
+    interface.set_minor(data["minor"])
+    interface.type_collections = [type_collections[index] for index in data["type_collections"]]
+    interface.is_settable_attribute = data["is_settable_attribute"]
+    interface.methods = [_method_from_ir(method) for method in data["methods"]]
+    interface.broadcasts = [_broadcast_from_ir(broadcast) for broadcast in data["broadcasts"]]
+    interface.attributes = [_attribute_from_ir(attribute) for attribute in data["attributes"]]
+    interface.types = [_type_declaration_from_ir(declaration) for declaration in data["types"]]
+    return interface
+
+
+def _type_collection_key(type_collection):
+    return type_collection.package_name, type_collection.name
+
+
+def to_ir(files):
+    """
+    Convert parsed and resolved model to IR: dictionary of plain lists, strings, numbers and None.
+    typeCollections are stored once and are referenced from interfaces by index
+    :param files: List of (fidl-file, list of Interface)
+    :return: IR dictionary
+    """
+    type_collections = []
+    type_collection_index = {}
+    ir_files = []
+    for fidl_file, interfaces in files:
+        for interface in interfaces:
+            for type_collection in interface.type_collections:
+                key = _type_collection_key(type_collection)
+                if key not in type_collection_index:
+                    type_collection_index[key] = len(type_collections)
+                    type_collections.append(_type_collection_to_ir(type_collection))
+        ir_files.append({"fidl_file": fidl_file,
+                         "interfaces": [_interface_to_ir(interface, type_collection_index)
+                                        for interface in interfaces]})
+    return {"format": IR_FORMAT,
+            "version": IR_VERSION,
+            "type_collections": type_collections,
+            "files": ir_files}
+
+
+def from_ir(data):
+    """
+    Restore model from IR, types of parameters are already resolved
+    :param data: IR dictionary
+    :return: List of (fidl-file, list of Interface) in the same order as they were stored
+    """
+    if not isinstance(data, dict) or data.get("format") != IR_FORMAT:
+        raise IRFormatError("Not a " + IR_FORMAT + " file")
+    if data.get("version") != IR_VERSION:
+        raise IRFormatError("Unsupported version of " + IR_FORMAT + ": " + str(data.get("version")) +
+                            ", expected " + str(IR_VERSION))
+    type_collections = [_type_collection_from_ir(type_collection) for type_collection in data["type_collections"]]
+    return [(ir_file["fidl_file"], [_interface_from_ir(interface, type_collections)
+                                    for interface in ir_file["interfaces"]])
+            for ir_file in data["files"]]
+
+
+def ir_format_of(ir_file):
+    """
+    Choose format of IR by extension of file: '.json' is JSON IR, everything else is binary IR
+    :param ir_file: Path to IR file
+    :return: JSON_FORMAT or BINARY_FORMAT
+    """
+    return JSON_FORMAT if os.path.splitext(ir_file)[1].lower() == ".json" else BINARY_FORMAT
+
+
+def dumps_ir(files, ir_format=BINARY_FORMAT):
+    """
+    Serialize parsed model
+    :param files: List of (fidl-file, list of Interface)
+    :param ir_format: JSON_FORMAT (readable) or BINARY_FORMAT (fast to load)
+    :return: Bytes
+    """
+    data = to_ir(files)
+    if ir_format == JSON_FORMAT:
+        return (json.dumps(data, indent=1) + "\n").encode("utf-8")
+    if ir_format == BINARY_FORMAT:
+        return _BINARY_MAGIC + marshal.dumps(data)
+    raise ValueError("Unknown IR format: " + str(ir_format))
+
+
+def loads_ir(content):
+    """
+    Deserialize parsed model, format is detected by content
+    :param content: Bytes of JSON or binary IR
+    :return: List of (fidl-file, list of Interface)
+    """
+    if content.startswith(_BINARY_MAGIC):
+        try:
+            data = marshal.loads(content[len(_BINARY_MAGIC):])
+        except (EOFError, ValueError, TypeError) as ex:
+            raise IRFormatError("Broken binary " + IR_FORMAT + " file: " + str(ex))
+    else:
+        try:
+            data = json.loads(content.decode("utf-8"))
+        except ValueError as ex:
+            raise IRFormatError("Not a " + IR_FORMAT + " file: " + str(ex))
+    return from_ir(data)
+
+
+def dump_ir(files, ir_file, ir_format=None):
+    """
+    Write parsed model to file
+    :param files: List of (fidl-file, list of Interface)
+    :param ir_file: Path to IR file
+    :param ir_format: JSON_FORMAT or BINARY_FORMAT, by default it is chosen by extension of ir_file
+    :return: None
+    """
+    with open(ir_file, 'wb') as file:
+        file.write(dumps_ir(files, ir_format or ir_format_of(ir_file)))
+
+
+def load_ir(ir_file):
+    """
+    Read parsed model from file written by dump_ir
+    :param ir_file: Path to IR file
+    :return: List of (fidl-file, list of Interface)
+    """
+    with open(ir_file, 'rb') as file:
+        return loads_ir(file.read())
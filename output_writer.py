@@ -0,0 +1,221 @@
+import hashlib
+import locale
+import os
+import threading
+import time
+
+WRITTEN = "written"
+UNCHANGED = "unchanged"
+DEFAULT_WRITE_JOBS = 8
+
+
+_umask = None
+
+
+def _process_umask():
+    """
+    Umask of process, it is read only once: os.umask() changes it for the whole process,
+    so reading it while other threads create files or directories would give them mode without umask.
+    OutputWriter reads it before it starts writing threads
+    :return: Umask
+    """
+    global _umask
+    if _umask is None:
+        umask = os.umask(0)
+        os.umask(umask)
+        _umask = umask
+    return _umask
+
+
+def _encode(content):
+    """
+    Encode content the same way as file opened with open(path, 'w')
+    :param content: Text
+    :return: Bytes
+    """
+    return content.encode(locale.getpreferredencoding(False))
+
+
+def is_unchanged(path, data):
+    """
+    Check whether file already has the data: first sizes are compared, then hashes
+    :param path: Path to file
+    :param data: Bytes that are going to be written
+    :return: True if file has exactly the same data, False - otherwise
+    """
+    try:
+        if os.stat(path).st_size != len(data):
+            return False
+        digest = hashlib.sha256()
+        with open(path, 'rb') as file:
+            for chunk in iter(lambda: file.read(1024 * 1024), b""):
+                digest.update(chunk)
+    except OSError:
+        return False
+    return digest.digest() == hashlib.sha256(data).digest()
+
+
+def write_atomic(path, data):
+    """
+    Write data to temporary file in the same directory and rename it to path,
+    so readers never see partially written file
+    :param path: Path to file
+    :param data: Bytes to write
+    :return: None
+    """
+    import tempfile
+    dir_path = os.path.dirname(os.path.abspath(path))
+    try:
+        mode = os.stat(path).st_mode & 0o777
+    except OSError:
+        mode = 0o666 & ~_process_umask()
+    fd, temp_path = tempfile.mkstemp(dir=dir_path, prefix="." + os.path.basename(path) + ".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, 'wb') as file:
+            file.write(data)
+        os.chmod(temp_path, mode)
+        os.replace(temp_path, path)
+    except Exception:
+        os.unlink(temp_path)
+        raise
+
+
+def _write_file(path, content, only_if_changed):
+    """
+    Write one generated file atomically
+    :return: Tuple (WRITTEN or UNCHANGED, number of written bytes, start and end of writing as time.time())
+    """
+    start = time.time()
+    data = _encode(content)
+    if only_if_changed and is_unchanged(path, data):
+        status, size = UNCHANGED, 0
+    else:
+        write_atomic(path, data)
+        status, size = WRITTEN, len(data)
+    return status, size, start, time.time()
+
+
+def write_output(path, content, only_if_changed=False):
+    """
+    Write generated file, it is replaced atomically
+    :param path: Path to file
+    :param content: Text of generated file
+    :param only_if_changed: If True, file is left untouched (mtime is not bumped)
+                            when it already has the same content
+    :return: WRITTEN or UNCHANGED
+    """
+    return _write_file(path, content, only_if_changed)[0]
+
+
+def write_now(path, content, only_if_changed=False):
+    """
+    Write generated file in calling thread, it could be used instead of OutputWriter.submit
+    :param path: Path to file
+    :param content: Text of generated file
+    :param only_if_changed: If True, file is left untouched when it already has the same content
+    :return: Done future with the same result as future of OutputWriter.submit, errors are raised immediately
+    """
+    from concurrent.futures import Future
+    future = Future()
+    future.set_result(_write_file(path, content, only_if_changed))
+    return future
+
+
+class WriteStats:
+    """
+    Class for collecting statistics of written files
+    """
+    def __init__(self):
+        self.written = []
+        self.unchanged = []
+
+    def add(self, path, status):
+        """
+        Register result of write_output
+        :param path: Path to file
+        :param status: WRITTEN or UNCHANGED
+        :return: None
+        """
+        if status == UNCHANGED:
+            self.unchanged.append(path)
+        else:
+            self.written.append(path)
+
+    def __repr__(self):
+        """
+        Detail string representation of WriteStats class
+        :return: Detail string representation
+        """
+        return str(len(self.written)) + " written, " + str(len(self.unchanged)) + " unchanged"
+
+
+class OutputWriter:
+    """
+    Class for writing generated files on pool of threads, so rendering of next file overlaps
+    with writing of previous ones and high-latency writes (for example to NFS) go in parallel.
+    Files are replaced atomically, number of files waiting for writing is bounded,
+    so submit() blocks renderer when writing falls behind
+    """
+    def __init__(self, max_workers=DEFAULT_WRITE_JOBS, max_pending=None):
+        """
+        :param max_workers: Number of writing threads, 0 means that files are written synchronously by submit()
+        :param max_pending: Maximum number of submitted but not written files, by default 2 * max_workers
+        """
+        self.max_workers = max_workers
+        self._executor = None
+        _process_umask()
+        if max_workers > 0:
+            # concurrent.futures imports logging, it is not needed until files are written
+            from concurrent.futures import ThreadPoolExecutor
+            self._executor = ThreadPoolExecutor(max_workers, thread_name_prefix="output_writer")
+            self._pending = threading.BoundedSemaphore(max_pending or 2 * max_workers)
+
+    def submit(self, path, content, only_if_changed=False):
+        """
+        Schedule writing of generated file
+        :param path: Path to file
+        :param content: Text of generated file
+        :param only_if_changed: If True, file is left untouched when it already has the same content
+        :return: Future with result (WRITTEN or UNCHANGED, number of written bytes,
+                 start and end of writing as time.time())
+        """
+        if self._executor is None:
+            from concurrent.futures import Future
+            future = Future()
+            try:
+                future.set_result(_write_file(path, content, only_if_changed))
+            except Exception as ex:
+                future.set_exception(ex)
+            return future
+        self._pending.acquire()
+        try:
+            future = self._executor.submit(_write_file, path, content, only_if_changed)
+        except Exception:
+            self._pending.release()
+            raise
+        future.add_done_callback(lambda _: self._pending.release())
+        return future
+
+    def close(self):
+        """
+        Wait for all submitted files and stop writing threads
+        :return: None
+        """
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def wait_all(futures):
+    """
+    Wait for futures of OutputWriter.submit, even if some of them failed
+    :param futures: Iterable of Future
+    :return: None
+    """
+    from concurrent.futures import wait
+    wait(list(futures))
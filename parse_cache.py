@@ -0,0 +1,250 @@
+import hashlib
+import os
+import pickle
+import re
+
+import run_stats
+from fidl_source import mapped
+
+CACHE_FORMAT_VERSION = "1"
+DEFAULT_MAX_SIZE = 256 * 1024 * 1024
+# put() evicts entries until this part of max_size is left, so the next scan is needed only after many puts
+EVICT_TO_FRACTION = 0.75
+
+_import_regex = re.compile(r"import\s+(?:model\s+|[\*\.\w]+\s+from\s+)\"(?P<fidl_file>[^\"]+)\"")
+_parser_sources = ["fidl_parser.py", "fidl_descent_parser.py", "fidl_tokenizer.py", "commonapi_types.py",
+                   "symbol_table.py"]
+_parser_hash = None
+
+
+def default_cache_dir():
+    """
+    Directory of cache if it was not set explicitly
+    :return: $COMMONAPI_TOOLS_CACHE_DIR or ~/.cache/commonapi_tools
+    """
+    cache_dir = os.environ.get("COMMONAPI_TOOLS_CACHE_DIR")
+    if cache_dir:
+        return cache_dir
+    cache_home = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(cache_home, "commonapi_tools")
+
+
+def _hash_of_parser():
+    """
+    Hash of parser sources, so cache is invalidated when parser is changed
+    :return: Hex digest
+    """
+    global _parser_hash
+    if _parser_hash is None:
+        digest = hashlib.sha256(CACHE_FORMAT_VERSION.encode())
+        dir_path = os.path.dirname(os.path.abspath(__file__))
+        for source in _parser_sources:
+            with open(os.path.join(dir_path, source), 'rb') as file:
+                digest.update(file.read())
+        _parser_hash = digest.hexdigest()
+    return _parser_hash
+
+
+def imported_files(text):
+    """
+    Find files imported with 'import ... from' and 'import model'
+    :param text: Text of fidl-file
+    :return: List of imported files in order of appearance
+    """
+    return [imp.group("fidl_file") for imp in _import_regex.finditer(text)]
+
+
+def is_private_dir(dir_path):
+    """
+    Check that directory is owned by current user and could not be written by others,
+    so nobody else could place there files which are unpickled
+    :param dir_path: Path to directory
+    :return: True if directory is private, False - otherwise
+    """
+    try:
+        stat = os.stat(dir_path)
+    except OSError:
+        return False
+    if hasattr(os, "getuid") and stat.st_uid != os.getuid():
+        return False
+    return stat.st_mode & 0o022 == 0
+
+
+class ParseCache:
+    """
+    Persistent cache of parsed fidl-files.
+    Entry is keyed by content of fidl-file and contents of all its transitive imports,
+    the least recently used entries are evicted when size of cache exceeds max_size.
+    Size of cache is scanned once and then tracked by put(), so entries stored by other processes
+    are noticed only on the next eviction.
+    Entries are unpickled, so cache is used only if its directory is private, see is_private_dir,
+    new directory is created with mode 0700
+    """
+    def __init__(self, cache_dir=None, max_size=DEFAULT_MAX_SIZE):
+        self.cache_dir = cache_dir or default_cache_dir()
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        # Size of entries known to this process, None until cache directory is scanned
+        self._size = None
+        self._usable = None
+
+    def _content_hashes(self, fidl_file, hashes):
+        """
+        Collect content hashes of fidl_file and its transitive imports
+        :param fidl_file: File to hash
+        :param hashes: Dictionary path -> hash, it is filled by this method
+        :return: None
+        """
+        fidl_file = os.path.abspath(fidl_file)
+        if fidl_file in hashes:
+            return
+        try:
+            with open(fidl_file, 'rb') as file:
+                content = file.read()
+        except OSError:
+            hashes[fidl_file] = None
+            return
+        hashes[fidl_file] = hashlib.sha256(content).hexdigest()
+        dir_path = os.path.dirname(fidl_file)
+        for imported_file in imported_files(content.decode('utf-8', 'replace')):
+            self._content_hashes(os.path.join(dir_path, imported_file), hashes)
+
+    def key(self, fidl_file, *parts, with_imports=True):
+        """
+        Compute key of cache entry
+        :param fidl_file: Parsed file
+        :param parts: Additional strings that distinguish entries, for example parser engine
+        :param with_imports: Whether contents of transitive imports are part of the key
+        :return: Key of cache entry
+        """
+        hashes = {}
+        if with_imports:
+            self._content_hashes(fidl_file, hashes)
+        else:
+            with mapped(fidl_file) as data:
+                hashes[os.path.abspath(fidl_file)] = hashlib.sha256(data).hexdigest()
+        digest = hashlib.sha256(_hash_of_parser().encode())
+        for part in parts:
+            digest.update(b"\0" + str(part).encode())
+        for path, content_hash in hashes.items():
+            digest.update(b"\0" + path.encode() + b"\0" + str(content_hash).encode())
+        return digest.hexdigest()
+
+    def is_usable(self):
+        """
+        Create cache directory if it does not exist and check that it is private,
+        warning is printed once if it is not
+        :return: True if cache could be used, False - otherwise
+        """
+        if self._usable is None:
+            try:
+                os.makedirs(self.cache_dir, mode=0o700, exist_ok=True)
+            except OSError:
+                pass
+            self._usable = is_private_dir(self.cache_dir)
+            if not self._usable:
+                import sys
+                print("warning: cache " + self.cache_dir + " is not used, it should be directory owned "
+                      "by current user and not writable by others", file=sys.stderr)
+        return self._usable
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key + ".pickle")
+
+    def get(self, key):
+        """
+        Get parsed model from cache
+        :param key: Key of cache entry
+        :return: Parsed model or None if there is no entry
+        """
+        path = self._path(key)
+        try:
+            if not self.is_usable():
+                raise OSError("cache is not private")
+            with open(path, 'rb') as file:
+                value = pickle.load(file)
+        except (OSError, EOFError, pickle.UnpicklingError, AttributeError, ImportError):
+            self.misses += 1
+            run_stats.count("parse_cache_misses")
+            return None
+        try:
+            # Access time is kept in mtime, because atime is often disabled
+            os.utime(path)
+        except OSError:
+            pass
+        self.hits += 1
+        run_stats.count("parse_cache_hits")
+        return value
+
+    def put(self, key, value):
+        """
+        Store parsed model in cache and evict old entries if cache is too big
+        :param key: Key of cache entry
+        :param value: Parsed model
+        :return: None
+        """
+        import tempfile
+        if not self.is_usable():
+            return
+        fd, temp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        try:
+            with os.fdopen(fd, 'wb') as file:
+                pickle.dump(value, file, protocol=pickle.HIGHEST_PROTOCOL)
+                size = file.tell()
+            os.replace(temp_path, self._path(key))
+        except Exception:
+            os.unlink(temp_path)
+            raise
+        if self._size is None:
+            self.evict(int(self.max_size * EVICT_TO_FRACTION))
+            return
+        # Replaced entry is counted twice, so eviction could only come earlier
+        self._size += size
+        if self._size > self.max_size:
+            self.evict(int(self.max_size * EVICT_TO_FRACTION))
+
+    def evict(self, target_size=None):
+        """
+        Remove the least recently used entries if size of cache exceeds max_size
+        :param target_size: Size to which cache is reduced, by default max_size
+        :return: Number of removed entries
+        """
+        entries = []
+        total_size = 0
+        for entry in os.scandir(self.cache_dir):
+            if entry.name.endswith(".pickle"):
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    # Entry was evicted by other process
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+                total_size += stat.st_size
+        removed = 0
+        if total_size <= self.max_size:
+            entries = []
+        elif target_size is None:
+            target_size = self.max_size
+        for mtime, size, path in sorted(entries):
+            if total_size <= target_size:
+                break
+            try:
+                os.unlink(path)
+            except OSError:
+                continue
+            total_size -= size
+            removed += 1
+        self._size = total_size
+        return removed
+
+    def clear(self):
+        """
+        Remove all entries of cache
+        :return: None
+        """
+        if os.path.isdir(self.cache_dir):
+            for entry in os.scandir(self.cache_dir):
+                if entry.name.endswith(".pickle"):
+                    os.unlink(entry.path)
+        self._size = 0
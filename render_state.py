@@ -0,0 +1,116 @@
+import hashlib
+import json
+import os
+
+from output_writer import write_output
+
+STATE_FILE = ".commonapi_render_state.json"
+STATE_VERSION = 1
+
+
+def template_digest(template_file):
+    """
+    Hash of content of template, templates included or extended by it are not hashed
+    :param template_file: Path to template
+    :return: Hex digest
+    """
+    with open(template_file, 'rb') as file:
+        return hashlib.sha256(file.read()).hexdigest()
+
+
+class RenderState:
+    """
+    Class for remembering inputs from which every generated file was rendered:
+    fingerprint of interface, content of template and date.
+    Generated file is rendered again only if one of them was changed or file was removed.
+    State is kept in STATE_FILE of output directory, only results of successfully generated files are stored
+    """
+    def __init__(self, dir_to_save, load=True):
+        """
+        :param dir_to_save: Directory for generated files
+        :param load: If False, state of previous run is not loaded, for example when it is kept only in memory
+        """
+        self.dir_to_save = dir_to_save
+        self.path = os.path.join(dir_to_save, STATE_FILE)
+        # Output relative to dir_to_save -> render key
+        self.keys = {}
+        self.updates = {}
+        self._template_digests = {}
+        if not load:
+            return
+        try:
+            with open(self.path) as file:
+                state = json.load(file)
+        except (OSError, ValueError):
+            return
+        if isinstance(state, dict) and state.get("version") == STATE_VERSION and \
+                isinstance(state.get("outputs"), dict):
+            self.keys = state["outputs"]
+
+    def _name(self, output):
+        return os.path.relpath(output, self.dir_to_save)
+
+    def key(self, fingerprint, template_file, date):
+        """
+        Render key of pair (interface, template)
+        :param fingerprint: Fingerprint of resolved Interface
+        :param template_file: Path to template
+        :param date: Date placed into generated files
+        :return: Hex digest
+        """
+        digest = self._template_digests.get(template_file)
+        if digest is None:
+            digest = template_digest(template_file)
+            self._template_digests[template_file] = digest
+        return hashlib.sha256("\0".join([fingerprint, digest, date or ""]).encode("utf-8")).hexdigest()
+
+    def forget_templates(self):
+        """
+        Hash templates again on the next use, it is needed when process outlives edits of templates
+        :return: None
+        """
+        self._template_digests = {}
+
+    def is_fresh(self, output, key):
+        """
+        Check whether generated file was rendered with the same key and still exists
+        :param output: Path to generated file
+        :param key: Result of key
+        :return: True if file does not need to be rendered
+        """
+        return self.keys.get(self._name(output)) == key and os.path.isfile(output)
+
+    def update(self, output, key):
+        """
+        Remember key of rendered file, it is stored only after merge
+        :param output: Path to generated file
+        :param key: Result of key
+        :return: None
+        """
+        self.updates[output] = key
+
+    def take_updates(self):
+        """
+        Take keys remembered since the previous call
+        :return: Dictionary path to generated file -> key
+        """
+        updates = self.updates
+        self.updates = {}
+        return updates
+
+    def merge(self, updates):
+        """
+        Store keys of successfully generated files, for example the ones returned by worker process
+        :param updates: Result of take_updates
+        :return: None
+        """
+        for output, key in updates.items():
+            self.keys[self._name(output)] = key
+
+    def save(self):
+        """
+        Write state to output directory
+        :return: None
+        """
+        content = json.dumps({"version": STATE_VERSION, "outputs": self.keys}, indent=1, sort_keys=True) + "\n"
+        write_output(self.path, content, only_if_changed=True)
@@ -0,0 +1,224 @@
+import os
+import time
+from contextlib import contextmanager
+
+_active = None
+
+
+class _Phase:
+    """
+    Class for counting items handled inside of one measured phase
+    """
+    __slots__ = ("items",)
+
+    def __init__(self):
+        self.items = 0
+
+    def count(self, items=1):
+        self.items += items
+
+
+class _NullPhase:
+    """
+    Phase that is used when instrumentation is disabled, it counts nothing
+    """
+    __slots__ = ()
+
+    def count(self, items=1):
+        pass
+
+
+_null_phase = _NullPhase()
+
+
+class RunStats:
+    """
+    Class for collecting wall time, number of calls and number of handled items
+    of every phase of generation run, in total and per fidl-file.
+    Time of nested phases is included into time of outer phase
+    """
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.phases = {}
+        self.files = {}
+        self.counters = {}
+        # Name of phase -> [start, end] as time.time(), it spans all measurements of phase, also concurrent ones
+        self.windows = {}
+        self.current_file = None
+
+    def add(self, phase, seconds, items=0, fidl_file=None):
+        """
+        Add one measurement of phase
+        :param phase: Name of phase
+        :param seconds: Wall time of phase
+        :param items: Number of items handled by phase
+        :param fidl_file: fidl-file to which measurement belongs
+        :return: None
+        """
+        _add_to(self.phases, phase, seconds, 1, items)
+        if fidl_file is not None:
+            _add_to(self.files.setdefault(fidl_file, {}), phase, seconds, 1, items)
+
+    def count(self, counter, value=1):
+        """
+        Increase counter which is not bound to any phase, for example number of cache hits
+        :param counter: Name of counter
+        :param value: Increment
+        :return: None
+        """
+        self.counters[counter] = self.counters.get(counter, 0) + value
+
+    def extend_window(self, phase, start, end):
+        """
+        Extend wall-clock window of phase, so wall time of phase run in many threads or processes is known
+        :param phase: Name of phase
+        :param start: Start of measurement as time.time()
+        :param end: End of measurement as time.time()
+        :return: None
+        """
+        window = self.windows.get(phase)
+        if window is None:
+            self.windows[phase] = [start, end]
+        else:
+            window[0] = min(window[0], start)
+            window[1] = max(window[1], end)
+
+    def merge(self, report):
+        """
+        Add report of other RunStats, for example the one collected in worker process
+        :param report: Result of RunStats.report()
+        :return: None
+        """
+        for phase, values in report["phases"].items():
+            _add_to(self.phases, phase, values["time"], values["calls"], values["items"])
+        for fidl_file, phases in report["files"].items():
+            file_phases = self.files.setdefault(fidl_file, {})
+            for phase, values in phases.items():
+                _add_to(file_phases, phase, values["time"], values["calls"], values["items"])
+        for counter, value in report["counters"].items():
+            self.count(counter, value)
+        for phase, (start, end) in report["windows"].items():
+            self.extend_window(phase, start, end)
+
+    def report(self):
+        """
+        Machine-readable report
+        :return: Dictionary which could be dumped to JSON
+        """
+        return {"total_time": time.perf_counter() - self.started,
+                "phases": self.phases,
+                "files": self.files,
+                "counters": self.counters,
+                "windows": self.windows}
+
+    def take(self):
+        """
+        Get report and start collecting from scratch
+        :return: Result of RunStats.report()
+        """
+        report = self.report()
+        self.__init__()
+        return report
+
+
+def _add_to(phases, phase, seconds, calls, items):
+    values = phases.get(phase)
+    if values is None:
+        phases[phase] = {"time": seconds, "calls": calls, "items": items}
+    else:
+        values["time"] += seconds
+        values["calls"] += calls
+        values["items"] += items
+
+
+def enable(stats=None):
+    """
+    Start collecting of statistics in this process
+    :param stats: RunStats to which statistics is collected, new one if None
+    :return: Active RunStats
+    """
+    global _active
+    _active = stats if stats is not None else RunStats()
+    return _active
+
+
+def disable():
+    """
+    Stop collecting of statistics in this process
+    :return: RunStats that was active or None
+    """
+    global _active
+    stats = _active
+    _active = None
+    return stats
+
+
+def active():
+    """
+    :return: Active RunStats or None if statistics is not collected
+    """
+    return _active
+
+
+def count(counter, value=1):
+    """
+    Increase counter of active RunStats, it does nothing if statistics is not collected
+    :param counter: Name of counter
+    :param value: Increment
+    :return: None
+    """
+    if _active is not None:
+        _active.count(counter, value)
+
+
+def add(name, seconds, items=0):
+    """
+    Add measurement of phase that was timed elsewhere, for example in other thread.
+    It is accounted to fidl-file of current phase, it does nothing if statistics is not collected
+    :param name: Name of phase
+    :param seconds: Wall time of phase
+    :param items: Number of items handled by phase
+    :return: None
+    """
+    if _active is not None:
+        _active.add(name, seconds, items, _active.current_file)
+
+
+def window(name, start, end):
+    """
+    Extend wall-clock window of phase of active RunStats, it does nothing if statistics is not collected
+    :param name: Name of phase
+    :param start: Start of measurement as time.time()
+    :param end: End of measurement as time.time()
+    :return: None
+    """
+    if _active is not None:
+        _active.extend_window(name, start, end)
+
+
+@contextmanager
+def phase(name, fidl_file=None):
+    """
+    Measure wall time of block of code, it costs almost nothing if statistics is not collected.
+    Nested phases without fidl_file are accounted to fidl-file of outer phase
+    :param name: Name of phase
+    :param fidl_file: fidl-file handled by block
+    :return: Object with method count(items) for counting handled items
+    """
+    stats = _active
+    if stats is None:
+        yield _null_phase
+        return
+    outer_file = stats.current_file
+    if fidl_file is None:
+        fidl_file = outer_file
+    else:
+        fidl_file = os.path.abspath(fidl_file)
+    stats.current_file = fidl_file
+    measured = _Phase()
+    start = time.perf_counter()
+    try:
+        yield measured
+    finally:
+        stats.add(name, time.perf_counter() - start, measured.items, fidl_file)
+        stats.current_file = outer_file
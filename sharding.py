@@ -0,0 +1,208 @@
+import hashlib
+import json
+import os
+from collections import namedtuple
+
+from fidl_tokenizer import FidlParseError, scan_interfaces
+from fidl_source import read_fidl_file
+from output_writer import write_output
+
+SHARD_FORMAT = "commonapi-shard"
+SHARD_VERSION = 1
+
+# Estimated cost of job with empty interface body, in characters of body
+_JOB_OVERHEAD = 1024
+
+# Cost of shard could exceed average one at most by this factor, unless one job is bigger than that
+_LOAD_FACTOR = 1.25
+
+ShardJob = namedtuple("ShardJob", ["fidl_file", "interface", "key", "cost"])
+
+
+def parse_shard(shard):
+    """
+    Parse shard written as 'INDEX/COUNT', index is counted from 0
+    :param shard: String
+    :return: Tuple (index, count)
+    :raise ValueError: If shard is malformed or index is out of range
+    """
+    index, separator, count = shard.partition("/")
+    try:
+        index = int(index)
+        count = int(count)
+    except ValueError:
+        separator = None
+    if separator != "/" or count < 1 or not 0 <= index < count:
+        raise ValueError("shard should be INDEX/COUNT with 0 <= INDEX < COUNT, got " + repr(shard))
+    return index, count
+
+
+def _stable_hash(key):
+    """
+    Hash that does not depend on PYTHONHASHSEED, so every machine computes the same one
+    """
+    return hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest()
+
+
+def scan_jobs(fidl_files, interface_names=None):
+    """
+    List jobs (fidl-file, interface) of generation, only package and interface headers are scanned.
+    Job is identified by qualified name of interface, so it does not depend on location of checkout.
+    File which could not be scanned is one job, it is reported by the shard which gets it
+    :param fidl_files: List of fidl-files
+    :param interface_names: Names of generated interfaces, None means all interfaces
+    :return: List of ShardJob, cost of job is size of interface plus fixed overhead
+    """
+    jobs = []
+    for fidl_file in fidl_files:
+        try:
+            package_name, interfaces = scan_interfaces(read_fidl_file(fidl_file), fidl_file)
+        except (OSError, FidlParseError):
+            jobs.append(ShardJob(fidl_file, None, fidl_file, _JOB_OVERHEAD))
+            continue
+        for name, size in interfaces:
+            if interface_names is None or name in interface_names:
+                key = (package_name + "." if package_name else "") + name
+                jobs.append(ShardJob(fidl_file, name, key, size + _JOB_OVERHEAD))
+    return jobs
+
+
+def _score(key, shard):
+    """
+    Rendezvous score of job for shard, job prefers shards with higher score
+    """
+    return _stable_hash(key + "/" + str(shard))
+
+
+def assign_shards(jobs, count):
+    """
+    Assign jobs to shards by rendezvous hashing with bounded load: every job goes to the shard
+    with the highest stable hash of (key, shard) unless its cost would exceed the cap
+    of _LOAD_FACTOR times the average cost of shard, then it spills over to the next shard by hash.
+    Jobs are placed in order of stable hash of key, so adding or removing one job moves only few other jobs.
+    Assignment depends only on set of jobs, so every machine computes the same one
+    :param jobs: List of ShardJob
+    :param count: Number of shards
+    :return: List of shard indexes, one per job
+    """
+    cap = _LOAD_FACTOR * sum(job.cost for job in jobs) / count
+    order = sorted(range(len(jobs)), key=lambda i: (_stable_hash(jobs[i].key), jobs[i].key))
+    shards = [0] * len(jobs)
+    loads = [0] * count
+    for i in order:
+        job = jobs[i]
+        preferred = sorted(range(count), key=lambda shard: _score(job.key, shard), reverse=True)
+        shard = next((shard for shard in preferred if loads[shard] + job.cost <= cap),
+                     min(range(count), key=lambda shard: loads[shard]))
+        shards[i] = shard
+        loads[shard] += job.cost
+    return shards
+
+
+def select_shard(jobs, index, count):
+    """
+    Select jobs of one shard
+    :param jobs: List of ShardJob
+    :param index: Index of shard
+    :param count: Number of shards
+    :return: Dictionary fidl-file -> frozenset of names of its interfaces in shard,
+             None instead of names means whole file, fidl-files without jobs in shard are not included
+    """
+    selections = {}
+    for job, shard in zip(jobs, assign_shards(jobs, count)):
+        if shard != index:
+            continue
+        if job.interface is None:
+            selections[job.fidl_file] = None
+        else:
+            selections[job.fidl_file] = selections.get(job.fidl_file, frozenset()) | {job.interface}
+    return selections
+
+
+def jobs_digest(jobs):
+    """
+    Digest of set of jobs, shards computed from different sets of jobs could not be merged
+    :param jobs: List of ShardJob
+    :return: Hex digest
+    """
+    return hashlib.sha256("\n".join(sorted(job.key for job in jobs)).encode("utf-8")).hexdigest()
+
+
+def write_shard_manifest(manifest_file, index, count, jobs, dir_to_save, results):
+    """
+    Write JSON manifest of files generated by shard
+    :param manifest_file: Path to manifest
+    :param index: Index of shard
+    :param count: Number of shards
+    :param jobs: List of ShardJob of all shards
+    :param dir_to_save: Directory for generated files, outputs are stored relative to it
+    :param results: List of BatchResult of shard
+    :return: None
+    """
+    outputs = [os.path.relpath(output, dir_to_save) for result in results for output in result.outputs]
+    manifest = {"format": SHARD_FORMAT,
+                "version": SHARD_VERSION,
+                "shard": [index, count],
+                "jobs": jobs_digest(jobs),
+                "failed": sum(1 for result in results if result.error is not None),
+                "outputs": outputs}
+    write_output(manifest_file, json.dumps(manifest, indent=1) + "\n")
+
+
+def _load_shard_manifest(manifest_file):
+    with open(manifest_file) as file:
+        manifest = json.load(file)
+    if not isinstance(manifest, dict) or manifest.get("format") != SHARD_FORMAT or \
+            manifest.get("version") != SHARD_VERSION:
+        raise ValueError("not a " + SHARD_FORMAT + " manifest of version " + str(SHARD_VERSION))
+    return manifest
+
+
+def merge_shard_manifests(manifest_files, expected_outputs, dir_to_save):
+    """
+    Check that shards together generated every expected file exactly once
+    :param manifest_files: List of manifests written by write_shard_manifest
+    :param expected_outputs: Paths to files that would be generated without sharding, see list_outputs
+    :param dir_to_save: Directory for generated files
+    :return: Tuple (number of merged outputs, list of error messages), no errors means shards could be merged
+    """
+    errors = []
+    manifests = []
+    for manifest_file in manifest_files:
+        try:
+            manifests.append((manifest_file, _load_shard_manifest(manifest_file)))
+        except (OSError, ValueError) as ex:
+            errors.append(manifest_file + ": " + str(ex))
+    if errors:
+        return 0, errors
+    counts = {manifest["shard"][1] for _, manifest in manifests}
+    if len(counts) != 1:
+        errors.append("shards have different counts: " + ", ".join(str(count) for count in sorted(counts)))
+    if len({manifest["jobs"] for _, manifest in manifests}) != 1:
+        errors.append("shards were computed from different sets of fidl-files or interfaces")
+    owners = {}
+    for manifest_file, manifest in manifests:
+        index = manifest["shard"][0]
+        if index in owners:
+            errors.append(manifest_file + ": shard " + str(index) + " is also merged from " + owners[index])
+        owners[index] = manifest_file
+        if manifest["failed"]:
+            errors.append(manifest_file + ": shard " + str(index) + " failed on " + str(manifest["failed"]) +
+                          " fidl-files")
+    for count in counts:
+        for index in range(count):
+            if index not in owners:
+                errors.append("shard " + str(index) + "/" + str(count) + " is missing")
+    generated = {}
+    for manifest_file, manifest in manifests:
+        for output in manifest["outputs"]:
+            if output in generated:
+                errors.append(output + " is generated by " + generated[output] + " and " + manifest_file)
+            else:
+                generated[output] = manifest_file
+    expected = {os.path.relpath(output, dir_to_save) for output in expected_outputs}
+    for output in sorted(expected.difference(generated)):
+        errors.append(output + " is not generated by any shard")
+    for output in sorted(set(generated).difference(expected)):
+        errors.append(output + " is generated by " + generated[output] + ", but it is not expected")
+    return len(generated), errors
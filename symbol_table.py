@@ -0,0 +1,118 @@
+from commonapi_types import Interface, LazyInterface, split_type, is_builtin_type, _cpp_type_from
+
+
+def qualified_name(package_name, owner_name, type_name):
+    """
+    Fully-qualified name of user type: <package>.<interface or typeCollection>.<type>
+    :param package_name: Package name
+    :param owner_name: Name of interface or typeCollection in which type is declared
+    :param type_name: Name of type
+    :return: Fully-qualified name
+    """
+    return ".".join(part for part in (package_name, owner_name, type_name) if part)
+
+
+def _parameters_of(owner):
+    """
+    Iterate over all parameters which types should be resolved
+    :param owner: Interface or TypeCollection
+    :return: Generator of Parameter
+    """
+    for declaration in owner.types:
+        yield from declaration.fields
+    if isinstance(owner, Interface):
+        for method in owner.methods:
+            yield from method.inputs
+            if method.outputs:
+                yield from method.outputs
+        for broadcast in owner.broadcasts:
+            yield from broadcast.parameters
+        yield from owner.attributes
+
+
+class SymbolTable:
+    """
+    Class for O(1) lookup of user types declared in typeCollections and interfaces.
+    Resolved cpp types are memoized, so identical parameters are resolved once
+    """
+    def __init__(self):
+        self._types = {}
+        self._resolved = {}
+
+    def add(self, owner):
+        """
+        Add all types declared in interface or typeCollection,
+        types of LazyInterface are added when its members are parsed
+        :param owner: Interface or TypeCollection
+        :return: None
+        """
+        if isinstance(owner, LazyInterface) and not owner.is_loaded:
+            owner.after_load(self.add)
+            return
+        for declaration in owner.types:
+            self._types[qualified_name(owner.package_name, owner.name, declaration.name)] = (owner, declaration)
+
+    def add_document(self, document):
+        """
+        Add all types declared in fidl-file
+        :param document: FidlDocument
+        :return: None
+        """
+        for type_collection in document.type_collections:
+            self.add(type_collection)
+        for interface in document.interfaces:
+            self.add(interface)
+
+    def lookup(self, name):
+        """
+        Find user type by fully-qualified name
+        :param name: Fully-qualified name, for example 'org.example.Types.tPoint'
+        :return: Tuple (owner, TypeDeclaration) or None if type is unknown
+        """
+        return self._types.get(name)
+
+    def __len__(self):
+        return len(self._types)
+
+    def cpp_type(self, owner, type_collections, fidl_type):
+        """
+        Resolve commonapi type used inside of owner to cpp type.
+        Unqualified user type is looked up in owner first, then in visible typeCollections
+        :param owner: Interface or TypeCollection in which type is used
+        :param type_collections: typeCollections visible from owner
+        :param fidl_type: commonapi type
+        :return: cpp type
+        """
+        key = (owner.package_name, owner.name, fidl_type)
+        cpp_type = self._resolved.get(key)
+        if cpp_type is None:
+            base_type, is_array = split_type(fidl_type)
+            type_namespace = None
+            if not is_builtin_type(base_type) and "." not in base_type:
+                if qualified_name(owner.package_name, owner.name, base_type) in self._types:
+                    type_namespace = owner.name
+                else:
+                    for type_collection in type_collections:
+                        if qualified_name(type_collection.package_name, type_collection.name,
+                                          base_type) in self._types:
+                            type_namespace = type_collection.name
+                            break
+            cpp_type = _cpp_type_from(type_namespace, fidl_type)
+            self._resolved[key] = cpp_type
+        return cpp_type
+
+    def resolve(self, owner, type_collections=()):
+        """
+        Resolve cpp types of all parameters, attributes and fields of owner,
+        LazyInterface is resolved when its members are parsed
+        :param owner: Interface or TypeCollection
+        :param type_collections: typeCollections visible from owner
+        :return: None
+        """
+        if isinstance(owner, LazyInterface) and not owner.is_loaded:
+            owner.after_load(lambda interface: self.resolve(interface, type_collections))
+            return
+        for parameter in _parameters_of(owner):
+            parameter.type = self.cpp_type(owner, type_collections, parameter.fidl_type)
+        # Resolved types are part of fingerprint
+        owner.forget_fingerprint()
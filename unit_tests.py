@@ -1,21 +1,63 @@
 import unittest
 import argparse
+import contextlib
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
 import regex as re
+import xml.etree.ElementTree as ElementTree
+from concurrent.futures import ProcessPoolExecutor
 from os.path import isfile
 
-from fidl_parser import parse_interfaces
+from fidl_parser import parse_interfaces, REGEX_ENGINE, DESCENT_ENGINE, ENGINES
+from fidl_source import read_fidl_file
+from fidl_tokenizer import FidlParseError, parse_time_limit
 
 __type_regex = r"[\.\w]+\s*(\[\])?"
 __method_regex = r"\s*method\s+(\w+)\s*(fireAndForget)?\s*\{"
 __method = re.compile(__method_regex)
-__broadcast_regex = r"\s*broadcast\s+(\w+)\s*\{"
+__broadcast_regex = r"\s*broadcast\s+(\w+)\s*(selective)?\s*\{"
 __broadcast = re.compile(__broadcast_regex)
 __attribute_regex = r"\s*attribute\s+(" + __type_regex + r")\s+(\w+)\s*(readonly)?\s*\n"
 __attribute = re.compile(__attribute_regex)
 __array_regex = r"\s*array\s+(\w+)\s+of\s+(" + __type_regex + r")\s*\n"
 __array = re.compile(__array_regex)
-__interface_regex = r"\s*interface\s+(\w+)\s*\{"
+__interface_regex = r"\s*interface\s+(?P<interface_name>\w+)\s*\{"
 __interface = re.compile(__interface_regex)
+__declaration = re.compile(r"(?P<interfaces>" + __interface_regex + r")|" +
+                           r"(?P<methods>" + __method_regex + r")|" +
+                           r"(?P<broadcasts>" + __broadcast_regex + r")|" +
+                           r"(?P<attributes>" + __attribute_regex + r")")
+
+DECLARATION_KINDS = ["interfaces", "methods", "broadcasts", "attributes"]
+
+
+def count_declarations(file_lines):
+    """
+    This function calculates in one pass numbers of interfaces, methods, broadcasts and attributes,
+    in total and per interface
+    :param file_lines: Text of fidl file
+    :return: Tuple (dictionary kind -> number, dictionary interface name -> dictionary kind -> number)
+    """
+    totals = dict.fromkeys(DECLARATION_KINDS, 0)
+    per_interface = {}
+    current = None
+    for declaration_meta in __declaration.finditer(file_lines):
+        kind = declaration_meta.lastgroup
+        totals[kind] += 1
+        if kind == "interfaces":
+            current = per_interface.setdefault(declaration_meta.group("interface_name"),
+                                               dict.fromkeys(DECLARATION_KINDS[1:], 0))
+        elif current is not None:
+            current[kind] += 1
+    return totals, per_interface
+
+
+def _number_of(fidl_file, kind):
+    return count_declarations(read_fidl_file(fidl_file))[0][kind]
 
 
 def number_of_interfaces(fidl_file):
@@ -24,14 +66,7 @@ def number_of_interfaces(fidl_file):
     :param fidl_file: Fidl file for simple parsing
     :return: Number of interfaces
     """
-    num = 0
-    with open(fidl_file, 'r') as file:
-        file_lines = file.readlines()
-        file_lines = "".join(file_lines)
-        interfaces_meta = __interface.findall(file_lines)
-        if interfaces_meta:
-            num += len(interfaces_meta)
-    return num
+    return _number_of(fidl_file, "interfaces")
 
 
 def number_of_methods(fidl_file):
@@ -40,14 +75,7 @@ def number_of_methods(fidl_file):
     :param fidl_file: Fidl file for simple parsing
     :return: Number of methods
     """
-    num = 0
-    with open(fidl_file, 'r') as file:
-        file_lines = file.readlines()
-        file_lines = "".join(file_lines)
-        methods_meta = __method.findall(file_lines)
-        if methods_meta:
-            num += len(methods_meta)
-    return num
+    return _number_of(fidl_file, "methods")
 
 
 def number_of_broadcasts(fidl_file):
@@ -56,14 +84,7 @@ def number_of_broadcasts(fidl_file):
     :param fidl_file: Fidl file for simple parsing
     :return: Number of broadcasts
     """
-    num = 0
-    with open(fidl_file, 'r') as file:
-        file_lines = file.readlines()
-        file_lines = "".join(file_lines)
-        broadcasts_meta = __broadcast.findall(file_lines)
-        if broadcasts_meta:
-            num += len(broadcasts_meta)
-    return num
+    return _number_of(fidl_file, "broadcasts")
 
 
 def number_of_attributes(fidl_file):
@@ -72,63 +93,1523 @@ def number_of_attributes(fidl_file):
     :param fidl_file: Fidl file for simple parsing
     :return: Number of attributes
     """
-    num = 0
-    with open(fidl_file, 'r') as file:
-        file_lines = file.readlines()
-        file_lines = "".join(file_lines)
-        attributes_meta = __attribute.findall(file_lines)
-        if attributes_meta:
-            num += len(attributes_meta)
-    return num
+    return _number_of(fidl_file, "attributes")
+
+
+def describe_parameters(parameters):
+    """
+    This function converts parameters to comparable tuples
+    :param parameters: List of Parameter or None
+    :return: Tuple of (type, name, description) or None
+    """
+    if parameters is None:
+        return None
+    return tuple((param.type, param.name, param.description) for param in parameters)
+
+
+def describe_types(declarations):
+    """
+    This function converts type declarations to comparable tuples
+    :param declarations: List of TypeDeclaration
+    :return: Tuple of (kind, name, description, extends, fields, enumerators)
+    """
+    return tuple((declaration.kind, declaration.name, declaration.description, declaration.extends,
+                  describe_parameters(declaration.fields), tuple(declaration.enumerators))
+                 for declaration in declarations)
+
+
+def describe_interfaces(interfaces):
+    """
+    This function converts parsed interfaces to comparable tuples
+    :param interfaces: List of Interface
+    :return: Tuple with all meta-information of interfaces
+    """
+    result = []
+    for interface in interfaces:
+        result.append((
+            interface.package_name, interface.name, interface.description,
+            interface.major, interface.minor, interface.is_settable_attribute,
+            tuple((method.name, method.description,
+                   describe_parameters(method.inputs), describe_parameters(method.outputs))
+                  for method in interface.methods),
+            tuple((broadcast.name, broadcast.description, broadcast.is_selective,
+                   describe_parameters(broadcast.parameters))
+                  for broadcast in interface.broadcasts),
+            tuple((attribute.type, attribute.name, attribute.description, attribute.is_read_only)
+                  for attribute in interface.attributes),
+            describe_types(interface.types),
+            tuple((type_collection.package_name, type_collection.name, type_collection.description,
+                   type_collection.major, type_collection.minor, describe_types(type_collection.types))
+                  for type_collection in interface.type_collections)))
+    return tuple(result)
+
+
+def engines_are_equivalent(fidl_file):
+    """
+    This function checks that regex and descent parser engines give the same result
+    :param fidl_file: Fidl file for parsing
+    :return: True if results are the same, False - otherwise
+    """
+    return describe_interfaces(parse_interfaces(fidl_file, REGEX_ENGINE)) == \
+        describe_interfaces(parse_interfaces(fidl_file, DESCENT_ENGINE))
+
+
+def validate_fidl_file(fidl_file, engine=REGEX_ENGINE, compare_engines=False, parse_timeout=None):
+    """
+    This function reads fidl_file once, counts declarations and checks that parser finds all of them
+    :param fidl_file: Fidl file for validation
+    :param engine: Parser engine
+    :param compare_engines: Check also that all parser engines give the same result
+    :param parse_timeout: Time budget of parsing of fidl_file in seconds, None means unlimited
+    :return: Dictionary with fidl_file, expected and parsed counts, list of mismatches, error
+             and error_location (line and column of parse error)
+    """
+    result = {"fidl_file": fidl_file, "expected": None, "parsed": None, "mismatches": [], "error": None,
+              "error_location": None}
+    try:
+        file_lines = read_fidl_file(fidl_file)
+        expected, expected_per_interface = count_declarations(file_lines)
+        with contextlib.redirect_stdout(io.StringIO()), parse_time_limit(parse_timeout):
+            interfaces = parse_interfaces(fidl_file, engine, source=file_lines)
+            if compare_engines:
+                other_engine = DESCENT_ENGINE if engine == REGEX_ENGINE else REGEX_ENGINE
+                other_interfaces = parse_interfaces(fidl_file, other_engine, source=file_lines)
+        parsed = {"interfaces": len(interfaces),
+                  "methods": sum(len(interface.methods) for interface in interfaces),
+                  "broadcasts": sum(len(interface.broadcasts) for interface in interfaces),
+                  "attributes": sum(len(interface.attributes) for interface in interfaces)}
+        result["expected"] = expected
+        result["parsed"] = parsed
+        if expected["interfaces"] != parsed["interfaces"]:
+            result["mismatches"].append({"interface": None, "kind": "interfaces",
+                                         "expected": expected["interfaces"], "parsed": parsed["interfaces"]})
+        for interface in interfaces:
+            interface_expected = expected_per_interface.get(interface.name)
+            if interface_expected is None:
+                continue
+            for kind in DECLARATION_KINDS[1:]:
+                if interface_expected[kind] != len(getattr(interface, kind)):
+                    result["mismatches"].append({"interface": interface.name, "kind": kind,
+                                                 "expected": interface_expected[kind],
+                                                 "parsed": len(getattr(interface, kind))})
+        if compare_engines and describe_interfaces(interfaces) != describe_interfaces(other_interfaces):
+            result["mismatches"].append({"interface": None, "kind": "engines",
+                                         "expected": engine, "parsed": other_engine})
+    except FidlParseError as ex:
+        result["error"] = str(ex)
+        if ex.line is not None:
+            result["error_location"] = {"line": ex.line, "column": ex.column}
+    except Exception as ex:
+        result["error"] = str(ex) or type(ex).__name__
+    return result
+
+
+def validate_corpus(fidl_files, engine=REGEX_ENGINE, compare_engines=False, jobs=None, parse_timeout=None):
+    """
+    This function validates fidl files in parallel
+    :param fidl_files: List of fidl files
+    :param engine: Parser engine
+    :param compare_engines: Check also that all parser engines give the same result
+    :param jobs: Number of worker processes, None means number of CPUs
+    :param parse_timeout: Time budget of parsing of one fidl file in seconds, None means unlimited
+    :return: List of results of validate_fidl_file in the same order as fidl_files
+    """
+    if jobs is None:
+        jobs = os.cpu_count() or 1
+    jobs = min(jobs, len(fidl_files))
+    if jobs <= 1:
+        return [validate_fidl_file(fidl_file, engine, compare_engines, parse_timeout) for fidl_file in fidl_files]
+    chunksize = max(1, len(fidl_files) // (jobs * 4))
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        return list(executor.map(validate_fidl_file, fidl_files,
+                                 [engine] * len(fidl_files), [compare_engines] * len(fidl_files),
+                                 [parse_timeout] * len(fidl_files),
+                                 chunksize=chunksize))
+
+
+def describe_mismatch(mismatch):
+    """
+    This function converts mismatch to human-readable message
+    :param mismatch: Dictionary from result of validate_fidl_file
+    :return: Message
+    """
+    if mismatch["kind"] == "engines":
+        return mismatch["expected"] + " and " + mismatch["parsed"] + " engines give different results"
+    location = "interface " + mismatch["interface"] + ": " if mismatch["interface"] else ""
+    return location + mismatch["kind"] + " expected " + str(mismatch["expected"]) + \
+        ", parsed " + str(mismatch["parsed"])
+
+
+def write_json_report(report_file, results):
+    """
+    This function writes results of validation as JSON
+    :param report_file: Path to report
+    :param results: List of results of validate_fidl_file
+    :return: None
+    """
+    with open(report_file, 'w') as file:
+        json.dump({"fidl_files": len(results),
+                   "failed": sum(1 for result in results if result["mismatches"] or result["error"]),
+                   "results": results}, file, indent=2)
+
+
+def write_junit_report(report_file, results):
+    """
+    This function writes results of validation as JUnit XML, one testcase per fidl file
+    :param report_file: Path to report
+    :param results: List of results of validate_fidl_file
+    :return: None
+    """
+    suite = ElementTree.Element("testsuite", name="fidl-corpus", tests=str(len(results)),
+                                failures=str(sum(1 for result in results if result["mismatches"])),
+                                errors=str(sum(1 for result in results if result["error"])))
+    for result in results:
+        case = ElementTree.SubElement(suite, "testcase", classname="fidl",
+                                      name=result["fidl_file"])
+        if result["error"]:
+            ElementTree.SubElement(case, "error", message=result["error"])
+        elif result["mismatches"]:
+            messages = [describe_mismatch(mismatch) for mismatch in result["mismatches"]]
+            failure = ElementTree.SubElement(case, "failure", message=messages[0])
+            failure.text = "\n".join(messages)
+    ElementTree.ElementTree(suite).write(report_file, encoding="utf-8", xml_declaration=True)
+
+
+def import_times(code, *args):
+    """
+    This function runs python with -X importtime in fresh process
+    :param code: Python code or path to script
+    :param args: Arguments of script, if they are given code is path to script
+    :return: Dictionary module -> cumulative import time in microseconds
+    """
+    env = dict(os.environ)
+    # Bytecode should be cached, otherwise compilation of changed modules is measured
+    env.pop("PYTHONDONTWRITEBYTECODE", None)
+    command = [sys.executable, "-X", "importtime"] + (["-c", code] if not args else [code] + list(args))
+    times = {}
+    for _ in range(2):
+        process = subprocess.run(command, cwd=os.path.dirname(os.path.abspath(__file__)), env=env,
+                                 stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, universal_newlines=True)
+        times = {}
+        for line in process.stderr.splitlines():
+            if line.startswith("import time:") and "|" in line:
+                _, cumulative, module = line.split("|")
+                if cumulative.strip().isdigit():
+                    times[module.strip()] = int(cumulative)
+    return times
+
+
+TEST_FIDL_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "test_fidl")
+
+
+def describe_golden(interfaces):
+    """
+    This function converts parsed interfaces to lists in format of golden files in test_fidl/golden,
+    they contain only meta-information that was parsed by the original regex parser
+    :param interfaces: List of Interface
+    :return: List of dictionaries, one per interface
+    """
+    def parameters_of(parameters):
+        if parameters is None:
+            return None
+        return [[param.type, param.name, param.description] for param in parameters]
+    return [{"package_name": interface.package_name, "name": interface.name, "description": interface.description,
+             "major": interface.major, "minor": interface.minor,
+             "is_settable_attribute": interface.is_settable_attribute,
+             "methods": [[method.name, method.description, parameters_of(method.inputs),
+                          parameters_of(method.outputs)] for method in interface.methods],
+             "broadcasts": [[broadcast.name, broadcast.description, broadcast.is_selective,
+                             parameters_of(broadcast.parameters)] for broadcast in interface.broadcasts],
+             "attributes": [[attribute.type, attribute.name, attribute.description, attribute.is_read_only]
+                            for attribute in interface.attributes],
+             "type_collections": [[type_collection.package_name, type_collection.name, type_collection.description,
+                                   type_collection.major, type_collection.minor]
+                                  for type_collection in interface.type_collections]}
+            for interface in interfaces]
+
+
+class GoldenTestCase(unittest.TestCase):
+    """
+    Both parser engines give the same meta-information as the original regex parser,
+    its output for sample fidl-files is frozen in test_fidl/golden
+    """
+    def test_engines_match_golden(self):
+        golden_dir = os.path.join(TEST_FIDL_DIR, "golden")
+        for golden_file in sorted(os.listdir(golden_dir)):
+            fidl_file = os.path.join(TEST_FIDL_DIR, os.path.splitext(golden_file)[0] + ".fidl")
+            with open(os.path.join(golden_dir, golden_file)) as file:
+                golden = json.load(file)
+            for engine in ENGINES:
+                with self.subTest(fidl_file=fidl_file, engine=engine):
+                    with contextlib.redirect_stdout(io.StringIO()):
+                        interfaces = parse_interfaces(fidl_file, engine)
+                    self.assertEqual(describe_golden(interfaces), golden)
+
+
+class TypeResolutionTestCase(unittest.TestCase):
+    """
+    User types are resolved through declarations of interface and imported typeCollections.
+    The original regex parser guessed namespace from leading 't', so here output differs from it:
+    imported tPoint was 'Types::tPoint', local eMode was 'eMode' and unknown tUnknown was 'Types::tUnknown'
+    """
+    def test_imported_local_and_unknown_types(self):
+        fidl_file = os.path.join(TEST_FIDL_DIR, "TypeResolution.fidl")
+        expected_parameters = [("point", "MyBestTypes::tPoint"),
+                               ("points", "std::vector<MyBestTypes::tPoints>"),
+                               ("color", "MyBestTypes::eColor"),
+                               ("local", "Types::tLocal"),
+                               ("mode", "Types::eMode"),
+                               ("missing", "tUnknown"),
+                               ("other", "Unknown")]
+        for engine in ENGINES:
+            with self.subTest(engine=engine):
+                with contextlib.redirect_stdout(io.StringIO()):
+                    interface, = parse_interfaces(fidl_file, engine)
+                self.assertEqual([(param.name, param.type) for method in interface.methods for param in method.inputs],
+                                 expected_parameters)
+                self.assertEqual([(attribute.name, attribute.type) for attribute in interface.attributes],
+                                 [("Id", "MyBestTypes::tId")])
+
+
+class CorpusTestCase(unittest.TestCase):
+    """
+    Base of test cases working with synthetic corpus of benchmarks.generate_corpus
+    """
+    DATE = "2020-01-01"
+
+    @classmethod
+    def setUpClass(cls):
+        from benchmarks import generate_corpus
+        cls.dir_path = tempfile.mkdtemp()
+        cls.fidl_files = generate_corpus(os.path.join(cls.dir_path, "fidl"), num_files=3, num_interfaces=3,
+                                         num_methods=5, comment_size=20)
+        package_dir = os.path.dirname(os.path.abspath(__file__))
+        cls.templates = [os.path.join(package_dir, "CommonAPIClientDefault.hpp.jinja2"),
+                         os.path.join(package_dir, "CommonAPIServiceDefault.hpp.jinja2")]
+
+    @classmethod
+    def tearDownClass(cls):
+        import shutil
+        shutil.rmtree(cls.dir_path)
+
+    def generate(self, name, **options):
+        """
+        Generate corpus into new directory
+        :return: Tuple (directory, list of BatchResult)
+        """
+        from wrapper_generator import generate_batch
+        dir_to_save = os.path.join(self.dir_path, name)
+        os.makedirs(dir_to_save, exist_ok=True)
+        options.setdefault("fidl_files", self.fidl_files)
+        options.setdefault("date", self.DATE)
+        with contextlib.redirect_stdout(io.StringIO()):
+            results = generate_batch(self.templates, options.pop("fidl_files"), dir_to_save, **options)
+        for result in results:
+            self.assertIsNone(result.error)
+        return dir_to_save, results
+
+    def run_main(self, *argv):
+        """
+        Run command line of wrapper generator without cache
+        :return: Tuple (exit code, stdout, stderr)
+        """
+        from wrapper_generator import main
+        stdout = io.StringIO()
+        stderr = io.StringIO()
+        cwd = os.getcwd()
+        try:
+            with contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(stderr):
+                code = main(list(argv) + ["--no-cache"])
+        finally:
+            os.chdir(cwd)
+        return code, stdout.getvalue(), stderr.getvalue()
+
+    def copy_corpus(self, name):
+        """
+        Copy corpus to new directory, so it could be changed
+        :return: List of copied fidl-files
+        """
+        import shutil
+        fidl_dir = os.path.join(self.dir_path, name)
+        shutil.copytree(os.path.dirname(self.fidl_files[0]), fidl_dir)
+        return [os.path.join(fidl_dir, os.path.basename(fidl_file)) for fidl_file in self.fidl_files]
+
+    def add_method(self, fidl_file, interface_name):
+        """
+        Add method to interface of fidl-file
+        """
+        with open(fidl_file) as file:
+            text = file.read()
+        with open(fidl_file, 'w') as file:
+            file.write(text.replace("interface " + interface_name + " {\n",
+                                    "interface " + interface_name + " {\n  method added {}\n"))
+
+    def read_outputs(self, dir_to_save):
+        """
+        Read generated files
+        :return: Dictionary name of file -> content
+        """
+        from render_state import STATE_FILE
+        contents = {}
+        for name in os.listdir(dir_to_save):
+            if name != STATE_FILE:
+                with open(os.path.join(dir_to_save, name)) as file:
+                    contents[name] = file.read()
+        return contents
+
+
+class EnginesTestCase(CorpusTestCase):
+    """
+    Regex and descent parser engines give the same model and the same generated files
+    """
+    def test_engines_give_same_model(self):
+        for fidl_file in self.fidl_files:
+            with contextlib.redirect_stdout(io.StringIO()):
+                self.assertTrue(engines_are_equivalent(fidl_file), fidl_file)
+
+    def test_engines_give_same_outputs(self):
+        regex_dir, _ = self.generate("regex", engine=REGEX_ENGINE)
+        descent_dir, _ = self.generate("descent", engine=DESCENT_ENGINE)
+        outputs = self.read_outputs(regex_dir)
+        self.assertEqual(len(outputs), 2 * 3 * 3)
+        self.assertEqual(outputs, self.read_outputs(descent_dir))
+
+
+class IncrementalTestCase(CorpusTestCase):
+    """
+    Test fingerprints of interfaces and rendering of only changed interfaces
+    """
+    def fingerprints(self, fidl_files, engine=REGEX_ENGINE):
+        with contextlib.redirect_stdout(io.StringIO()):
+            return {interface.name: interface.fingerprint
+                    for fidl_file in fidl_files for interface in parse_interfaces(fidl_file, engine)}
+
+    def test_engines_give_same_fingerprints(self):
+        self.assertEqual(self.fingerprints(self.fidl_files, REGEX_ENGINE),
+                         self.fingerprints(self.fidl_files, DESCENT_ENGINE))
+
+    def test_fingerprint_changes_only_for_changed_interface(self):
+        fidl_files = self.copy_corpus("fingerprint_fidl")
+        before = self.fingerprints(fidl_files)
+        self.assertEqual(len(set(before.values())), len(before))
+        self.add_method(fidl_files[1], "Service1x2")
+        after = self.fingerprints(fidl_files)
+        self.assertEqual([name for name in before if before[name] != after[name]], ["Service1x2"])
+
+    def test_incremental_renders_only_changed_interface(self):
+        from render_state import RenderState
+        fidl_files = self.copy_corpus("incremental_fidl")
+        dir_to_save = os.path.join(self.dir_path, "incremental")
+        for _ in range(2):
+            render_state = RenderState(dir_to_save)
+            _, results = self.generate("incremental", fidl_files=fidl_files, render_state=render_state)
+            render_state.save()
+        self.assertEqual([result.unchanged for result in results], [result.outputs for result in results])
+        self.add_method(fidl_files[1], "Service1x2")
+        render_state = RenderState(dir_to_save)
+        _, results = self.generate("incremental", fidl_files=fidl_files, render_state=render_state)
+        render_state.save()
+        rendered = [output for result in results for output in result.outputs if output not in result.unchanged]
+        self.assertEqual(sorted(os.path.basename(output) for output in rendered),
+                         ["Service1x2Client.hpp", "Service1x2Service.hpp"])
+        full_dir, _ = self.generate("incremental_full", fidl_files=fidl_files)
+        self.assertEqual(self.read_outputs(dir_to_save), self.read_outputs(full_dir))
+        # Date is part of key of rendered file
+        _, results = self.generate("incremental", fidl_files=fidl_files, render_state=RenderState(dir_to_save),
+                                   date="2021-01-01")
+        self.assertEqual([result.unchanged for result in results], [[]] * len(fidl_files))
+
+
+class WatchTestCase(CorpusTestCase):
+    """
+    Test that watch regenerates only files affected by changes
+    """
+    def test_only_affected_files_are_regenerated(self):
+        from wrapper_generator import watch
+        fidl_files = self.copy_corpus("watch_fidl")
+        fidl_dir = os.path.dirname(fidl_files[0])
+        dir_to_save = os.path.join(self.dir_path, "watch")
+        os.makedirs(dir_to_save)
+        inodes = []
+
+        def change_files(interval):
+            self.assertEqual(interval, 0.5)
+            inodes.append({name: os.stat(os.path.join(dir_to_save, name)).st_ino for name in os.listdir(dir_to_save)})
+            if len(inodes) == 1:
+                self.add_method(fidl_files[1], "Service1x2")
+                with open(os.path.join(fidl_dir, "New.fidl"), "w") as file:
+                    file.write(HELLO_WORLD_FIDL)
+        stdout = io.StringIO()
+        with contextlib.redirect_stdout(stdout):
+            exit_code = watch(self.templates, [fidl_dir], dir_to_save, max_polls=3, sleep=change_files, date=self.DATE)
+        self.assertEqual(exit_code, 0)
+        self.assertEqual(len(inodes), 2)
+        first, second = inodes
+        self.assertEqual(len(first), 2 * 3 * 3)
+        self.assertEqual(sorted(name for name in second if first.get(name) != second[name]),
+                         ["HelloWorldClient.hpp", "HelloWorldService.hpp",
+                          "Service1x2Client.hpp", "Service1x2Service.hpp"])
+        # The third poll finds no changes, so nothing is generated
+        self.assertEqual(len([line for line in stdout.getvalue().splitlines() if line.startswith("Generated")]), 2)
+        full_dir, _ = self.generate("watch_full", fidl_files=fidl_files + [os.path.join(fidl_dir, "New.fidl")])
+        self.assertEqual(self.read_outputs(dir_to_save), self.read_outputs(full_dir))
+
+    def test_changed_template_regenerates_everything(self):
+        import shutil
+        from wrapper_generator import watch
+        templates = []
+        for template_file in self.templates:
+            templates.append(os.path.join(self.dir_path, os.path.basename(template_file)))
+            shutil.copy(template_file, templates[-1])
+        dir_to_save = os.path.join(self.dir_path, "watch_templates")
+        os.makedirs(dir_to_save)
+        polls = []
+
+        def change_template(interval):
+            polls.append(interval)
+            with open(templates[0], "a") as file:
+                file.write("// changed\n")
+        with contextlib.redirect_stdout(io.StringIO()):
+            watch(templates, self.fidl_files, dir_to_save, interval=0.01, max_polls=2, sleep=change_template,
+                  date=self.DATE)
+        self.assertEqual(polls, [0.01])
+        for name, content in self.read_outputs(dir_to_save).items():
+            self.assertEqual(content.endswith("// changed"), name.endswith("Client.hpp"), name)
+
+
+class BatchTestCase(CorpusTestCase):
+    """
+    Test generating of many fidl-files by generate_batch and command line
+    """
+    def test_jobs_give_same_outputs(self):
+        sequential_dir, sequential_results = self.generate("sequential")
+        parallel_dir, parallel_results = self.generate("parallel", jobs=2, write_jobs=2)
+        self.assertEqual([result.outputs for result in sequential_results],
+                         [[output.replace(parallel_dir, sequential_dir) for output in result.outputs]
+                          for result in parallel_results])
+        self.assertEqual(self.read_outputs(sequential_dir), self.read_outputs(parallel_dir))
+
+    def test_failed_file_gives_error_exit_code(self):
+        broken_file = os.path.join(self.dir_path, "Broken.fidl")
+        with open(broken_file, "w") as file:
+            file.write("package broken\ninterface Broken {\n    method get {\n")
+        for jobs in ["1", "2"]:
+            dir_to_save = os.path.join(self.dir_path, "failed" + jobs)
+            os.makedirs(dir_to_save)
+            code, stdout, stderr = self.run_main(*self.fidl_files, broken_file, dir_to_save, "--default",
+                                                 "--date", self.DATE, "-j", jobs)
+            self.assertEqual(code, 1)
+            self.assertIn("error: " + broken_file, stderr)
+            self.assertIn("from " + str(len(self.fidl_files) + 1) + " fidl-files, 1 failed", stdout)
+            self.assertEqual(len(os.listdir(dir_to_save)),
+                             2 * sum(number_of_interfaces(fidl_file) for fidl_file in self.fidl_files))
+
+
+class ReproducibleTestCase(CorpusTestCase):
+    """
+    Test that generated files do not depend on time of run when SOURCE_DATE_EPOCH is set
+    """
+    def test_source_date_epoch_gives_identical_files(self):
+        from unittest import mock
+        fidl_file = os.path.join(TEST_FIDL_DIR, "HelloWorld.fidl")
+        contents = []
+        for name in ["first", "second"]:
+            dir_to_save = os.path.join(self.dir_path, "reproducible_" + name)
+            os.makedirs(dir_to_save)
+            with mock.patch.dict(os.environ, {"SOURCE_DATE_EPOCH": "1577836800"}):
+                code, _, stderr = self.run_main(fidl_file, dir_to_save, "--default", "--reproducible")
+            self.assertEqual(code, 0, stderr)
+            files = {}
+            for file_name in sorted(os.listdir(dir_to_save)):
+                with open(os.path.join(dir_to_save, file_name), "rb") as file:
+                    files[file_name] = file.read()
+            contents.append(files)
+        self.assertEqual(sorted(contents[0]), ["HelloWorld2Client.hpp", "HelloWorld2Service.hpp",
+                                              "HelloWorldClient.hpp", "HelloWorldService.hpp"])
+        self.assertEqual(contents[0], contents[1])
+        for content in contents[0].values():
+            self.assertIn(b"01 Jan 2020", content)
+
+
+class BuildIntegrationTestCase(CorpusTestCase):
+    """
+    Test depfile and --list-outputs used by build systems
+    """
+    def test_depfile_has_rule_per_output(self):
+        dir_to_save = os.path.join(self.dir_path, "depfile")
+        os.makedirs(dir_to_save)
+        depfile = os.path.join(self.dir_path, "wrappers.d")
+        code, _, stderr = self.run_main(os.path.join(TEST_FIDL_DIR, "HelloWorld.fidl"), dir_to_save, "--default",
+                                        "--date", self.DATE, "--depfile", depfile)
+        self.assertEqual(code, 0, stderr)
+        dependencies = " \\\n  ".join([os.path.join(TEST_FIDL_DIR, "HelloWorld.fidl"),
+                                        os.path.join(TEST_FIDL_DIR, "MyBestTypes.fidl"),
+                                        os.path.join(TEST_FIDL_DIR, "MyNewTypes.fidl")] + self.templates)
+        expected = "".join(os.path.join(dir_to_save, name) + ": " + dependencies + "\n"
+                           for name in ["HelloWorldClient.hpp", "HelloWorld2Client.hpp",
+                                        "HelloWorldService.hpp", "HelloWorld2Service.hpp"])
+        with open(depfile) as file:
+            self.assertEqual(file.read(), expected)
+
+    def test_list_outputs_match_generated_files(self):
+        dir_to_save = os.path.join(self.dir_path, "list_outputs")
+        os.makedirs(dir_to_save)
+        code, stdout, stderr = self.run_main(*self.fidl_files, dir_to_save, "--default", "--list-outputs")
+        self.assertEqual(code, 0, stderr)
+        self.assertEqual(os.listdir(dir_to_save), [])
+        _, results = self.generate("list_outputs")
+        self.assertEqual(stdout.splitlines(), [output for result in results for output in result.outputs])
+
+
+class RunStatsTestCase(CorpusTestCase):
+    """
+    Test --stats report and --profile dump
+    """
+    def run_with(self, name, *options):
+        dir_to_save = os.path.join(self.dir_path, name)
+        os.makedirs(dir_to_save)
+        code, _, stderr = self.run_main(*self.fidl_files, dir_to_save, "--default", "--date", self.DATE, *options)
+        self.assertEqual(code, 0, stderr)
+
+    def assert_phases(self, phases):
+        for phase, values in phases.items():
+            self.assertEqual(sorted(values), ["calls", "items", "time"], phase)
+            self.assertIsInstance(values["time"], float)
+            self.assertGreaterEqual(values["time"], 0)
+            self.assertGreaterEqual(values["calls"], 1)
+            self.assertIsInstance(values["items"], int)
+
+    def test_stats_report_schema(self):
+        stats_file = os.path.join(self.dir_path, "stats.json")
+        self.run_with("stats", "--stats", stats_file, "--write-jobs", "2")
+        with open(stats_file) as file:
+            report = json.load(file)
+        self.assertEqual(sorted(report), ["counters", "files", "phases", "total_time", "windows", "write_throughput"])
+        self.assert_phases(report["phases"])
+        self.assertLessEqual({"generate", "parse", "resolve", "render", "write"}, report["phases"].keys())
+        num_outputs = 2 * sum(number_of_interfaces(fidl_file) for fidl_file in self.fidl_files)
+        self.assertEqual(report["phases"]["render"]["calls"], num_outputs)
+        self.assertEqual(report["phases"]["write"]["items"], num_outputs)
+        self.assertEqual(report["counters"]["fidl_files"], len(self.fidl_files))
+        self.assertEqual(report["counters"]["failed"], 0)
+        self.assertEqual(report["counters"]["outputs"], num_outputs)
+        # Imported files are parsed too, so they have their own statistics
+        self.assertLessEqual({os.path.abspath(fidl_file) for fidl_file in self.fidl_files}, report["files"].keys())
+        for fidl_file in self.fidl_files:
+            phases = report["files"][os.path.abspath(fidl_file)]
+            self.assert_phases(phases)
+            self.assertEqual(phases["generate"]["calls"], 1)
+        for phase, (start, end) in report["windows"].items():
+            self.assertLessEqual(start, end, phase)
+        self.assertEqual(sorted(report["write_throughput"]), ["bytes_per_second", "files_per_second", "wall_time"])
+
+    def test_nested_phases(self):
+        import time
+        import run_stats
+        previous_stats = run_stats.active()
+        stats = run_stats.enable()
+        try:
+            with run_stats.phase("generate", "Outer.fidl"):
+                with run_stats.phase("render") as measured:
+                    time.sleep(0.01)
+                    measured.count(3)
+                with run_stats.phase("parse", "Inner.fidl"):
+                    pass
+                self.assertEqual(stats.current_file, os.path.abspath("Outer.fidl"))
+            self.assertIsNone(stats.current_file)
+        finally:
+            if previous_stats is not None:
+                run_stats.enable(previous_stats)
+            else:
+                run_stats.disable()
+        outer = stats.files[os.path.abspath("Outer.fidl")]
+        self.assertEqual(sorted(outer), ["generate", "render"])
+        self.assertEqual(outer["render"]["items"], 3)
+        # Time of nested phase is included into time of outer one
+        self.assertGreaterEqual(outer["generate"]["time"], outer["render"]["time"])
+        self.assertGreaterEqual(outer["render"]["time"], 0.01)
+        self.assertEqual(sorted(stats.files[os.path.abspath("Inner.fidl")]), ["parse"])
+        self.assertEqual(sorted(stats.phases), ["generate", "parse", "render"])
+
+    def test_profile_dump_is_readable(self):
+        import pstats
+        profile_file = os.path.join(self.dir_path, "generator.prof")
+        self.run_with("profile", "--profile", profile_file)
+        functions = {function for _, _, function in pstats.Stats(profile_file).stats}
+        self.assertIn("generate_batch", functions)
+        self.assertIn("render_commonapi_wrappers", functions)
+
+
+class LazyInterfaceTestCase(CorpusTestCase):
+    """
+    Test that members of interfaces are parsed only when they are needed
+    """
+    def test_members_are_parsed_on_first_access(self):
+        fidl_file = os.path.join(TEST_FIDL_DIR, "Radio.fidl")
+        for engine in ENGINES:
+            with self.subTest(engine=engine):
+                with contextlib.redirect_stdout(io.StringIO()):
+                    radio, tuner = parse_interfaces(fidl_file, engine, lazy=True)
+                self.assertEqual((radio.name, radio.package_name, radio.major, radio.minor),
+                                 ("Radio", "org.example.radio", "3", "2"))
+                self.assertFalse(radio.is_loaded)
+                # Types are resolved by hook of symbol table when members are parsed
+                self.assertEqual([param.type for param in radio.methods[0].inputs],
+                                 ["uint32_t", "MyBestTypes::tPoint", "std::vector<Radio::tStation>"])
+                self.assertTrue(radio.is_loaded)
+                self.assertFalse(tuner.is_loaded)
+
+    def test_after_load_hooks(self):
+        from commonapi_types import LazyInterface, Method
+        calls = []
+
+        def loader(interface):
+            calls.append("load")
+            interface.methods = [Method("get", None)]
+            interface.broadcasts = []
+            interface.attributes = []
+            interface.types = []
+            interface.is_settable_attribute = False
+        interface = LazyInterface("Lazy", None, loader)
+        interface.after_load(lambda loaded: calls.append("first " + loaded.methods[0].name))
+        interface.after_load(lambda loaded: calls.append("second"))
+        self.assertEqual(calls, [])
+        self.assertEqual(len(interface.attributes), 0)
+        self.assertEqual(calls, ["load", "first get", "second"])
+        interface.load()
+        interface.after_load(lambda loaded: calls.append("after"))
+        self.assertEqual(calls, ["load", "first get", "second", "after"])
+
+    def test_interface_option_filters_outputs(self):
+        from workspace import Workspace
+        fidl_file = os.path.join(TEST_FIDL_DIR, "HelloWorld.fidl")
+        dir_to_save = os.path.join(self.dir_path, "interface_option")
+        os.makedirs(dir_to_save)
+        code, _, stderr = self.run_main(fidl_file, dir_to_save, "--default", "--date", self.DATE,
+                                        "--interface", "HelloWorld2")
+        self.assertEqual(code, 0, stderr)
+        self.assertEqual(sorted(os.listdir(dir_to_save)), ["HelloWorld2Client.hpp", "HelloWorld2Service.hpp"])
+        workspace = Workspace(lazy=True)
+        _, results = self.generate("interface_option", fidl_files=[fidl_file], workspace=workspace,
+                                   interface_names=frozenset(["HelloWorld2"]))
+        self.assertEqual([os.path.basename(output) for output in results[0].outputs],
+                         ["HelloWorld2Client.hpp", "HelloWorld2Service.hpp"])
+        hello_world, hello_world2 = workspace.interfaces(fidl_file)
+        self.assertFalse(hello_world.is_loaded)
+        self.assertTrue(hello_world2.is_loaded)
+
+
+class OutputWriterTestCase(CorpusTestCase):
+    """
+    Test atomic writing of generated files
+    """
+    def setUp(self):
+        self.output_dir = tempfile.mkdtemp(dir=self.dir_path)
+
+    def test_file_is_replaced_atomically(self):
+        from output_writer import write_output, OutputWriter, WRITTEN
+        path = os.path.join(self.output_dir, "Atomic.hpp")
+        for write in [write_output, lambda *args: OutputWriter(2).submit(*args).result()[0]]:
+            for only_if_changed in [False, True]:
+                with open(path, "w") as file:
+                    file.write("old")
+                os.chmod(path, 0o640)
+                with open(path) as reader:
+                    self.assertEqual(write(path, "new", only_if_changed), WRITTEN)
+                    # Reader of old file is not affected, file is replaced by other one
+                    self.assertEqual(reader.read(), "old")
+                with open(path) as file:
+                    self.assertEqual(file.read(), "new")
+                self.assertEqual(os.stat(path).st_mode & 0o777, 0o640)
+                self.assertEqual(os.listdir(self.output_dir), ["Atomic.hpp"])
+
+    def test_new_file_mode_respects_umask(self):
+        from output_writer import write_output
+        path = os.path.join(self.output_dir, "New.hpp")
+        umask = os.umask(0o022)
+        os.umask(umask)
+        write_output(path, "new")
+        self.assertEqual(os.stat(path).st_mode & 0o777, 0o666 & ~umask)
+
+    def test_unchanged_file_is_not_touched(self):
+        from output_writer import write_output, OutputWriter, WRITTEN, UNCHANGED
+        path = os.path.join(self.output_dir, "Unchanged.hpp")
+        write_output(path, "content")
+        stat = os.stat(path)
+        self.assertEqual(write_output(path, "content", only_if_changed=True), UNCHANGED)
+        with OutputWriter(2) as writer:
+            self.assertEqual(writer.submit(path, "content", True).result()[:2], (UNCHANGED, 0))
+        self.assertEqual((os.stat(path).st_ino, os.stat(path).st_mtime_ns), (stat.st_ino, stat.st_mtime_ns))
+        self.assertEqual(write_output(path, "changed", only_if_changed=True), WRITTEN)
+        self.assertNotEqual(os.stat(path).st_ino, stat.st_ino)
+
+    def test_write_error_is_raised_after_all_files_are_written(self):
+        from output_writer import OutputWriter, wait_all
+        from wrapper_generator import generate_commonapi_wrappers
+        fidl_file = os.path.join(TEST_FIDL_DIR, "HelloWorld.fidl")
+        for write_jobs in [0, 2]:
+            output_dir = tempfile.mkdtemp(dir=self.dir_path)
+            # Directory could not be replaced by generated file
+            os.mkdir(os.path.join(output_dir, "HelloWorldService.hpp"))
+            with OutputWriter(write_jobs) as writer:
+                with self.assertRaises(OSError):
+                    with contextlib.redirect_stdout(io.StringIO()):
+                        generate_commonapi_wrappers(self.templates, fidl_file, output_dir, date=self.DATE,
+                                                    writer=writer if write_jobs else None)
+            written = sorted(os.listdir(output_dir))
+            self.assertIn("HelloWorldClient.hpp", written)
+            self.assertEqual([name for name in written if name.endswith(".tmp")], [])
+        with OutputWriter(2) as writer:
+            futures = [writer.submit(os.path.join(self.output_dir, "First.hpp"), "first"),
+                       writer.submit(os.path.join(self.output_dir, "missing", "Second.hpp"), "second"),
+                       writer.submit(os.path.join(self.output_dir, "Third.hpp"), "third")]
+            wait_all(futures)
+            self.assertTrue(all(future.done() for future in futures))
+            self.assertIsInstance(futures[1].exception(), FileNotFoundError)
+        self.assertEqual(sorted(os.listdir(self.output_dir)), ["First.hpp", "Third.hpp"])
+
+
+class GeneratorServerTestCase(CorpusTestCase):
+    """
+    Test JSON-RPC protocol of generator_server and its socket
+    """
+    def serve(self, server, *requests):
+        """
+        Send requests to server through serve_stream
+        :return: List of responses
+        """
+        lines = [request if isinstance(request, str) else json.dumps(request) for request in requests]
+        output_stream = io.BytesIO()
+        server.serve_stream(io.BytesIO(("\n".join(lines) + "\n").encode("utf-8")), output_stream)
+        return [json.loads(line) for line in output_stream.getvalue().decode("utf-8").splitlines()]
+
+    def test_serve_stream(self):
+        from generator_server import GeneratorServer, PARSE_ERROR, METHOD_NOT_FOUND, INVALID_PARAMS
+        dir_to_save = os.path.join(self.dir_path, "server")
+        os.makedirs(dir_to_save)
+        argv = [os.path.join(TEST_FIDL_DIR, "HelloWorld.fidl"), dir_to_save, "--default", "--no-cache",
+                "--date", self.DATE]
+        responses = self.serve(GeneratorServer(),
+                               {"jsonrpc": "2.0", "id": 1, "method": "ping"},
+                               {"jsonrpc": "2.0", "id": 2, "method": "generate", "params": {"argv": argv}},
+                               "{not json",
+                               {"jsonrpc": "2.0", "id": 3, "method": "unknown"},
+                               {"jsonrpc": "2.0", "id": 4, "method": "generate", "params": {"argv": "wrong"}},
+                               {"jsonrpc": "2.0", "id": 5, "method": "generate",
+                                "params": {"argv": argv + ["-j", "2"]}},
+                               {"jsonrpc": "2.0", "method": "ping"},
+                               {"jsonrpc": "2.0", "id": 6, "method": "ping"},
+                               {"jsonrpc": "2.0", "id": 7, "method": "shutdown"},
+                               {"jsonrpc": "2.0", "id": 8, "method": "ping"})
+        self.assertEqual([response["id"] for response in responses], [1, 2, None, 3, 4, 5, 6, 7])
+        self.assertEqual(responses[0]["result"], {"pid": os.getpid(), "requests": 1, "fidl_files": 0})
+        generated = responses[1]["result"]
+        self.assertEqual((generated["exit_code"], generated["stderr"], generated["affected"]), (0, "", []))
+        self.assertIn("Generated 4 files", generated["stdout"])
+        self.assertEqual(sorted(os.listdir(dir_to_save)), ["HelloWorld2Client.hpp", "HelloWorld2Service.hpp",
+                                                           "HelloWorldClient.hpp", "HelloWorldService.hpp"])
+        self.assertEqual(responses[2]["error"]["code"], PARSE_ERROR)
+        self.assertEqual(responses[3]["error"]["code"], METHOD_NOT_FOUND)
+        self.assertEqual(responses[4]["error"]["code"], INVALID_PARAMS)
+        rejected = responses[5]["result"]
+        self.assertEqual(rejected["exit_code"], 2)
+        self.assertIn("--jobs could not be used through generator_server", rejected["stderr"])
+        # Parsed fidl-files are kept between requests, notification is counted too
+        self.assertEqual(responses[6]["result"], {"pid": os.getpid(), "requests": 8, "fidl_files": 3})
+        self.assertIsNone(responses[7]["result"])
+
+    def test_socket_is_private(self):
+        import socket
+        import stat
+        import threading
+        from generator_client import call
+        from generator_server import GeneratorServer, make_socket_dir, _peer_uid
+        socket_dir = os.path.join(self.dir_path, "socket")
+        socket_path = os.path.join(socket_dir, "server.sock")
+        make_socket_dir(socket_path)
+        self.assertEqual(stat.S_IMODE(os.stat(socket_dir).st_mode), 0o700)
+        server = GeneratorServer()
+        thread = threading.Thread(target=server.serve_socket, args=(socket_path,))
+        thread.start()
+        try:
+            for _ in range(100):
+                if os.path.exists(socket_path):
+                    break
+                thread.join(0.05)
+            self.assertEqual(stat.S_IMODE(os.stat(socket_path).st_mode), 0o600)
+            self.assertEqual(call(socket_path, "ping")["requests"], 1)
+        finally:
+            call(socket_path, "shutdown")
+            thread.join()
+        self.assertFalse(os.path.exists(socket_path))
+        if hasattr(socket, "SO_PEERCRED"):
+            first, second = socket.socketpair(socket.AF_UNIX)
+            with first, second:
+                self.assertEqual(_peer_uid(first), os.getuid())
+
+    def test_shared_socket_dir_is_rejected(self):
+        from generator_server import make_socket_dir
+        socket_dir = os.path.join(self.dir_path, "shared_socket")
+        os.makedirs(socket_dir)
+        os.chmod(socket_dir, 0o755)
+        with self.assertRaises(RuntimeError):
+            make_socket_dir(os.path.join(socket_dir, "server.sock"))
+
+    def test_connection_of_other_user_is_rejected(self):
+        from unittest import mock
+        import generator_server
+        unix_server = generator_server._PrivateUnixStreamServer.__new__(generator_server._PrivateUnixStreamServer)
+        with mock.patch.object(generator_server, "_peer_uid", return_value=os.getuid() + 1), \
+                contextlib.redirect_stderr(io.StringIO()):
+            self.assertFalse(unix_server.verify_request(None, None))
+        with mock.patch.object(generator_server, "_peer_uid", return_value=os.getuid()):
+            self.assertTrue(unix_server.verify_request(None, None))
+
+
+class ManifestTestCase(CorpusTestCase):
+    """
+    Test manifest of templates and fan-out generation of pairs (interface, template)
+    """
+    def write_manifest(self, name, manifest):
+        manifest_file = os.path.join(self.dir_path, name)
+        with open(manifest_file, "w") as file:
+            file.write(manifest if isinstance(manifest, str) else json.dumps(manifest))
+        return manifest_file
+
+    def make_manifest(self):
+        with open(os.path.join(self.dir_path, "Mock.jinja2"), "w") as file:
+            file.write("mock of {{ interface.name }} with {{ interface.methods | length }} methods\n")
+        return self.write_manifest("manifest.json", {"templates": [
+            {"template": self.templates[0], "output": "{interface}Client.hpp"},
+            {"template": self.templates[1], "output": "{interface}Service.hpp"},
+            {"template": "Mock.jinja2", "output": "{package_path}/mock/{interface}Mock.hpp"}]})
+
+    def read_tree(self, dir_to_save):
+        contents = {}
+        for dir_path, _, names in os.walk(dir_to_save):
+            for name in names:
+                with open(os.path.join(dir_path, name)) as file:
+                    contents[os.path.relpath(os.path.join(dir_path, name), dir_to_save)] = file.read()
+        return contents
+
+    def test_load_manifest(self):
+        from wrapper_generator import load_manifest, TemplateSpec
+        self.assertEqual(load_manifest(self.make_manifest()),
+                         [TemplateSpec(self.templates[0], "{interface}Client.hpp"),
+                          TemplateSpec(self.templates[1], "{interface}Service.hpp"),
+                          TemplateSpec(os.path.join(self.dir_path, "Mock.jinja2"),
+                                       "{package_path}/mock/{interface}Mock.hpp")])
+
+    def test_bad_manifest_is_reported(self):
+        from wrapper_generator import load_manifest
+        template = {"template": "Mock.jinja2", "output": "{interface}Mock.hpp"}
+        for manifest, message in [("{not json", "Expecting property name"),
+                                  ({}, "'templates' should be non-empty list"),
+                                  ({"templates": []}, "'templates' should be non-empty list"),
+                                  ({"templates": [{"template": "Mock.jinja2"}]},
+                                   "every template should have 'template' and 'output' strings"),
+                                  ({"templates": [{"template": "Mock.jinja2", "output": "{unknown}.hpp"}]},
+                                   "wrong output pattern '{unknown}.hpp'"),
+                                  ({"templates": [template, template]}, "output patterns should be unique")]:
+            with self.subTest(message=message):
+                manifest_file = self.write_manifest("bad.json", manifest)
+                with self.assertRaises(ValueError) as raised:
+                    load_manifest(manifest_file)
+                self.assertTrue(str(raised.exception).startswith(manifest_file + ": "), str(raised.exception))
+                self.assertIn(message, str(raised.exception))
+        code, _, stderr = self.run_main(*self.fidl_files, self.dir_path, "--manifest", manifest_file)
+        self.assertEqual(code, 2)
+        self.assertIn("error: " + manifest_file + ": output patterns should be unique", stderr)
+        with self.assertRaises(SystemExit), contextlib.redirect_stderr(io.StringIO()):
+            self.run_main(*self.fidl_files, self.dir_path, "--manifest", self.make_manifest(), "--default")
+
+    def test_fanout_generates_every_pair(self):
+        manifest_file = self.make_manifest()
+        batch_dir, _ = self.generate("batch")
+        expected = self.read_outputs(batch_dir)
+        for fidl_file in self.fidl_files:
+            with contextlib.redirect_stdout(io.StringIO()):
+                interfaces = parse_interfaces(fidl_file)
+            for interface in interfaces:
+                mock_file = os.path.join(interface.package_name.replace(".", "/"), "mock", interface.name + "Mock.hpp")
+                # jinja2 drops trailing new line of template
+                expected[mock_file] = "mock of " + interface.name + " with " + str(len(interface.methods)) + " methods"
+        for jobs in ["1", "2"]:
+            with self.subTest(jobs=jobs):
+                dir_to_save = os.path.join(self.dir_path, "fanout" + jobs)
+                os.makedirs(dir_to_save)
+                code, _, stderr = self.run_main(*self.fidl_files, dir_to_save, "--manifest", manifest_file,
+                                                "--date", self.DATE, "-j", jobs)
+                self.assertEqual(code, 0, stderr)
+                self.assertEqual(self.read_tree(dir_to_save), expected)
+                code, stdout, _ = self.run_main(*self.fidl_files, dir_to_save, "--manifest", manifest_file,
+                                                "--list-outputs")
+                self.assertEqual(sorted(os.path.relpath(output, dir_to_save) for output in stdout.splitlines()),
+                                 sorted(expected))
+
+
+class ShardingTestCase(CorpusTestCase):
+    """
+    Test splitting of generation to shards and merging of their manifests
+    """
+    def make_jobs(self, number, prefix="Interface"):
+        from sharding import ShardJob
+        # Costs are deterministic, but different
+        return [ShardJob("Jobs.fidl", prefix + str(i), "org.example." + prefix + str(i), 1024 + (i * 7919) % 20000)
+                for i in range(number)]
+
+    def test_shards_are_balanced(self):
+        from sharding import assign_shards, _LOAD_FACTOR
+        jobs = self.make_jobs(200)
+        for count in [1, 3, 8]:
+            with self.subTest(count=count):
+                loads = [0] * count
+                for job, shard in zip(jobs, assign_shards(jobs, count)):
+                    loads[shard] += job.cost
+                average = sum(loads) / count
+                self.assertLessEqual(max(loads), _LOAD_FACTOR * average + max(job.cost for job in jobs))
+                self.assertEqual(assign_shards(list(reversed(jobs)), count),
+                                 list(reversed(assign_shards(jobs, count))))
+
+    def test_added_job_moves_few_other_jobs(self):
+        from sharding import assign_shards
+        jobs = self.make_jobs(200)
+        for count in [4, 8]:
+            shards = assign_shards(jobs, count)
+            for extra in self.make_jobs(20, "Extra"):
+                with self.subTest(count=count, extra=extra.key):
+                    new_shards = assign_shards(jobs + [extra], count)
+                    moved = sum(1 for shard, new_shard in zip(shards, new_shards) if shard != new_shard)
+                    self.assertLessEqual(moved, 5)
+
+    def generate_shards(self, count):
+        """
+        Generate every shard of corpus into one directory
+        :return: List of shard manifests
+        """
+        from sharding import scan_jobs, select_shard, write_shard_manifest
+        jobs = scan_jobs(self.fidl_files)
+        manifests = []
+        for index in range(count):
+            selections = select_shard(jobs, index, count)
+            _, results = self.generate("shards", fidl_files=[fidl_file for fidl_file in self.fidl_files
+                                                             if fidl_file in selections], selections=selections)
+            manifests.append(os.path.join(self.dir_path, "shard" + str(index) + "of" + str(count) + ".json"))
+            write_shard_manifest(manifests[-1], index, count, jobs, os.path.join(self.dir_path, "shards"), results)
+        return manifests
+
+    def merge_shards(self, manifests):
+        from sharding import merge_shard_manifests
+        from wrapper_generator import list_outputs
+        dir_to_save = os.path.join(self.dir_path, "shards")
+        return merge_shard_manifests(manifests, list_outputs(self.templates, self.fidl_files, dir_to_save),
+                                     dir_to_save)
+
+    def test_shards_generate_same_outputs(self):
+        manifests = self.generate_shards(4)
+        self.assertEqual(self.merge_shards(manifests), (2 * 3 * 3, []))
+        all_dir, _ = self.generate("all")
+        self.assertEqual(self.read_outputs(os.path.join(self.dir_path, "shards")), self.read_outputs(all_dir))
+
+    def test_merge_reports_duplicate_and_missing_shards(self):
+        manifests = self.generate_shards(3)
+        with open(manifests[1]) as file:
+            missing_outputs = json.load(file)["outputs"]
+        self.assertTrue(missing_outputs)
+        merged, errors = self.merge_shards([manifests[0], manifests[0], manifests[2]])
+        self.assertIn(manifests[0] + ": shard 0 is also merged from " + manifests[0], errors)
+        self.assertIn("shard 1/3 is missing", errors)
+        for output in missing_outputs:
+            self.assertIn(output + " is not generated by any shard", errors)
+        self.assertTrue(any(error.endswith(" is generated by " + manifests[0] + " and " + manifests[0])
+                            for error in errors))
+
+    def test_merge_reports_shards_of_different_counts(self):
+        manifests = self.generate_shards(2)
+        other = self.generate_shards(3)
+        _, errors = self.merge_shards([manifests[0], other[1], other[2]])
+        self.assertIn("shards have different counts: 2, 3", errors)
+
+
+class TemplateCacheTestCase(unittest.TestCase):
+    """
+    Test that compiled templates are kept between runs and are compiled again after template is changed
+    """
+    def setUp(self):
+        import shutil
+        import wrapper_generator
+        self.dir_path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir_path)
+        self.cache_dir = os.path.join(self.dir_path, "templates")
+        self.template_file = os.path.join(self.dir_path, "Test.jinja2")
+        self.write_template("first {{ interface }}")
+        # Every new Environment is like new run of generator
+        self.addCleanup(wrapper_generator._template_environments.pop, self.cache_dir, None)
+
+    def write_template(self, source):
+        with open(self.template_file, "w") as file:
+            file.write(source)
+
+    def render_in_new_run(self, compile_allowed):
+        from unittest import mock
+        from jinja2 import Environment
+        import wrapper_generator
+        wrapper_generator._template_environments.pop(self.cache_dir, None)
+        with mock.patch.object(Environment, "compile", autospec=True,
+                               side_effect=Environment.compile) as compile_template:
+            content = wrapper_generator.get_template(self.template_file, self.cache_dir).render(interface="Hello")
+        self.assertEqual(compile_template.called, compile_allowed)
+        return content
+
+    def test_bytecode_cache_is_reused(self):
+        self.assertEqual(self.render_in_new_run(compile_allowed=True), "first Hello")
+        self.assertEqual(len(os.listdir(self.cache_dir)), 1)
+        self.assertEqual(self.render_in_new_run(compile_allowed=False), "first Hello")
+
+    def test_bytecode_cache_is_invalidated_by_changed_template(self):
+        self.assertEqual(self.render_in_new_run(compile_allowed=True), "first Hello")
+        self.write_template("second {{ interface }}")
+        self.assertEqual(self.render_in_new_run(compile_allowed=True), "second Hello")
+        self.assertEqual(self.render_in_new_run(compile_allowed=False), "second Hello")
+
+
+class ModelIRTestCase(CorpusTestCase):
+    """
+    Test that model stored in IR files is the same as parsed one
+    """
+    def test_ir_round_trip(self):
+        from model_ir import dumps_ir, loads_ir, JSON_FORMAT, BINARY_FORMAT
+        with contextlib.redirect_stdout(io.StringIO()):
+            files = [(fidl_file, parse_interfaces(fidl_file)) for fidl_file in self.fidl_files]
+        for ir_format in (JSON_FORMAT, BINARY_FORMAT):
+            with self.subTest(ir_format=ir_format):
+                loaded = loads_ir(dumps_ir(files, ir_format))
+                self.assertEqual([fidl_file for fidl_file, _ in loaded], self.fidl_files)
+                for (_, interfaces), (_, loaded_interfaces) in zip(files, loaded):
+                    self.assertEqual(describe_interfaces(interfaces), describe_interfaces(loaded_interfaces))
+                    self.assertEqual([interface.fingerprint for interface in interfaces],
+                                     [interface.fingerprint for interface in loaded_interfaces])
+
+    def test_broken_ir_is_reported(self):
+        from model_ir import loads_ir, IRFormatError, BINARY_FORMAT, dumps_ir
+        with contextlib.redirect_stdout(io.StringIO()):
+            content = dumps_ir([(self.fidl_files[0], parse_interfaces(self.fidl_files[0]))], BINARY_FORMAT)
+        for broken in [content[:len(content) // 2], b"not ir"]:
+            with self.assertRaises(IRFormatError):
+                loads_ir(broken)
+
+    def test_outputs_from_ir_are_the_same(self):
+        from fidl_parser import emit_ir
+        from wrapper_generator import generate_from_ir
+        parsed_dir, _ = self.generate("parsed")
+        for name in ["model.json", "model.ir"]:
+            with self.subTest(ir_file=name):
+                ir_file = os.path.join(self.dir_path, name)
+                with contextlib.redirect_stdout(io.StringIO()):
+                    emit_ir(self.fidl_files, ir_file)
+                ir_dir = os.path.join(self.dir_path, "from_" + name)
+                os.makedirs(ir_dir)
+                results = generate_from_ir(self.templates, [ir_file], ir_dir, date=self.DATE)
+                self.assertEqual([result.error for result in results], [None] * len(self.fidl_files))
+                self.assertEqual([result.dependencies for result in results], [[ir_file]] * len(self.fidl_files))
+                self.assertEqual(self.read_outputs(ir_dir), self.read_outputs(parsed_dir))
+
+
+class ParseTimeoutTestCase(CorpusTestCase):
+    """
+    Test time budget of parsing of one fidl-file
+    """
+    @classmethod
+    def setUpClass(cls):
+        from benchmarks import generate_corpus
+        super().setUpClass()
+        # Descent engine checks deadline once per many tokens, so file should be big enough
+        cls.big_file = generate_corpus(os.path.join(cls.dir_path, "timeout"), num_files=1, num_methods=20,
+                                       import_depth=0)[0]
+
+    def test_parse_timeout(self):
+        from fidl_tokenizer import FidlParseTimeout
+        for engine in ENGINES:
+            with self.subTest(engine=engine):
+                with self.assertRaises(FidlParseTimeout) as raised, parse_time_limit(0.0), \
+                        contextlib.redirect_stdout(io.StringIO()):
+                    parse_interfaces(self.big_file, engine)
+                self.assertEqual(raised.exception.fidl_file, self.big_file)
+                self.assertIn("exceeded time budget of 0.0 s", str(raised.exception))
+                # Budget is restored after block
+                with contextlib.redirect_stdout(io.StringIO()):
+                    self.assertTrue(parse_interfaces(self.big_file, engine))
+
+    def test_parse_timeout_is_not_shared_between_threads(self):
+        import threading
+        from fidl_tokenizer import FidlParseTimeout
+        errors = []
+
+        def parse():
+            try:
+                with contextlib.redirect_stdout(io.StringIO()):
+                    parse_interfaces(self.big_file)
+            except FidlParseTimeout as ex:
+                errors.append(ex)
+        with parse_time_limit(0.0):
+            thread = threading.Thread(target=parse)
+            thread.start()
+            thread.join()
+        self.assertEqual(errors, [])
+
+    def test_timeout_is_reported_by_batch(self):
+        from wrapper_generator import generate_batch
+        for jobs in [1, 2]:
+            with self.subTest(jobs=jobs):
+                results = validate_corpus([self.big_file, self.fidl_files[0]], jobs=jobs, parse_timeout=0.0)
+                self.assertIn("exceeded time budget", results[0]["error"])
+                self.assertIsNotNone(results[0]["error_location"])
+                dir_to_save = os.path.join(self.dir_path, "timeout" + str(jobs))
+                os.makedirs(dir_to_save)
+                results = generate_batch(self.templates, [self.big_file], dir_to_save, jobs=jobs, parse_timeout=0.0,
+                                         date=self.DATE)
+                self.assertIn(self.big_file + ":", results[0].error)
+                self.assertIn("exceeded time budget", results[0].error)
+
+
+class ParseCacheTestCase(CorpusTestCase):
+    """
+    Cache of parsed fidl-files: hits, private directory and eviction
+    """
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp(dir=self.dir_path)
+        os.rmdir(self.cache_dir)
+
+    def test_parse_cache_returns_same_model(self):
+        from parse_cache import ParseCache
+        cache = ParseCache(self.cache_dir)
+        with contextlib.redirect_stdout(io.StringIO()):
+            parsed = describe_interfaces(parse_interfaces(self.fidl_files[0], cache=cache))
+            self.assertEqual(parsed, describe_interfaces(parse_interfaces(self.fidl_files[0], cache=cache)))
+        self.assertEqual((cache.misses, cache.hits), (1, 1))
+
+    def test_new_cache_dir_is_private(self):
+        from parse_cache import ParseCache
+        cache = ParseCache(self.cache_dir)
+        cache.put("key", "value")
+        self.assertEqual(os.stat(self.cache_dir).st_mode & 0o777, 0o700)
+        self.assertEqual(cache.get("key"), "value")
+
+    def test_writable_by_others_cache_dir_is_not_used(self):
+        from parse_cache import ParseCache
+        ParseCache(self.cache_dir).put("key", "value")
+        os.chmod(self.cache_dir, 0o777)
+        cache = ParseCache(self.cache_dir)
+        with contextlib.redirect_stderr(io.StringIO()) as stderr:
+            self.assertIsNone(cache.get("key"))
+            cache.put("other", "value")
+        self.assertIn("is not used", stderr.getvalue())
+        self.assertFalse(os.path.exists(os.path.join(self.cache_dir, "other.pickle")))
+
+    def test_evict_skips_entries_removed_by_other_process(self):
+        import parse_cache
+        cache = parse_cache.ParseCache(self.cache_dir)
+        for key in ("first", "second", "third"):
+            cache.put(key, "value")
+        cache.max_size = 0
+        entries = list(os.scandir(self.cache_dir))
+        os.unlink(os.path.join(self.cache_dir, "first.pickle"))
+        scandir = parse_cache.os.scandir
+        parse_cache.os.scandir = lambda path: iter(entries)
+        try:
+            cache.evict()
+        finally:
+            parse_cache.os.scandir = scandir
+        self.assertEqual([name for name in os.listdir(self.cache_dir) if name.endswith(".pickle")], [])
+
+    def test_put_does_not_scan_cache_every_time(self):
+        import parse_cache
+        cache = parse_cache.ParseCache(self.cache_dir, max_size=20000)
+        scans = []
+        scandir = parse_cache.os.scandir
+        parse_cache.os.scandir = lambda path: scans.append(path) or scandir(path)
+        try:
+            for index in range(100):
+                cache.put("key" + str(index), "x" * 1000)
+        finally:
+            parse_cache.os.scandir = scandir
+        self.assertLess(len(scans), 30)
+        self.assertLessEqual(sum(entry.stat().st_size for entry in os.scandir(self.cache_dir)), 20000)
+
+
+HELLO_WORLD_FIDL = ("package commonapi\n"
+                    "interface HelloWorld {\n"
+                    "  version { major 1 minor 0 }\n"
+                    "  method sayHello { in { String name } out { String message } }\n"
+                    "}\n")
+
+
+class UnbalancedBracesTestCase(unittest.TestCase):
+    """
+    Both parser engines reject fidl-file with unbalanced braces instead of dropping interfaces
+    """
+    def assert_parse_error(self, source, line):
+        for engine in ENGINES:
+            with self.subTest(engine=engine):
+                with self.assertRaises(FidlParseError) as raised:
+                    parse_interfaces("Broken.fidl", engine, source=source)
+                self.assertEqual(raised.exception.fidl_file, "Broken.fidl")
+                if engine == REGEX_ENGINE:
+                    self.assertEqual(raised.exception.line, line)
+
+    def test_unterminated_interface(self):
+        self.assert_parse_error("package commonapi\n"
+                                "interface HelloWorld {\n"
+                                "  version { major 1 minor 0 }\n", 2)
+
+    def test_extra_closing_brace(self):
+        self.assert_parse_error(HELLO_WORLD_FIDL + "}\n" +
+                                "interface Other {\n"
+                                "  version { major 1 minor 0 }\n"
+                                "}\n", 6)
+
+
+class FidlSourceTestCase(unittest.TestCase):
+    """
+    Test reading of fidl-files from memory-mapped file, bytes and stdin
+    """
+    def setUp(self):
+        import shutil
+        self.dir_path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir_path)
+
+    def write_file(self, name, data):
+        path = os.path.join(self.dir_path, name)
+        with open(path, "wb") as file:
+            file.write(data)
+        return path
+
+    def test_mapped_file(self):
+        fidl_file = os.path.join(TEST_FIDL_DIR, "HelloWorld.fidl")
+        with open(fidl_file) as file:
+            self.assertEqual(read_fidl_file(fidl_file), file.read())
+        self.assertEqual(read_fidl_file(self.write_file("Empty.fidl", b"")), "")
+
+    def test_bytes_and_file_objects(self):
+        from fidl_source import read_fidl_source
+        data = HELLO_WORLD_FIDL.encode()
+        for source in [data, bytearray(data), memoryview(data), io.BytesIO(data), io.StringIO(HELLO_WORLD_FIDL),
+                       HELLO_WORLD_FIDL]:
+            with self.subTest(source=type(source).__name__):
+                self.assertEqual(read_fidl_source(source), HELLO_WORLD_FIDL)
+
+    def test_stdin(self):
+        from unittest import mock
+        stdin = io.TextIOWrapper(io.BytesIO(HELLO_WORLD_FIDL.replace("\n", "\r\n").encode()))
+        with mock.patch.object(sys, "stdin", stdin):
+            self.assertEqual(read_fidl_file("-"), HELLO_WORLD_FIDL)
+
+    def test_windows_and_old_mac_newlines(self):
+        from fidl_source import read_fidl_source
+        self.assertEqual(read_fidl_source(b"a\r\nb\rc\n\r\n"), "a\nb\nc\n\n")
+        fidl_file = os.path.join(TEST_FIDL_DIR, "HelloWorld.fidl")
+        with open(fidl_file, "rb") as file:
+            data = file.read()
+        crlf_file = self.write_file("HelloWorld.fidl", data.replace(b"\n", b"\r\n"))
+        for name in ["MyBestTypes.fidl", "MyNewTypes.fidl"]:
+            with open(os.path.join(TEST_FIDL_DIR, name), "rb") as file:
+                self.write_file(name, file.read().replace(b"\n", b"\r\n"))
+        self.assertEqual(read_fidl_file(crlf_file), data.decode())
+        for engine in ENGINES:
+            with self.subTest(engine=engine):
+                with contextlib.redirect_stdout(io.StringIO()):
+                    self.assertEqual(describe_golden(parse_interfaces(crlf_file, engine)),
+                                     describe_golden(parse_interfaces(fidl_file, engine)))
+
+
+class ValidationTestCase(unittest.TestCase):
+    """
+    Test validation of corpus and its reports on corpus with failing fidl-files
+    """
+    GHOST_FIDL = ("package p\n"
+                  "interface Ghost {\n"
+                  "  version { major 1 minor 0 }\n"
+                  "  // method ghost {\n"
+                  "  method real {\n"
+                  "  }\n"
+                  "}\n")
+    BROKEN_FIDL = ("package p\n"
+                   "interface Broken {\n"
+                   "  method get {\n")
+
+    def setUp(self):
+        import shutil
+        self.dir_path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir_path)
+        for name in os.listdir(TEST_FIDL_DIR):
+            if name.endswith(".fidl"):
+                shutil.copy(os.path.join(TEST_FIDL_DIR, name), self.dir_path)
+        for name, content in [("Ghost.fidl", self.GHOST_FIDL), ("Broken.fidl", self.BROKEN_FIDL)]:
+            with open(os.path.join(self.dir_path, name), "w") as file:
+                file.write(content)
+        self.fidl_files = sorted(os.path.join(self.dir_path, name) for name in os.listdir(self.dir_path))
+        self.ghost_file = os.path.join(self.dir_path, "Ghost.fidl")
+        self.broken_file = os.path.join(self.dir_path, "Broken.fidl")
+
+    def test_validate_corpus(self):
+        results = validate_corpus(self.fidl_files, compare_engines=True, jobs=1)
+        self.assertEqual(validate_corpus(self.fidl_files, compare_engines=True, jobs=2), results)
+        self.assertEqual([result["fidl_file"] for result in results], self.fidl_files)
+        by_file = {result["fidl_file"]: result for result in results}
+        broken = by_file.pop(self.broken_file)
+        self.assertIn("Unterminated interface", broken["error"])
+        self.assertEqual(broken["error_location"], {"line": 2, "column": 1})
+        ghost = by_file.pop(self.ghost_file)
+        self.assertIsNone(ghost["error"])
+        self.assertEqual(ghost["mismatches"], [{"interface": "Ghost", "kind": "methods", "expected": 2, "parsed": 1}])
+        self.assertEqual(ghost["parsed"], {"interfaces": 1, "methods": 1, "broadcasts": 0, "attributes": 0})
+        for result in by_file.values():
+            self.assertEqual((result["error"], result["mismatches"]), (None, []), result["fidl_file"])
+
+    def test_json_report(self):
+        results = validate_corpus(self.fidl_files, jobs=1)
+        report_file = os.path.join(self.dir_path, "report.json")
+        write_json_report(report_file, results)
+        with open(report_file) as file:
+            report = json.load(file)
+        self.assertEqual(report, {"fidl_files": len(self.fidl_files), "failed": 2, "results": results})
+
+    def test_junit_report(self):
+        results = validate_corpus(self.fidl_files, jobs=1)
+        report_file = os.path.join(self.dir_path, "junit.xml")
+        write_junit_report(report_file, results)
+        suite = ElementTree.parse(report_file).getroot()
+        self.assertEqual((suite.tag, suite.get("tests"), suite.get("failures"), suite.get("errors")),
+                         ("testsuite", str(len(self.fidl_files)), "1", "1"))
+        cases = {case.get("name"): case for case in suite.findall("testcase")}
+        self.assertEqual(sorted(cases), self.fidl_files)
+        failure, = cases.pop(self.ghost_file)
+        self.assertEqual((failure.tag, failure.get("message"), failure.text),
+                         ("failure", "interface Ghost: methods expected 2, parsed 1",
+                          "interface Ghost: methods expected 2, parsed 1"))
+        error, = cases.pop(self.broken_file)
+        self.assertEqual(error.tag, "error")
+        self.assertIn("Unterminated interface", error.get("message"))
+        for case in cases.values():
+            self.assertEqual(len(case), 0, case.get("name"))
+
+    def test_command_line_exit_code(self):
+        report_file = os.path.join(self.dir_path, "report.json")
+        completed = subprocess.run([sys.executable, os.path.abspath(__file__), self.dir_path, "-j", "1",
+                                    "--report", report_file], stdout=subprocess.PIPE, universal_newlines=True)
+        self.assertEqual(completed.returncode, 1)
+        self.assertIn(self.ghost_file + ": interface Ghost: methods expected 2, parsed 1", completed.stdout)
+        self.assertIn("len(num_of_errors) is 2", completed.stdout)
+        self.assertTrue(os.path.isfile(report_file))
+
+
+class ModelMemoryTestCase(unittest.TestCase):
+    """
+    Test slotted model classes with interned strings
+    """
+    def test_model_objects_have_no_dict(self):
+        from benchmarks import build_model
+        interface = build_model(1, num_methods=1, num_parameters=1, num_broadcasts=1, num_attributes=1)[0]
+        for value in [interface, interface.type_collections[0], interface.methods[0], interface.methods[0].inputs[0],
+                      interface.broadcasts[0], interface.attributes[0]]:
+            self.assertFalse(hasattr(value, "__dict__"), type(value).__name__)
+
+    def test_names_are_interned(self):
+        from commonapi_types import Parameter
+        first = Parameter("Hello", "Int32", "".join(["val", "ue"]), None)
+        second = Parameter("".join(["Hel", "lo"]), "".join(["Int", "32"]), "".join(["va", "lue"]), None)
+        self.assertIs(first.name, second.name)
+        self.assertIs(first.fidl_type, second.fidl_type)
+        self.assertIs(first.type, second.type)
+        self.assertIs(first.type_namespace, second.type_namespace)
+
+    def test_model_takes_less_memory_than_dict_backed_one(self):
+        from benchmarks import benchmark_model_memory
+        result = benchmark_model_memory(50)
+        self.assertLess(result["current"], result["dict_current"])
+        self.assertLess(result["dict_current"], result["uninterned_current"])
+
+
+class ImportTimeTestCase(unittest.TestCase):
+    """
+    Cold start of wrapper_generator: heavy modules are imported only when they are needed.
+    Time budget is checked only if $COMMONAPI_TOOLS_IMPORT_BUDGET_US is set, wall time is unstable on loaded machines
+    """
+    HEAVY_MODULES = ["regex", "jinja2", "multiprocessing"]
+
+    @unittest.skipUnless(os.environ.get("COMMONAPI_TOOLS_IMPORT_BUDGET_US"),
+                         "set $COMMONAPI_TOOLS_IMPORT_BUDGET_US to check import time")
+    def test_wrapper_generator_import_budget(self):
+        times = import_times("import wrapper_generator")
+        self.assertIn("wrapper_generator", times)
+        self.assertLess(times["wrapper_generator"], int(os.environ["COMMONAPI_TOOLS_IMPORT_BUDGET_US"]))
+
+    def test_heavy_modules_are_not_imported(self):
+        times = import_times("import wrapper_generator")
+        for module in self.HEAVY_MODULES:
+            self.assertNotIn(module, times)
+
+    def test_list_outputs_does_not_import_heavy_modules(self):
+        with tempfile.TemporaryDirectory() as dir_path:
+            fidl_file = os.path.join(dir_path, "HelloWorld.fidl")
+            with open(fidl_file, 'w') as file:
+                file.write("package commonapi\n"
+                           "interface HelloWorld {\n"
+                           "  version { major 1 minor 0 }\n"
+                           "  method sayHello { in { String name } out { String message } }\n"
+                           "}\n")
+            times = import_times("wrapper_generator.py", fidl_file, dir_path, "--default", "--list-outputs")
+        self.assertIn("fidl_parser", times)
+        for module in self.HEAVY_MODULES:
+            self.assertNotIn(module, times)
+
+    def test_package_init_is_lazy(self):
+        times = import_times("import sys, os; sys.path.insert(0, os.path.dirname(os.getcwd())); "
+                             "import " + os.path.basename(os.path.dirname(os.path.abspath(__file__))))
+        self.assertNotIn("fidl_parser", " ".join(times))
 
 
 if __name__ == '__main__':
-    import os
-    os.chdir(os.path.dirname(__file__))
-    current_dir = os.getcwd()
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
 
     parser = argparse.ArgumentParser()
     parser.add_argument("dir_with_fidls",
                         help="CommonAPI interface /<path>/ to *.fidl")
+    parser.add_argument("--engine",
+                        choices=ENGINES,
+                        default=REGEX_ENGINE,
+                        help="Parser engine that is used for parsing *.fidl")
+    parser.add_argument("--compare-engines",
+                        action='store_true',
+                        help="Check also that all parser engines give the same result")
+    parser.add_argument("-j", "--jobs",
+                        type=int,
+                        default=0,
+                        help="Number of worker processes, 0 means number of CPUs")
+    parser.add_argument("--parse-timeout",
+                        type=float,
+                        metavar="SECONDS",
+                        help="Time budget of parsing of one fidl file")
+    parser.add_argument("--report",
+                        help="Write JSON report of validation")
+    parser.add_argument("--junit",
+                        help="Write JUnit XML report of validation")
     args = parser.parse_args()
-    if args.dir_with_fidls:
-        fidl_files = [os.path.join(args.dir_with_fidls, file) for file in os.listdir(args.dir_with_fidls) if file.endswith(".fidl") and os.path.isfile(os.path.join(args.dir_with_fidls, file))]
-        print("fidl_files is "+str(fidl_files))
-        print("len(fidl_files) is " + str(len(fidl_files)))
-        num_handled_files = 0
-        num_of_errors = []
-        for file in fidl_files:
-            try:
-                num_interfaces = number_of_interfaces(file)
-                num_methods = number_of_methods(file)
-                num_broadcasts = number_of_broadcasts(file)
-                num_attributes = number_of_attributes(file)
-                interfaces = parse_interfaces(file)
-                interfaces_methods = 0
-                for interface in interfaces:
-                    interfaces_methods += len(interface.methods)
-                interfaces_broadcasts = 0
-                for interface in interfaces:
-                    interfaces_broadcasts += len(interface.broadcasts)
-                interfaces_attributes = 0
-                for interface in interfaces:
-                    interfaces_attributes += len(interface.attributes)
-                num_handled_files += 1
-                print("num_handled_files is "+str(num_handled_files))
-                print("num_interfaces is " + str(num_interfaces))
-                print("num_methods is " + str(num_methods))
-                print("num_broadcasts is " + str(num_broadcasts))
-                print("num_attributes is " + str(num_attributes))
-                assert num_interfaces == len(interfaces), "num_interfaces != len(interfaces)"
-                assert num_methods == interfaces_methods, "num_methods == interfaces_methods"
-                assert num_broadcasts == interfaces_broadcasts, "num_broadcasts == interfaces_broadcasts"
-                assert num_attributes == interfaces_attributes, "num_attributes == interfaces_attributes"
-            except Exception as ex:
-                print("ex is " + str(ex))
-                num_of_errors.append((file, num_interfaces, len(interfaces),
-                                            num_methods, interfaces_methods,
-                                            num_broadcasts, interfaces_broadcasts,
-                                            num_attributes, interfaces_attributes))
-        print("num_handled_files is " + str(num_handled_files))
-        print("len(num_of_errors) is " + str(len(num_of_errors)))
-        print("num_of_errors is " + str(num_of_errors))
\ No newline at end of file
+    fidl_files = sorted(os.path.join(args.dir_with_fidls, file) for file in os.listdir(args.dir_with_fidls)
+                        if file.endswith(".fidl") and isfile(os.path.join(args.dir_with_fidls, file)))
+    print("len(fidl_files) is " + str(len(fidl_files)))
+    results = validate_corpus(fidl_files, args.engine, args.compare_engines, args.jobs or None,
+                              args.parse_timeout)
+    failed = [result for result in results if result["mismatches"] or result["error"]]
+    for result in failed:
+        if result["error"]:
+            print(result["fidl_file"] + ": error: " + result["error"])
+        for mismatch in result["mismatches"]:
+            print(result["fidl_file"] + ": " + describe_mismatch(mismatch))
+    if args.report:
+        write_json_report(args.report, results)
+    if args.junit:
+        write_junit_report(args.junit, results)
+    print("num_handled_files is " + str(len(results) - len(failed)))
+    print("len(num_of_errors) is " + str(len(failed)))
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,226 @@
+import hashlib
+import os
+
+from fidl_parser import parse_fidl_file, resolve_fidl_file, REGEX_ENGINE
+from fidl_source import mapped
+from symbol_table import SymbolTable
+import run_stats
+
+
+def file_stamp(fidl_file):
+    """
+    Stamp of file content: modification time, size and hash
+    :param fidl_file: Path to file
+    :return: Tuple (mtime in ns, size, sha256 hex digest) or None if file could not be read
+    """
+    try:
+        stat = os.stat(fidl_file)
+        with mapped(fidl_file) as data:
+            return stat.st_mtime_ns, stat.st_size, hashlib.sha256(data).hexdigest()
+    except OSError:
+        return None
+
+
+def is_changed(fidl_file, stamp):
+    """
+    Check whether file was changed since stamp was taken,
+    hash is computed only if modification time or size differs
+    :param fidl_file: Path to file
+    :param stamp: Result of file_stamp
+    :return: Tuple (is_changed, actual stamp)
+    """
+    try:
+        stat = os.stat(fidl_file)
+    except OSError:
+        # File that was missing and is still missing is not changed
+        return stamp is not None, None
+    if stamp is not None and (stat.st_mtime_ns, stat.st_size) == stamp[:2]:
+        return False, stamp
+    actual = file_stamp(fidl_file)
+    return actual is None or stamp is None or actual[2] != stamp[2], actual
+
+
+class Workspace:
+    """
+    Class for holding parsed model of set of fidl-files.
+    Every fidl-file is read and parsed only once, imports are resolved by full path,
+    so files shared by many interfaces (like CommonTypes.fidl) are parsed once per workspace.
+    User types of all loaded files are kept in one SymbolTable.
+    In lazy mode members of interfaces are parsed on the first access.
+    With track_changes workspace remembers stamps of loaded files, so it could be refreshed.
+    Dropped files are re-parsed reusing their unchanged interfaces and typeCollections
+    """
+    def __init__(self, roots=None, engine=REGEX_ENGINE, cache=None, lazy=False, track_changes=False):
+        self.engine = engine
+        self.cache = cache
+        self.lazy = lazy
+        self.track_changes = track_changes
+        self._stamps = {}
+        # Documents dropped by forget, their unchanged nodes are reused on the next load
+        self._previous = {}
+        self.documents = {}
+        self._imports = {}
+        self._type_collections = {}
+        self._resolved_files = set()
+        self.symbol_table = SymbolTable()
+        if roots:
+            for root in roots:
+                self.load(root)
+
+    def load(self, fidl_file):
+        """
+        Load fidl-file and all its transitive imports into workspace
+        :param fidl_file: Path to fidl-file
+        :return: FidlDocument of fidl_file
+        """
+        fidl_file = resolve_fidl_file(fidl_file)
+        document = self.documents.get(fidl_file)
+        if document is None:
+            if self.track_changes:
+                # Stamp is taken before parsing, so change made during parsing is not missed
+                self._stamps[fidl_file] = file_stamp(fidl_file)
+            document = parse_fidl_file(fidl_file, self.engine, self.cache, self.lazy,
+                                       self._previous.pop(fidl_file, None))
+            self.documents[fidl_file] = document
+            self.symbol_table.add_document(document)
+            dir_path = os.path.dirname(fidl_file)
+            imports = [resolve_fidl_file(imported_file, dir_path) for imported_file in document.imports]
+            self._imports[fidl_file] = imports
+            for imported_file in imports:
+                self.load(imported_file)
+        return document
+
+    def imports(self, fidl_file):
+        """
+        Get files imported directly by fidl-file
+        :param fidl_file: Path to fidl-file
+        :return: List of resolved paths
+        """
+        fidl_file = resolve_fidl_file(fidl_file)
+        self.load(fidl_file)
+        return self._imports[fidl_file]
+
+    def dependencies(self, fidl_file):
+        """
+        Get all files imported by fidl-file directly or transitively
+        :param fidl_file: Path to fidl-file
+        :return: List of resolved paths in depth-first order
+        """
+        fidl_file = resolve_fidl_file(fidl_file)
+        handled_files = {fidl_file}
+        dependencies = []
+        pending = list(reversed(self.imports(fidl_file)))
+        while pending:
+            imported_file = pending.pop()
+            if imported_file in handled_files:
+                continue
+            handled_files.add(imported_file)
+            dependencies.append(imported_file)
+            pending.extend(reversed(self.imports(imported_file)))
+        return dependencies
+
+    def type_collections(self, fidl_file):
+        """
+        Get type_collections visible from fidl-file: its own and ones of transitive imports.
+        Every TypeCollection object is created once and shared between all files that see it
+        :param fidl_file: Path to fidl-file
+        :return: List of TypeCollection
+        """
+        fidl_file = resolve_fidl_file(fidl_file)
+        type_collections = self._type_collections.get(fidl_file)
+        if type_collections is None:
+            type_collections = list(self.load(fidl_file).type_collections)
+            for imported_file in self.dependencies(fidl_file):
+                type_collections.extend(self.documents[imported_file].type_collections)
+            self._type_collections[fidl_file] = type_collections
+        return type_collections
+
+    def resolve(self, fidl_file):
+        """
+        Resolve cpp types of everything declared in fidl-file, every file is resolved once
+        :param fidl_file: Path to fidl-file
+        :return: FidlDocument of fidl_file
+        """
+        fidl_file = resolve_fidl_file(fidl_file)
+        document = self.load(fidl_file)
+        if fidl_file not in self._resolved_files:
+            self._resolved_files.add(fidl_file)
+            for imported_file in self.dependencies(fidl_file):
+                self.resolve(imported_file)
+            with run_stats.phase("resolve", fidl_file):
+                type_collections = self.type_collections(fidl_file)
+                for type_collection in document.type_collections:
+                    self.symbol_table.resolve(type_collection, type_collections)
+                for interface in document.interfaces:
+                    interface.type_collections = type_collections
+                    self.symbol_table.resolve(interface, type_collections)
+        return document
+
+    def interfaces(self, fidl_file):
+        """
+        Get interfaces declared in fidl-file
+        :param fidl_file: Path to fidl-file
+        :return: List of Interface
+        """
+        return self.resolve(fidl_file).interfaces
+
+    def importers(self, fidl_files):
+        """
+        Get loaded files which import any of fidl_files directly or transitively
+        :param fidl_files: Iterable of resolved paths
+        :return: Set of resolved paths, fidl_files are not included
+        """
+        importers = {}
+        for fidl_file, imports in self._imports.items():
+            for imported_file in imports:
+                importers.setdefault(imported_file, []).append(fidl_file)
+        found = set()
+        pending = list(fidl_files)
+        while pending:
+            for importer in importers.get(pending.pop(), ()):
+                if importer not in found:
+                    found.add(importer)
+                    pending.append(importer)
+        return found.difference(fidl_files)
+
+    def forget(self, fidl_files):
+        """
+        Drop parsed model of fidl_files, they are re-parsed on the next access reusing nodes
+        which text was not changed. Files importing them are not re-parsed, only their types are resolved again
+        :param fidl_files: Iterable of paths
+        :return: Set of affected resolved paths: fidl_files known to workspace and all files importing them
+        """
+        changed = {resolve_fidl_file(fidl_file) for fidl_file in fidl_files}
+        # File which failed to parse has stamp, but does not have document
+        changed &= self.documents.keys() | self._stamps.keys()
+        affected = changed | (self.importers(changed) & self.documents.keys())
+        if not affected:
+            return affected
+        for fidl_file in changed:
+            document = self.documents.pop(fidl_file, None)
+            if document is not None:
+                self._previous[fidl_file] = document
+            self._imports.pop(fidl_file, None)
+            self._stamps.pop(fidl_file, None)
+        self._resolved_files -= affected
+        self._type_collections = {}
+        # Types of dropped files are removed and memoized resolutions are forgotten
+        self.symbol_table = SymbolTable()
+        for document in self.documents.values():
+            self.symbol_table.add_document(document)
+        return affected
+
+    def refresh(self):
+        """
+        Drop files changed on disk since they were loaded, see forget,
+        it works only with track_changes
+        :return: Set of affected resolved paths
+        """
+        changed = []
+        for fidl_file, stamp in list(self._stamps.items()):
+            is_file_changed, actual = is_changed(fidl_file, stamp)
+            if is_file_changed:
+                changed.append(fidl_file)
+            else:
+                self._stamps[fidl_file] = actual
+        return self.forget(changed)
@@ -1,62 +1,955 @@
 import argparse
 import datetime
+import glob
+import hashlib
 import itertools
+import json
+import os
+import sys
+import time
+from collections import namedtuple
 
-from jinja2 import Template
-from fidl_parser import parse_interfaces
+from fidl_parser import parse_interfaces, resolve_fidl_file, REGEX_ENGINE, ENGINES
+from fidl_tokenizer import FidlParseError, scan_interface_names, set_parse_timeout, parse_time_limit
+from fidl_source import read_fidl_file
+from parse_cache import ParseCache, DEFAULT_MAX_SIZE
+from model_ir import load_ir, IRFormatError
+from output_writer import write_output, write_now, wait_all, OutputWriter, WriteStats, DEFAULT_WRITE_JOBS, UNCHANGED
+from render_state import RenderState, STATE_FILE
+from sharding import parse_shard, scan_jobs, select_shard, write_shard_manifest, merge_shard_manifests
+from workspace import Workspace, file_stamp, is_changed
+import run_stats
 
+BatchResult = namedtuple("BatchResult", ["fidl_file", "outputs", "unchanged", "dependencies", "error", "stats",
+                                         "render_keys"],
+                         defaults=[None, None])
 
-def generate_commonapi_wrappers(templates, fidl_file, dir_to_save, wrappers_names=[]):
+TemplateSpec = namedtuple("TemplateSpec", ["template", "output"])
+
+WRAPPER_SUFFIXES = ["Client.hpp", "Service.hpp"]
+
+DEFAULT_WATCH_INTERVAL = 0.5
+
+_worker_context = None
+_template_environments = {}
+_template_auto_reload = False
+
+
+def get_template(template_file, template_cache_dir=None):
+    """
+    Load template through jinja2 Environment shared by the whole run,
+    so every template is compiled only once per process
+    :param template_file: Path to template
+    :param template_cache_dir: Optional directory for caching of compiled templates between runs
+    :return: jinja2 Template
+    """
+    # jinja2 is imported on the first render, it is the most expensive import of the generator
+    from jinja2 import Environment, FileSystemLoader, FileSystemBytecodeCache, PrefixLoader
+    environment = _template_environments.get(template_cache_dir)
+    if environment is None:
+        bytecode_cache = None
+        if template_cache_dir:
+            os.makedirs(template_cache_dir, mode=0o700, exist_ok=True)
+            bytecode_cache = FileSystemBytecodeCache(template_cache_dir)
+        # Templates are addressed as '<directory>|<name>', so same-named templates do not collide
+        environment = Environment(loader=PrefixLoader({}, delimiter="|"),
+                                  bytecode_cache=bytecode_cache,
+                                  auto_reload=_template_auto_reload)
+        _template_environments[template_cache_dir] = environment
+    dir_path, name = os.path.split(os.path.abspath(template_file))
+    if dir_path not in environment.loader.mapping:
+        environment.loader.mapping[dir_path] = FileSystemLoader(dir_path)
+    with run_stats.phase("load_template"):
+        return environment.get_template(dir_path + "|" + name)
+
+
+def set_template_auto_reload(auto_reload):
+    """
+    Check templates for changes on every use, it is needed when process outlives edits of templates
+    :param auto_reload: True to check templates for changes
+    :return: None
+    """
+    global _template_auto_reload
+    _template_auto_reload = auto_reload
+    for environment in _template_environments.values():
+        environment.auto_reload = auto_reload
+
+
+def current_date(date=None, reproducible=False):
+    """
+    Date that is placed into generated files
+    :param date: Fixed date, it has priority over everything else
+    :param reproducible: If True and SOURCE_DATE_EPOCH is not set, date is omitted
+    :return: Date string, SOURCE_DATE_EPOCH is honored if it is set
+    """
+    if date is not None:
+        return date
+    source_date_epoch = os.environ.get("SOURCE_DATE_EPOCH")
+    if source_date_epoch:
+        current_datetime = datetime.datetime.fromtimestamp(int(source_date_epoch), datetime.timezone.utc)
+    elif reproducible:
+        return ""
+    else:
+        current_datetime = datetime.datetime.now()
+    return current_datetime.strftime("%d %b %Y")
+
+
+def template_specs_of(templates):
+    """
+    Convert templates to list of TemplateSpec
+    :param templates: List of TemplateSpec, for example from manifest,
+                      or pair [CommonAPI Client template, CommonAPI Service template], None template is skipped
+    :return: List of TemplateSpec
+    """
+    if all(isinstance(template, TemplateSpec) for template in templates):
+        return list(templates)
     if len(templates) != 2:
         raise ValueError("Size of templates argument should be 2 : CommonAPI Client and CommonAPI Service")
+    return [TemplateSpec(template_file, "{interface}" + suffix)
+            for template_file, suffix in zip(templates, WRAPPER_SUFFIXES) if template_file]
+
+
+def output_name(pattern, interface_name, package_name=None):
+    """
+    Name of generated file
+    :param pattern: Pattern of output name with placeholders {interface}, {package} and {package_path},
+                    for example '{package_path}/{interface}Mock.hpp'
+    :param interface_name: Name of interface or wrapper
+    :param package_name: Package of interface
+    :return: Name of generated file relative to output directory
+    """
+    package_name = package_name or ""
+    return pattern.format(interface=interface_name, package=package_name, package_path=package_name.replace(".", "/"))
+
+
+def load_manifest(manifest_file):
+    """
+    Load manifest of templates: JSON object with list 'templates' of objects with keys
+    'template' (path to template, relative paths are resolved against directory of manifest)
+    and 'output' (pattern of output name, see output_name)
+    :param manifest_file: Path to manifest
+    :return: List of TemplateSpec
+    """
+    with open(manifest_file) as file:
+        try:
+            manifest = json.load(file)
+        except ValueError as ex:
+            raise ValueError(manifest_file + ": " + str(ex))
+    entries = manifest.get("templates") if isinstance(manifest, dict) else None
+    if not isinstance(entries, list) or not entries:
+        raise ValueError(manifest_file + ": 'templates' should be non-empty list")
+    dir_path = os.path.dirname(os.path.abspath(manifest_file))
+    template_specs = []
+    for entry in entries:
+        if not isinstance(entry, dict) or not isinstance(entry.get("template"), str) or \
+                not isinstance(entry.get("output"), str):
+            raise ValueError(manifest_file + ": every template should have 'template' and 'output' strings")
+        try:
+            output_name(entry["output"], "Interface", "package")
+        except (KeyError, IndexError, ValueError) as ex:
+            raise ValueError(manifest_file + ": wrong output pattern " + repr(entry["output"]) + ": " + str(ex))
+        template_specs.append(TemplateSpec(os.path.join(dir_path, entry["template"]), entry["output"]))
+    outputs = [template_spec.output for template_spec in template_specs]
+    if len(set(outputs)) != len(outputs):
+        raise ValueError(manifest_file + ": output patterns should be unique")
+    return template_specs
+
+
+def render_commonapi_wrappers(templates, interfaces, dir_to_save, wrappers_names=None, date="",
+                              template_cache_dir=None, render_state=None):
+    """
+    Render wrappers of interfaces without writing them
+    :param templates: Templates of CommonAPI Client and CommonAPI Service or list of TemplateSpec
+    :param interfaces: List of Interface
+    :param dir_to_save: Directory for generated files, it should end with '/'
+    :param wrappers_names: Optional names of wrappers, by default names of interfaces are used
+    :param date: Date placed into generated files
+    :param template_cache_dir: Optional directory for caching of compiled templates
+    :param render_state: Optional RenderState, files which interface fingerprint, template and date
+                         were not changed since they were generated are not rendered.
+                         Key of rendered file is remembered when the next file is requested
+    :return: Generator of (path to generated file, content) in stable order:
+             all files of the first template, then all files of the second one, in order of interfaces.
+             Content is None for file which is not rendered
+    """
+    fingerprints = None
+    if render_state is not None:
+        with run_stats.phase("fingerprint") as measured:
+            fingerprints = [interface.fingerprint for interface in interfaces]
+            measured.count(len(fingerprints))
+    for template_spec in template_specs_of(templates):
+        template = None
+        for index, (interface, wrapper_name) in enumerate(itertools.zip_longest(interfaces, wrappers_names or [])):
+            if wrapper_name is None:
+                wrapper_name = interface.name
+            output = dir_to_save + output_name(template_spec.output, wrapper_name, interface.package_name)
+            key = None
+            if fingerprints is not None:
+                key = render_state.key(fingerprints[index], template_spec.template, date)
+                if render_state.is_fresh(output, key):
+                    run_stats.count("skipped_renders")
+                    yield output, None
+                    continue
+            if template is None:
+                template = get_template(template_spec.template, template_cache_dir)
+            with run_stats.phase("render") as measured:
+                files_output = template.render(interface=interface,
+                                               date=date)
+                measured.count(len(files_output))
+            yield output, files_output
+            if key is not None:
+                render_state.update(output, key)
+
+
+def _make_output_dir(output, dir_to_save):
+    """
+    Create subdirectory of generated file if output pattern has one
+    """
+    if "/" in output[len(dir_to_save):]:
+        os.makedirs(os.path.dirname(output), exist_ok=True)
+
+
+def _interface_names_of(fidl_file, interface_names, selections):
+    """
+    Names of interfaces of fidl-file to generate
+    :param fidl_file: fidl-file
+    :param interface_names: Names of interfaces to generate in every file, None means all interfaces
+    :param selections: Optional dictionary fidl-file -> names of its interfaces to generate (or None for all),
+                       for example of one shard, see sharding.select_shard
+    :return: Names of interfaces or None for all interfaces
+    """
+    if selections is None or selections.get(fidl_file) is None:
+        return interface_names
+    return selections[fidl_file]
+
+
+def select_interfaces(interfaces, interface_names=None):
+    """
+    Select interfaces by name, members of skipped LazyInterface are never parsed
+    :param interfaces: List of Interface
+    :param interface_names: Names of interfaces to select, None means all interfaces
+    :return: List of selected Interface in the same order
+    """
+    if interface_names is None:
+        return interfaces
+    return [interface for interface in interfaces if interface.name in interface_names]
+
+
+def generate_commonapi_wrappers(templates, fidl_file, dir_to_save, wrappers_names=None, engine=REGEX_ENGINE,
+                                cache=None, workspace=None, template_cache_dir=None,
+                                only_if_changed=False, write_stats=None, date=None, interface_names=None,
+                                writer=None, interfaces=None, render_state=None):
+    templates = template_specs_of(templates)
 
     if len(dir_to_save) == 0:
         raise ValueError("dir_to_save is empty !!")
     elif dir_to_save[len(dir_to_save) - 1] != '/':
         dir_to_save += '/'
 
-    interfaces = parse_interfaces(fidl_file)
-    if len(interfaces) == 0:
-        raise ValueError("Size of interfaces is zero. No work to do man !?")
+    with run_stats.phase("generate", fidl_file):
+        if interfaces is None and workspace is not None:
+            interfaces = workspace.interfaces(fidl_file)
+        elif interfaces is None:
+            interfaces = parse_interfaces(fidl_file, engine, cache, lazy=interface_names is not None)
+        interfaces = select_interfaces(interfaces, interface_names)
+        if len(interfaces) == 0:
+            raise ValueError("Size of interfaces is zero. No work to do man !?")
 
-    current_datetime = datetime.datetime.now()
-    current_date = current_datetime.strftime("%d %b %Y")
+        # With writer next file is rendered while previous ones are being written
+        submit = writer.submit if writer is not None else write_now
+        outputs = []
+        written = []
+        futures = []
+        try:
+            for output, files_output in render_commonapi_wrappers(templates, interfaces, dir_to_save,
+                                                                  wrappers_names, current_date(date),
+                                                                  template_cache_dir, render_state):
+                outputs.append(output)
+                if files_output is None:
+                    if write_stats is not None:
+                        write_stats.add(output, UNCHANGED)
+                    continue
+                _make_output_dir(output, dir_to_save)
+                futures.append(submit(output, files_output, only_if_changed))
+                written.append(output)
+        except Exception:
+            wait_all(futures)
+            raise
+        with run_stats.phase("write_wait"):
+            for output, future in zip(written, futures):
+                try:
+                    status, size, start, end = future.result()
+                except Exception:
+                    wait_all(futures)
+                    raise
+                run_stats.add("write", end - start, 1)
+                run_stats.window("write", start, end)
+                run_stats.count("written_bytes", size)
+                if write_stats is not None:
+                    write_stats.add(output, status)
+        return outputs
 
-    if templates[0]:
-        with open(templates[0], 'r') as file:
-            lines = file.readlines()
-            lines = "".join(lines)
-            for interface, wrapper_name in itertools.zip_longest(interfaces, wrappers_names):
-                template = Template(lines)
-                files_output = template.render(interface=interface,
-                                               date=current_date)
-                if wrapper_name is None:
-                    wrapper_name = interface.name
-                with open(dir_to_save + wrapper_name + "Client.hpp", mode='w') as file_to_save:
-                    file_to_save.write(files_output)
-
-    if templates[1]:
-        with open(templates[1], 'r') as file:
-            lines = file.readlines()
-            lines = "".join(lines)
-            for interface, wrapper_name in itertools.zip_longest(interfaces, wrappers_names):
-                template = Template(lines)
-                files_output = template.render(interface=interface,
-                                               date=current_date)
-                if wrapper_name is None:
-                    wrapper_name = interface.name
-                with open(dir_to_save + wrapper_name + "Service.hpp", mode='w') as file_to_save:
-                    file_to_save.write(files_output)
 
+def collect_fidl_files(sources):
+    """
+    Collect fidl-files from list of files, directories and glob patterns
+    :param sources: List of fidl-files, directories with *.fidl or glob patterns
+    :return: List of fidl-files without duplicates, files of directory and pattern are sorted
+    """
+    fidl_files = []
+    for source in sources:
+        if os.path.isdir(source):
+            found = [os.path.join(source, name) for name in os.listdir(source)
+                     if name.endswith(".fidl") and os.path.isfile(os.path.join(source, name))]
+        elif glob.has_magic(source):
+            found = [path for path in glob.glob(source, recursive=True) if os.path.isfile(path)]
+        else:
+            found = [source]
+        fidl_files.extend(sorted(found))
+    return list(dict.fromkeys(fidl_files))
 
-if __name__ == '__main__':
-    import os
-    os.chdir(os.path.dirname(__file__))
+
+class BatchContext:
+    """
+    State of one worker of batch which is shared by its fidl-files: Workspace, so imports shared by files
+    of the worker are parsed once, writer of generated files, statistics and RenderState.
+    Sequential batch passes it to every item, worker process keeps one for its whole life
+    """
+
+    def __init__(self, engine, cache, collect_stats=False, lazy=False, write_jobs=0, workspace=None,
+                 parse_timeout=None, render_state=None):
+        """
+        :param engine: Parser engine
+        :param cache: Optional ParseCache
+        :param collect_stats: If True, statistics is collected and returned with every BatchResult
+        :param lazy: If True, members of interfaces are parsed only for generated interfaces
+        :param write_jobs: Number of threads writing generated files, 0 means that files are written synchronously
+        :param workspace: Already loaded Workspace to reuse, by default new one is created
+        :param parse_timeout: Time budget of parsing of one fidl-file in seconds, None means unlimited
+        :param render_state: Optional RenderState, keys of generated files are returned with every BatchResult
+        """
+        self.parse_timeout = parse_timeout
+        self.render_state = render_state
+        self.workspace = workspace if workspace is not None else Workspace(engine=engine, cache=cache, lazy=lazy)
+        self.stats = run_stats.enable() if collect_stats else None
+        self.writer = OutputWriter(write_jobs) if write_jobs > 0 else None
+
+    def close(self):
+        """
+        Wait for files being written and stop writer
+        :return: None
+        """
+        if self.writer is not None:
+            self.writer.close()
+
+    def generate(self, templates, fidl_file, dir_to_save, options):
+        """
+        Generate wrappers for one fidl-file of batch,
+        statistics collected by worker is attached to result
+        :return: BatchResult, errors are reported in result instead of being raised
+        """
+        with parse_time_limit(self.parse_timeout):
+            result = self._generate(templates, fidl_file, dir_to_save, options)
+        if self.render_state is not None:
+            render_keys = self.render_state.take_updates()
+            if result.error is None:
+                result = result._replace(render_keys=render_keys)
+        if self.stats is not None:
+            return result._replace(stats=self.stats.take())
+        return result
+
+    def _generate(self, templates, fidl_file, dir_to_save, options):
+        """
+        Generate wrappers for one fidl-file of batch
+        :return: BatchResult, errors are reported in result instead of being raised
+        """
+        try:
+            dependencies = [fidl_file] + self.workspace.dependencies(fidl_file)
+            if not select_interfaces(self.workspace.interfaces(fidl_file), options.get("interface_names")):
+                return BatchResult(fidl_file, [], [], dependencies, None)
+            write_stats = WriteStats()
+            outputs = generate_commonapi_wrappers(templates, fidl_file, dir_to_save,
+                                                  workspace=self.workspace,
+                                                  write_stats=write_stats,
+                                                  writer=self.writer,
+                                                  render_state=self.render_state,
+                                                  **options)
+            return BatchResult(fidl_file, outputs, write_stats.unchanged, dependencies, None)
+        except FidlParseError as ex:
+            return BatchResult(fidl_file, [], [], [], str(ex))
+        except Exception as ex:
+            return BatchResult(fidl_file, [], [], [], fidl_file + ": " + (str(ex) or type(ex).__name__))
+
+
+def _init_batch_worker(*args):
+    """
+    Initialize worker process of batch, it keeps one BatchContext for all its fidl-files
+    :param args: Arguments of BatchContext
+    :return: None
+    """
+    global _worker_context
+    _worker_context = BatchContext(*args)
+
+
+def _generate_in_worker(templates, fidl_file, dir_to_save, options):
+    """
+    Generate wrappers for one fidl-file in worker process
+    :return: BatchResult
+    """
+    return _worker_context.generate(templates, fidl_file, dir_to_save, options)
+
+
+def generate_batch(templates, fidl_files, dir_to_save, jobs=1, engine=REGEX_ENGINE, cache=None, stats=None,
+                   write_jobs=0, workspace=None, parse_timeout=None, render_state=None, selections=None, **options):
+    """
+    Generate wrappers for many fidl-files, files without interfaces are skipped
+    :param templates: Templates of CommonAPI Client and CommonAPI Service or list of TemplateSpec
+    :param fidl_files: List of fidl-files
+    :param dir_to_save: Directory for generated files
+    :param jobs: Number of worker processes, None means number of CPUs
+    :param engine: Parser engine
+    :param cache: Optional ParseCache
+    :param stats: Optional RunStats, statistics of all workers is merged into it
+    :param write_jobs: Number of threads of every worker that write generated files atomically
+                       while next files are rendered, 0 means that files are written synchronously
+    :param workspace: Optional Workspace which is reused by sequential batch, for example by generator_server
+    :param parse_timeout: Time budget of parsing of one fidl-file in seconds, parsing of file which exceeds it
+                          is aborted with FidlParseTimeout, None means unlimited
+    :param render_state: Optional RenderState, only files which interface fingerprint, template or date
+                         were changed are rendered, keys of generated files are merged into it
+    :param selections: Optional dictionary fidl-file -> names of its interfaces to generate, it overrides
+                       interface_names, for example for one shard
+    :param options: Options of generate_commonapi_wrappers: template_cache_dir, only_if_changed, date,
+                    interface_names (with them members of other interfaces are not parsed)
+    :return: List of BatchResult in the same order as fidl_files
+    """
+    lazy = options.get("interface_names") is not None or selections is not None
+    # Date is taken once, so all files of batch have the same date
+    options["date"] = current_date(options.get("date"))
+    if selections is None:
+        item_options = [options] * len(fidl_files)
+    else:
+        item_options = [dict(options, interface_names=_interface_names_of(fidl_file, options.get("interface_names"),
+                                                                          selections))
+                        for fidl_file in fidl_files]
+    if jobs is None:
+        jobs = os.cpu_count() or 1
+    jobs = min(jobs, len(fidl_files))
+    if jobs <= 1:
+        context = BatchContext(engine, cache, lazy=lazy, write_jobs=write_jobs, workspace=workspace,
+                               parse_timeout=parse_timeout, render_state=render_state)
+        previous_stats = run_stats.active()
+        if stats is not None:
+            run_stats.enable(stats)
+        try:
+            results = [context.generate(templates, fidl_file, dir_to_save, file_options)
+                       for fidl_file, file_options in zip(fidl_files, item_options)]
+            _merge_render_keys(render_state, results)
+            return results
+        finally:
+            context.close()
+            if previous_stats is not None:
+                run_stats.enable(previous_stats)
+            elif stats is not None:
+                run_stats.disable()
+    from concurrent.futures import ProcessPoolExecutor
+    # Big chunks let worker reuse parsed imports of its Workspace
+    chunksize = max(1, len(fidl_files) // (jobs * 4))
+    with ProcessPoolExecutor(max_workers=jobs,
+                             initializer=_init_batch_worker,
+                             initargs=(engine, cache, stats is not None, lazy, write_jobs, None,
+                                       parse_timeout, render_state)) as executor:
+        results = list(executor.map(_generate_in_worker,
+                                    itertools.repeat(templates),
+                                    fidl_files,
+                                    itertools.repeat(dir_to_save),
+                                    item_options,
+                                    chunksize=chunksize))
+    if stats is not None:
+        for result in results:
+            if result.stats is not None:
+                stats.merge(result.stats)
+    _merge_render_keys(render_state, results)
+    return results
+
+
+def _merge_render_keys(render_state, results):
+    """
+    Store in render_state keys of files generated without errors
+    """
+    if render_state is None:
+        return
+    for result in results:
+        if result.render_keys:
+            render_state.merge(result.render_keys)
+
+
+def _render_pair(template_file, template_cache_dir, interface, date):
+    """
+    Render one template for one interface, it is run by worker of generate_fanout
+    :return: Tuple (content, None) or (None, error message)
+    """
+    try:
+        template = get_template(template_file, template_cache_dir)
+        with run_stats.phase("render") as measured:
+            files_output = template.render(interface=interface, date=date)
+            measured.count(len(files_output))
+        return files_output, None
+    except Exception as ex:
+        return None, template_file + ": " + (str(ex) or type(ex).__name__)
+
+
+def generate_fanout(templates, fidl_files, dir_to_save, jobs=1, engine=REGEX_ENGINE, cache=None, stats=None,
+                    write_jobs=0, template_cache_dir=None, only_if_changed=False, date=None, interface_names=None,
+                    render_state=None, selections=None):
+    """
+    Generate files of any number of templates: every fidl-file is parsed once in this process,
+    then pairs (interface, template) are rendered by pool of worker processes
+    and written here while next pairs are rendered
+    :param templates: List of TemplateSpec, for example from load_manifest
+    :param fidl_files: List of fidl-files
+    :param dir_to_save: Directory for generated files
+    :param jobs: Number of worker processes that render templates, None means number of CPUs
+    :param engine: Parser engine
+    :param cache: Optional ParseCache
+    :param stats: Optional RunStats, rendering in worker processes is not accounted
+    :param write_jobs: Number of threads that write generated files, 0 means that files are written synchronously
+    :param template_cache_dir: Optional directory for caching of compiled templates
+    :param only_if_changed: Do not touch generated files which content was not changed
+    :param date: Date placed into generated files
+    :param interface_names: Names of interfaces to generate, None means all interfaces
+    :param render_state: Optional RenderState, only pairs which interface fingerprint, template or date
+                         were changed are rendered, keys of generated files are merged into it
+    :param selections: Optional dictionary fidl-file -> names of its interfaces to generate, it overrides
+                       interface_names, for example for one shard
+    :return: List of BatchResult in the same order as fidl_files
+    """
+    template_specs = template_specs_of(templates)
+    if not dir_to_save.endswith('/'):
+        dir_to_save += '/'
+    date = current_date(date)
+    previous_stats = run_stats.active()
+    if stats is not None:
+        run_stats.enable(stats)
+    try:
+        workspace = Workspace(engine=engine, cache=cache, lazy=interface_names is not None or selections is not None)
+        results = []
+        # Every pair is (index of result, generated file, template, interface, render key)
+        pairs = []
+        for fidl_file in fidl_files:
+            try:
+                with run_stats.phase("generate", fidl_file):
+                    interfaces = select_interfaces(workspace.interfaces(fidl_file),
+                                                   _interface_names_of(fidl_file, interface_names, selections))
+                dependencies = [fidl_file] + workspace.dependencies(fidl_file)
+            except FidlParseError as ex:
+                results.append(BatchResult(fidl_file, [], [], [], str(ex)))
+                continue
+            except Exception as ex:
+                results.append(BatchResult(fidl_file, [], [], [], fidl_file + ": " + (str(ex) or type(ex).__name__)))
+                continue
+            outputs = []
+            unchanged = []
+            fingerprints = [interface.fingerprint for interface in interfaces] if render_state is not None else None
+            for template_spec in template_specs:
+                for index, interface in enumerate(interfaces):
+                    output = dir_to_save + output_name(template_spec.output, interface.name, interface.package_name)
+                    outputs.append(output)
+                    key = None
+                    if fingerprints is not None:
+                        key = render_state.key(fingerprints[index], template_spec.template, date)
+                        if render_state.is_fresh(output, key):
+                            run_stats.count("skipped_renders")
+                            unchanged.append(output)
+                            continue
+                    pairs.append((len(results), output, template_spec.template, interface, key))
+            results.append(BatchResult(fidl_file, outputs, unchanged, dependencies, None))
+        if jobs is None:
+            jobs = os.cpu_count() or 1
+        jobs = min(jobs, len(pairs))
+        executor = None
+        if jobs <= 1:
+            rendered = (_render_pair(template_file, template_cache_dir, interface, date)
+                        for _, _, template_file, interface, _ in pairs)
+        else:
+            from concurrent.futures import ProcessPoolExecutor
+            executor = ProcessPoolExecutor(max_workers=jobs)
+            rendered = executor.map(_render_pair,
+                                    [template_file for _, _, template_file, _, _ in pairs],
+                                    itertools.repeat(template_cache_dir),
+                                    [interface for _, _, _, interface, _ in pairs],
+                                    itertools.repeat(date),
+                                    chunksize=max(1, len(pairs) // (jobs * 4)))
+        errors = {}
+        written = []
+        try:
+            with OutputWriter(write_jobs) as writer:
+                for (index, output, _, _, key), (files_output, error) in zip(pairs, rendered):
+                    if error is not None:
+                        errors.setdefault(index, error)
+                        continue
+                    try:
+                        _make_output_dir(output, dir_to_save)
+                        written.append((index, output, key, writer.submit(output, files_output, only_if_changed)))
+                    except Exception as ex:
+                        errors.setdefault(index, output + ": " + (str(ex) or type(ex).__name__))
+        finally:
+            if executor is not None:
+                executor.shutdown()
+        render_keys = {}
+        for index, output, key, future in written:
+            try:
+                status, size, start, end = future.result()
+            except Exception as ex:
+                errors.setdefault(index, output + ": " + (str(ex) or type(ex).__name__))
+                continue
+            run_stats.add("write", end - start, 1)
+            run_stats.window("write", start, end)
+            run_stats.count("written_bytes", size)
+            if status == UNCHANGED:
+                results[index].unchanged.append(output)
+            if key is not None:
+                render_keys.setdefault(index, {})[output] = key
+        for index, keys in render_keys.items():
+            results[index] = results[index]._replace(render_keys=keys)
+        for index, error in errors.items():
+            results[index] = results[index]._replace(outputs=[], unchanged=[], error=error, render_keys=None)
+        _merge_render_keys(render_state, results)
+        return results
+    finally:
+        if previous_stats is not None:
+            run_stats.enable(previous_stats)
+        elif stats is not None:
+            run_stats.disable()
+
+
+def generate_from_ir(templates, ir_files, dir_to_save, stats=None, write_jobs=0, render_state=None, **options):
+    """
+    Generate wrappers from IR files written by fidl_parser, nothing is parsed
+    :param templates: Templates of CommonAPI Client and CommonAPI Service or list of TemplateSpec
+    :param ir_files: List of IR files
+    :param dir_to_save: Directory for generated files
+    :param stats: Optional RunStats
+    :param write_jobs: Number of threads that write generated files, 0 means that files are written synchronously
+    :param render_state: Optional RenderState, only files which interface fingerprint, template or date
+                         were changed are rendered, keys of generated files are merged into it
+    :param options: Options of generate_commonapi_wrappers: template_cache_dir, only_if_changed, date,
+                    interface_names
+    :return: List of BatchResult, one per fidl-file stored in IR files,
+             generated files depend on IR file instead of fidl-files
+    """
+    options["date"] = current_date(options.get("date"))
+    previous_stats = run_stats.active()
+    if stats is not None:
+        run_stats.enable(stats)
+    results = []
+    try:
+        with OutputWriter(write_jobs) as writer:
+            for ir_file in ir_files:
+                try:
+                    with run_stats.phase("load_ir", ir_file):
+                        files = load_ir(ir_file)
+                except (OSError, IRFormatError) as ex:
+                    results.append(BatchResult(ir_file, [], [], [], ir_file + ": " + str(ex)))
+                    continue
+                for fidl_file, interfaces in files:
+                    if not select_interfaces(interfaces, options.get("interface_names")):
+                        results.append(BatchResult(fidl_file, [], [], [ir_file], None))
+                        continue
+                    write_stats = WriteStats()
+                    try:
+                        outputs = generate_commonapi_wrappers(templates, fidl_file, dir_to_save,
+                                                              interfaces=interfaces,
+                                                              write_stats=write_stats,
+                                                              writer=writer if write_jobs > 0 else None,
+                                                              render_state=render_state,
+                                                              **options)
+                    except Exception as ex:
+                        if render_state is not None:
+                            render_state.take_updates()
+                        results.append(BatchResult(fidl_file, [], [], [], fidl_file + ": " +
+                                                   (str(ex) or type(ex).__name__)))
+                        continue
+                    results.append(BatchResult(fidl_file, outputs, write_stats.unchanged, [ir_file], None,
+                                               render_keys=render_state.take_updates() if render_state else None))
+    finally:
+        if previous_stats is not None:
+            run_stats.enable(previous_stats)
+        elif stats is not None:
+            run_stats.disable()
+    _merge_render_keys(render_state, results)
+    return results
+
+
+def _interface_names_of_ir(ir_files):
+    """
+    Names of interfaces stored in IR files
+    :return: Generator of (package name, list of interface names), one per fidl-file stored in IR files
+    """
+    for ir_file in ir_files:
+        for fidl_file, interfaces in load_ir(ir_file):
+            yield interfaces[0].package_name if interfaces else None, [interface.name for interface in interfaces]
+
+
+def list_outputs(templates, fidl_files, dir_to_save, interface_names=None, ir=False, selections=None):
+    """
+    List files that would be generated, only package and interface headers are scanned
+    :param templates: Templates of CommonAPI Client and CommonAPI Service or list of TemplateSpec
+    :param fidl_files: List of fidl-files
+    :param dir_to_save: Directory for generated files
+    :param interface_names: Names of generated interfaces, None means all interfaces
+    :param ir: If True, fidl_files are IR files written by fidl_parser
+    :param selections: Optional dictionary fidl-file -> names of its interfaces to generate, it overrides
+                       interface_names, it is not used for IR files
+    :return: List of paths to generated files in the same order as they are generated
+    """
+    if not dir_to_save.endswith('/'):
+        dir_to_save += '/'
+    if ir:
+        scanned = ((package_name, names, interface_names)
+                   for package_name, names in _interface_names_of_ir(fidl_files))
+    else:
+        scanned = (scan_interface_names(read_fidl_file(fidl_file), fidl_file) +
+                   (_interface_names_of(fidl_file, interface_names, selections),) for fidl_file in fidl_files)
+    template_specs = template_specs_of(templates)
+    outputs = []
+    for package_name, names, selected_names in scanned:
+        if selected_names is not None:
+            names = [name for name in names if name in selected_names]
+        for template_spec in template_specs:
+            outputs.extend(dir_to_save + output_name(template_spec.output, name, package_name) for name in names)
+    return outputs
+
+
+def write_stats_report(stats_file, stats, results):
+    """
+    Write JSON report of run
+    :param stats_file: Path to report, '-' means stdout
+    :param stats: RunStats of run
+    :param results: List of BatchResult
+    :return: None
+    """
+    report = stats.report()
+    report["counters"]["fidl_files"] = len(results)
+    report["counters"]["failed"] = sum(1 for result in results if result.error is not None)
+    report["counters"]["outputs"] = sum(len(result.outputs) for result in results)
+    report["counters"]["unchanged"] = sum(len(result.unchanged) for result in results)
+    write_phase = report["phases"].get("write")
+    write_window = report["windows"].get("write")
+    if write_phase is not None and write_window is not None and write_window[1] > write_window[0]:
+        # Time of phase sums up concurrent writes, so throughput is taken over wall time from the first
+        # write to the last one
+        wall_time = write_window[1] - write_window[0]
+        report["write_throughput"] = {"wall_time": wall_time,
+                                      "files_per_second": write_phase["items"] / wall_time}
+        if "written_bytes" in report["counters"]:
+            report["write_throughput"]["bytes_per_second"] = report["counters"]["written_bytes"] / wall_time
+    content = json.dumps(report, indent=2, sort_keys=True) + "\n"
+    if stats_file == "-":
+        sys.stdout.write(content)
+    else:
+        write_output(stats_file, content)
+
+
+def _escape_make_path(path):
+    return path.replace(" ", "\\ ").replace("#", "\\#").replace("$", "$$")
+
+
+def write_depfile(depfile, results, templates):
+    """
+    Write Makefile-style depfile: generated files of every fidl-file depend on
+    the fidl-file, its transitive imports and templates.
+    Every generated file has its own rule, Ninja before 1.10 does not accept rules with many targets
+    :param depfile: Path to depfile
+    :param results: List of BatchResult
+    :param templates: Templates of CommonAPI Client and CommonAPI Service or list of TemplateSpec
+    :return: None
+    """
+    template_files = [os.path.abspath(template_spec.template) for template_spec in template_specs_of(templates)]
+    lines = []
+    for result in results:
+        if result.error is not None or not result.outputs:
+            continue
+        dependencies = [os.path.abspath(dependency) for dependency in result.dependencies] + template_files
+        dependencies = " \\\n  ".join(_escape_make_path(dependency) for dependency in dependencies)
+        lines.extend(_escape_make_path(output) + ": " + dependencies + "\n" for output in result.outputs)
+    write_output(depfile, "".join(lines), only_if_changed=True)
+
+
+def _render_digests(templates, fidl_files, dir_to_save, engine, date):
+    """
+    Render wrappers of all fidl-files from scratch without writing them
+    :return: List of (path to generated file, sha256 of content)
+    """
+    if not dir_to_save.endswith('/'):
+        dir_to_save += '/'
+    workspace = Workspace(engine=engine)
+    digests = []
+    for fidl_file in fidl_files:
+        interfaces = workspace.interfaces(fidl_file)
+        for output, files_output in render_commonapi_wrappers(templates, interfaces, dir_to_save, date=date):
+            digests.append((output, hashlib.sha256(files_output.encode('utf-8')).hexdigest()))
+    return digests
+
+
+def check_reproducible(templates, fidl_files, dir_to_save, engine=REGEX_ENGINE, date=None):
+    """
+    Render wrappers twice: in this process and in freshly spawned one (with other hash seed)
+    and compare results byte by byte
+    :param templates: Templates of CommonAPI Client and CommonAPI Service or list of TemplateSpec
+    :param fidl_files: List of fidl-files
+    :param dir_to_save: Directory for generated files
+    :param engine: Parser engine
+    :param date: Fixed date, by default SOURCE_DATE_EPOCH is used or date is omitted
+    :return: List of generated files which content or order differs between runs
+    """
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+    date = current_date(date, reproducible=True)
+    first = _render_digests(templates, fidl_files, dir_to_save, engine, date)
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as executor:
+        second = executor.submit(_render_digests, templates, fidl_files, dir_to_save, engine, date).result()
+    differences = []
+    for first_digest, second_digest in itertools.zip_longest(first, second, fillvalue=(None, None)):
+        if first_digest != second_digest:
+            differences.append(first_digest[0] or second_digest[0])
+    return differences
+
+
+def report_results(results, latency=None):
+    """
+    Print errors and summary of run
+    :param results: List of BatchResult
+    :param latency: Optional wall time of run in seconds
+    :return: Exit code
+    """
+    failed = [result for result in results if result.error is not None]
+    for result in failed:
+        print("error: " + result.error, file=sys.stderr)
+    num_outputs = sum(len(result.outputs) for result in results)
+    num_unchanged = sum(len(result.unchanged) for result in results)
+    print("Generated " + str(num_outputs) + " files (" +
+          str(num_outputs - num_unchanged) + " written, " + str(num_unchanged) + " unchanged) from " +
+          str(len(results)) + " fidl-files, " + str(len(failed)) + " failed" +
+          ("" if latency is None else " in " + format(latency * 1000, ".1f") + " ms"), flush=True)
+    return 1 if failed else 0
+
+
+def _changed_templates(template_stamps):
+    """
+    Check templates for changes and update their stamps
+    :param template_stamps: Dictionary path to template -> result of file_stamp
+    :return: True if any template was changed
+    """
+    changed = False
+    for template_file, stamp in list(template_stamps.items()):
+        is_template_changed, template_stamps[template_file] = is_changed(template_file, stamp)
+        changed = changed or is_template_changed
+    return changed
+
+
+def watch(templates, sources, dir_to_save, interval=DEFAULT_WATCH_INTERVAL, engine=REGEX_ENGINE, cache=None,
+          write_jobs=0, parse_timeout=None, render_state=None, max_cycles=None, max_polls=None, sleep=time.sleep,
+          **options):
+    """
+    Generate wrappers and regenerate them on every change of fidl-files or templates until interrupted.
+    Files are polled by modification time and size, content is hashed only if they differ,
+    so no file system notification service is needed.
+    Parsed workspace and compiled templates are kept in memory between cycles:
+    changed file is re-parsed reusing its unchanged interfaces, files importing it directly or transitively
+    are only resolved again, and only interfaces of affected files which fingerprint was changed are rendered.
+    Summary of every cycle is printed with its latency: time from the poll that found change to the last write
+    :param templates: Templates of CommonAPI Client and CommonAPI Service or list of TemplateSpec
+    :param sources: List of fidl-files, directories with *.fidl or glob patterns, new files found in them
+                    are generated too
+    :param dir_to_save: Directory for generated files
+    :param interval: Time between polls in seconds
+    :param engine: Parser engine
+    :param cache: Optional ParseCache
+    :param write_jobs: Number of threads that write generated files, 0 means that files are written synchronously
+    :param parse_timeout: Time budget of parsing of one fidl-file in seconds, None means unlimited
+    :param render_state: Optional RenderState loaded from output directory, it is saved after every cycle,
+                         by default state is kept only in memory
+    :param max_cycles: Stop after this number of generation cycles, None means until KeyboardInterrupt
+    :param max_polls: Stop after this number of polls, also polls which found no changes are counted,
+                      None means until KeyboardInterrupt
+    :param sleep: Function (seconds) -> None that waits between polls
+    :param options: Options of generate_commonapi_wrappers: template_cache_dir, only_if_changed, date,
+                    interface_names
+    :return: Exit code of the last cycle
+    """
+    set_template_auto_reload(True)
+    persistent = render_state is not None
+    if render_state is None:
+        render_state = RenderState(dir_to_save, load=False)
+    workspace = Workspace(engine=engine, cache=cache, lazy=options.get("interface_names") is not None,
+                          track_changes=True)
+    template_stamps = {template_spec.template: file_stamp(template_spec.template)
+                       for template_spec in template_specs_of(templates)}
+    fidl_files = []
+    exit_code = 0
+    cycles = 0
+    polls = 0
+    try:
+        while True:
+            started = time.perf_counter()
+            current = collect_fidl_files(sources)
+            affected = workspace.refresh()
+            if _changed_templates(template_stamps):
+                render_state.forget_templates()
+                affected_files = current
+            else:
+                known = set(fidl_files)
+                affected_files = [fidl_file for fidl_file in current
+                                  if fidl_file not in known or resolve_fidl_file(fidl_file) in affected]
+            fidl_files = current
+            if affected_files:
+                results = generate_batch(templates, affected_files, dir_to_save,
+                                         engine=engine,
+                                         cache=cache,
+                                         write_jobs=write_jobs,
+                                         workspace=workspace,
+                                         parse_timeout=parse_timeout,
+                                         render_state=render_state,
+                                         **options)
+                if persistent:
+                    render_state.save()
+                exit_code = report_results(results, time.perf_counter() - started)
+                cycles += 1
+                if max_cycles is not None and cycles >= max_cycles:
+                    break
+            polls += 1
+            if max_polls is not None and polls >= max_polls:
+                break
+            sleep(interval)
+    except KeyboardInterrupt:
+        pass
+    return exit_code
+
+
+def _shard_argument(shard):
+    try:
+        return parse_shard(shard)
+    except ValueError as ex:
+        raise argparse.ArgumentTypeError(str(ex))
+
+
+def main(argv=None, workspaces=None):
+    """
+    Command line of wrapper generator
+    :param argv: Arguments, by default sys.argv is used
+    :param workspaces: Optional dictionary (engine, lazy) -> Workspace that is kept between calls,
+                       it is used by generator_server to keep parsed fidl-files warm.
+                       Then --jobs is rejected: output of worker processes could not be returned to client
+    :return: Exit code
+    """
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
     current_dir = os.getcwd()
 
-    parser = argparse.ArgumentParser()
+    parser = argparse.ArgumentParser(prog="wrapper_generator.py")
     parser.add_argument("capi_interface",
-                        help="CommonAPI interface /<path>/<name>.fidl")
+                        nargs='+',
+                        help="CommonAPI interface /<path>/<name>.fidl, directory with *.fidl or glob pattern")
     parser.add_argument("dir_to_save",
                         help="CommonAPI /<path_to_generate>/")
     parser.add_argument("--default",
@@ -66,15 +959,252 @@ if __name__ == '__main__':
                         help="Template for generating CommonAPI Client")
     parser.add_argument("--capi_service",
                         help="Template for generating CommonAPI Service")
-    args = parser.parse_args()
+    parser.add_argument("--manifest",
+                        help="JSON manifest with any number of templates and patterns of output names, "
+                             "every fidl-file is parsed once and pairs (interface, template) are rendered "
+                             "by -j worker processes")
+    parser.add_argument("--engine",
+                        choices=ENGINES,
+                        default=REGEX_ENGINE,
+                        help="Parser engine: 'regex' (default) or linear-time 'descent'")
+    parser.add_argument("--parse-timeout",
+                        type=float,
+                        metavar="SECONDS",
+                        help="Time budget of parsing of one fidl-file, file which exceeds it "
+                             "fails with error pointing to file, line and column")
+    parser.add_argument("--no-cache",
+                        action='store_true',
+                        help="Do not use cache of parsed *.fidl files and compiled templates")
+    parser.add_argument("--cache-dir",
+                        help="Directory of cache of parsed *.fidl files and compiled templates, "
+                             "by default $COMMONAPI_TOOLS_CACHE_DIR or ~/.cache/commonapi_tools. "
+                             "It is used only if it is owned by current user and is not writable by others")
+    parser.add_argument("--cache-size",
+                        type=int,
+                        default=DEFAULT_MAX_SIZE // (1024 * 1024),
+                        help="Maximum size of cache in MiB")
+    parser.add_argument("-j", "--jobs",
+                        type=int,
+                        default=1,
+                        help="Number of worker processes, 0 means number of CPUs")
+    parser.add_argument("--write-if-changed",
+                        action='store_true',
+                        help="Do not touch generated files which content was not changed")
+    parser.add_argument("--incremental",
+                        action='store_true',
+                        help="Render only files which interface fingerprint, template or date were changed "
+                             "since the previous run into the same directory, state is kept in "
+                             "<dir_to_save>/" + STATE_FILE + ". Templates included by templates are not tracked")
+    parser.add_argument("--watch",
+                        action='store_true',
+                        help="Keep running and regenerate outputs affected by changes of *.fidl files and templates, "
+                             "files are polled by modification time and size, parsed files and compiled templates "
+                             "are kept in memory, latency of every cycle is printed")
+    parser.add_argument("--watch-interval",
+                        type=float,
+                        default=DEFAULT_WATCH_INTERVAL,
+                        metavar="SECONDS",
+                        help="Time between polls of --watch")
+    parser.add_argument("--write-jobs",
+                        type=int,
+                        default=DEFAULT_WRITE_JOBS,
+                        help="Number of threads of every worker that write generated files atomically "
+                             "while next files are rendered, 0 means synchronous writing")
+    parser.add_argument("--depfile",
+                        help="Write Makefile-style depfile with *.fidl files and templates "
+                             "on which generated files depend")
+    parser.add_argument("--list-outputs",
+                        action='store_true',
+                        help="Only print files that would be generated, nothing is parsed or written")
+    parser.add_argument("--date",
+                        help="Fixed date placed into generated files")
+    parser.add_argument("--reproducible",
+                        action='store_true',
+                        help="Generate byte-identical files across runs: date is taken from "
+                             "SOURCE_DATE_EPOCH or omitted")
+    parser.add_argument("--check-reproducible",
+                        action='store_true',
+                        help="Render files twice in different processes and check they are identical, "
+                             "nothing is written")
+    parser.add_argument("--interface",
+                        action='append',
+                        metavar="NAME",
+                        help="Generate only interface NAME, it could be repeated. "
+                             "Members of other interfaces are not parsed")
+    parser.add_argument("--ir",
+                        action='store_true',
+                        help="Inputs are IR files written by fidl_parser.py --ir, nothing is parsed")
+    parser.add_argument("--shard",
+                        type=_shard_argument,
+                        metavar="INDEX/COUNT",
+                        help="Generate only INDEX-th (from 0) of COUNT parts of (fidl-file, interface) jobs, "
+                             "parts are balanced by size of interfaces and are the same on every machine")
+    parser.add_argument("--shard-manifest",
+                        metavar="FILE",
+                        help="Write JSON manifest of files generated by --shard")
+    parser.add_argument("--merge-shards",
+                        nargs='+',
+                        metavar="MANIFEST",
+                        help="Check that manifests of all shards together cover every file "
+                             "that would be generated exactly once, nothing is generated")
+    parser.add_argument("--stats",
+                        metavar="FILE",
+                        help="Write JSON report with time and counters of every phase, "
+                             "in total and per fidl-file, '-' means stdout")
+    parser.add_argument("--profile",
+                        metavar="FILE",
+                        help="Write cProfile dump of main process, it could be read with pstats")
+    args = parser.parse_args(argv)
+    if workspaces is not None and args.jobs != 1:
+        parser.error("--jobs could not be used through generator_server")
     if args.default:
         if not args.capi_client:
             args.capi_client = os.path.join(current_dir, "CommonAPIClientDefault.hpp.jinja2")
         if not args.capi_service:
             args.capi_service = os.path.join(current_dir, "CommonAPIServiceDefault.hpp.jinja2")
-    try:
-        generate_commonapi_wrappers([args.capi_client, args.capi_service],
-                                     args.capi_interface,
-                                     args.dir_to_save)
-    except Exception as ex:
-        print("ex is " + str(ex))
+    cache = None
+    template_cache_dir = None
+    if not args.no_cache:
+        cache = ParseCache(args.cache_dir, args.cache_size * 1024 * 1024)
+        # Compiled templates are loaded as code, so they are kept only in private cache directory
+        if cache.is_usable():
+            template_cache_dir = os.path.join(cache.cache_dir, "templates")
+    if args.ir and args.check_reproducible:
+        parser.error("--check-reproducible could not be used with --ir")
+    fidl_files = args.capi_interface if args.ir else collect_fidl_files(args.capi_interface)
+    if not fidl_files:
+        print("error: no *.fidl files found in " + " ".join(args.capi_interface), file=sys.stderr)
+        return 2
+    if args.manifest:
+        if args.default or args.capi_client or args.capi_service:
+            parser.error("--manifest could not be used with --default, --capi_client or --capi_service")
+        try:
+            templates = load_manifest(args.manifest)
+        except (OSError, ValueError) as ex:
+            print("error: " + str(ex), file=sys.stderr)
+            return 2
+    else:
+        templates = [args.capi_client, args.capi_service]
+    interface_names = frozenset(args.interface) if args.interface else None
+    if args.merge_shards:
+        merged, errors = merge_shard_manifests(args.merge_shards,
+                                               list_outputs(templates, fidl_files, args.dir_to_save,
+                                                            interface_names, args.ir),
+                                               args.dir_to_save)
+        for error in errors:
+            print("error: " + error, file=sys.stderr)
+        print("Merged " + str(len(args.merge_shards)) + " shard manifests with " + str(merged) + " files, " +
+              str(len(errors)) + " errors")
+        return 1 if errors else 0
+    shard_jobs = None
+    selections = None
+    if args.shard:
+        if args.ir or args.watch or args.check_reproducible:
+            parser.error("--shard could not be used with --ir, --watch or --check-reproducible")
+        shard_jobs = scan_jobs(fidl_files, interface_names)
+        selections = select_shard(shard_jobs, *args.shard)
+        fidl_files = [fidl_file for fidl_file in fidl_files if fidl_file in selections]
+    elif args.shard_manifest:
+        parser.error("--shard-manifest could be used only with --shard")
+    if args.list_outputs:
+        for output in list_outputs(templates, fidl_files, args.dir_to_save, interface_names, args.ir, selections):
+            print(output)
+        return 0
+    if args.check_reproducible:
+        differences = check_reproducible(templates, fidl_files, args.dir_to_save, args.engine, args.date)
+        for output in differences:
+            print("error: " + output + " is not reproducible", file=sys.stderr)
+        print("Checked reproducibility of " + str(len(fidl_files)) + " fidl-files, " +
+              str(len(differences)) + " differences")
+        return 1 if differences else 0
+    # Budget is set here for parsing done in this process, workers of generate_batch get it explicitly
+    set_parse_timeout(args.parse_timeout)
+    render_state = RenderState(args.dir_to_save) if args.incremental else None
+    if args.watch:
+        if args.ir or args.stats or args.profile or args.depfile:
+            parser.error("--watch could not be used with --ir, --stats, --profile or --depfile")
+        return watch(templates,
+                     args.capi_interface,
+                     args.dir_to_save,
+                     interval=args.watch_interval,
+                     engine=args.engine,
+                     cache=cache,
+                     write_jobs=args.write_jobs,
+                     parse_timeout=args.parse_timeout,
+                     render_state=render_state,
+                     template_cache_dir=template_cache_dir,
+                     only_if_changed=args.write_if_changed,
+                     date=current_date(args.date, args.reproducible),
+                     interface_names=interface_names)
+    stats = run_stats.RunStats() if args.stats else None
+    profiler = None
+    if args.profile:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+    if args.ir:
+        results = generate_from_ir(templates,
+                                   fidl_files,
+                                   args.dir_to_save,
+                                   stats=stats,
+                                   write_jobs=args.write_jobs,
+                                   render_state=render_state,
+                                   template_cache_dir=template_cache_dir,
+                                   only_if_changed=args.write_if_changed,
+                                   date=current_date(args.date, args.reproducible),
+                                   interface_names=interface_names)
+    elif args.manifest:
+        results = generate_fanout(templates,
+                                  fidl_files,
+                                  args.dir_to_save,
+                                  jobs=args.jobs or None,
+                                  engine=args.engine,
+                                  cache=cache,
+                                  stats=stats,
+                                  write_jobs=args.write_jobs,
+                                  template_cache_dir=template_cache_dir,
+                                  only_if_changed=args.write_if_changed,
+                                  date=current_date(args.date, args.reproducible),
+                                  interface_names=interface_names,
+                                  render_state=render_state,
+                                  selections=selections)
+    else:
+        workspace = None
+        if workspaces is not None:
+            lazy = interface_names is not None
+            workspace = workspaces.get((args.engine, lazy))
+            if workspace is None:
+                workspace = Workspace(engine=args.engine, cache=cache, lazy=lazy, track_changes=True)
+                workspaces[(args.engine, lazy)] = workspace
+        results = generate_batch(templates,
+                                 fidl_files,
+                                 args.dir_to_save,
+                                 jobs=args.jobs or None,
+                                 engine=args.engine,
+                                 cache=cache,
+                                 stats=stats,
+                                 write_jobs=args.write_jobs,
+                                 workspace=workspace,
+                                 parse_timeout=args.parse_timeout,
+                                 render_state=render_state,
+                                 selections=selections,
+                                 template_cache_dir=template_cache_dir,
+                                 only_if_changed=args.write_if_changed,
+                                 date=current_date(args.date, args.reproducible),
+                                 interface_names=interface_names)
+    if render_state is not None:
+        render_state.save()
+    if profiler is not None:
+        profiler.disable()
+        profiler.dump_stats(args.profile)
+    if stats is not None:
+        write_stats_report(args.stats, stats, results)
+    if args.depfile:
+        write_depfile(args.depfile, results, templates)
+    if args.shard_manifest:
+        write_shard_manifest(args.shard_manifest, args.shard[0], args.shard[1], shard_jobs, args.dir_to_save, results)
+    return report_results(results)
+
+
+if __name__ == '__main__':
+    sys.exit(main())